@@ -12,6 +12,8 @@ interface ChatRequest {
   workspace_id: string;
   conversation_history: ChatMessage[];
   use_rag?: boolean;
+  context_tokens?: number;
+  session_id?: string;
 }
 
 interface NoteSource {
@@ -39,6 +41,17 @@ interface ChatResponse {
   };
   sources?: NoteSource[];
   citations?: Citation[];
+  session_id?: string;
+}
+
+interface StreamTiming {
+  retrieval_ms: number;
+  ttft_ms: number | null;
+  total_ms: number;
+}
+
+interface StreamDone extends ChatResponse {
+  timing: StreamTiming;
 }
 
 function authHeaders(token: string) {
@@ -54,4 +67,60 @@ export async function sendAIMessage(request: ChatRequest, token: string): Promis
   return response.data;
 }
 
-export type { ChatMessage, ChatRequest, ChatResponse, NoteSource, Citation };
\ No newline at end of file
+// Server-side chat session: the server keeps (and summarises) the history, so requests only carry session_id
+export async function createChatSession(workspaceId: string, token: string): Promise<string> {
+  const response = await axios.post<{ session_id: string }>(`${API_URL}/ai/sessions`, { workspace_id: workspaceId }, authHeaders(token));
+  return response.data.session_id;
+}
+
+// Streams /ai/chat/stream (Server-Sent Events): onToken gets each delta as it arrives,
+// the promise resolves with the final frame (full message, citations, sources, timings).
+export async function streamAIMessage(
+  request: ChatRequest,
+  token: string,
+  onToken: (delta: string) => void,
+  signal?: AbortSignal,
+): Promise<StreamDone> {
+  const response = await fetch(`${API_URL}/ai/chat/stream`, {
+    method: 'POST',
+    headers: {
+      Authorization: `Bearer ${token}`,
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+    },
+    body: JSON.stringify(request),
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`AI chat stream failed: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload.delta);
+      else if (event === 'done') return payload as StreamDone;
+      else if (event === 'error') throw new Error(payload.detail);
+    }
+  }
+  throw new Error('AI chat stream ended without a result');
+}
+
+export type { ChatMessage, ChatRequest, ChatResponse, NoteSource, Citation, StreamDone, StreamTiming };
\ No newline at end of file
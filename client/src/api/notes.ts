@@ -57,6 +57,30 @@ export async function deleteNote(noteId: string, token: string): Promise<void> {
   await axios.delete(`${API_URL}/notes/${noteId}`, authHeaders(token));
 }
 
+export interface RelatedNote {
+  id: string;
+  title: string;
+  file_name?: string | null;
+  file_type?: string | null;
+  updated_at: string | null;
+  score: number;
+}
+
+export interface RelatedNotesResult {
+  note_id: string;
+  related: RelatedNote[];
+  // true while the note's neighbours have not been computed yet
+  pending: boolean;
+}
+
+export async function getRelatedNotes(noteId: string, token: string, limit?: number): Promise<RelatedNotesResult> {
+  const res = await axios.get(`${API_URL}/notes/${noteId}/related`, {
+    ...authHeaders(token),
+    params: limit ? { limit } : undefined,
+  });
+  return res.data;
+}
+
 export interface UploadResult {
   id: string;
   title: string;
@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useEffect } from 'react';
 import ReactMarkdown from 'react-markdown';
 import { Send, Sparkles } from 'lucide-react';
 import type { Components } from 'react-markdown';
@@ -18,8 +18,12 @@ interface AIAssistantTabProps {
   handleSendAiMessage: () => void;
   isAiLoading: boolean;
   onSourceClick: (noteId: string) => void;
+  onDraftChange?: (draft: string) => void;
 }
 
+// pause in typing after which the draft question is sent for speculative retrieval
+const DRAFT_DEBOUNCE_MS = 400;
+
 type CitationMap = Map<string, Citation>;
 
 function buildMarkdownComponents(
@@ -189,7 +193,15 @@ const AIAssistantTab: React.FC<AIAssistantTabProps> = ({
   handleSendAiMessage,
   isAiLoading,
   onSourceClick,
+  onDraftChange,
 }) => {
+  useEffect(() => {
+    const draft = aiInput.trim();
+    if (!onDraftChange || !draft) return;
+    const timer = setTimeout(() => onDraftChange(draft), DRAFT_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [aiInput, onDraftChange]);
+
   return (
     <>
       <div className="flex-1 overflow-y-auto p-4">
@@ -223,7 +235,7 @@ const AIAssistantTab: React.FC<AIAssistantTabProps> = ({
             })
           )}
 
-          {isAiLoading && (
+          {isAiLoading && aiMessages[aiMessages.length - 1]?.role !== 'assistant' && (
             <div className="flex justify-start">
               <div className="rounded-lg bg-gray-700 px-3 py-2 text-sm text-gray-200">
                 <span className="flex items-center gap-2">
@@ -24,6 +24,7 @@ interface ChatPanelProps {
   handleSendAiMessage: () => void;
   isAiLoading: boolean;
   onSourceClick: (noteId: string) => void;
+  onAiDraftChange?: (draft: string) => void;
 }
 
 const ChatPanel: React.FC<ChatPanelProps> = ({
@@ -40,7 +41,8 @@ const ChatPanel: React.FC<ChatPanelProps> = ({
   setAiInput,
   handleSendAiMessage,
   isAiLoading,
-  onSourceClick
+  onSourceClick,
+  onAiDraftChange
 }) => {
   return (
     <aside className="flex w-80 flex-col border-l border-gray-700 bg-gray-800">
@@ -105,6 +107,7 @@ const ChatPanel: React.FC<ChatPanelProps> = ({
             handleSendAiMessage={handleSendAiMessage}
             isAiLoading={isAiLoading}
             onSourceClick={onSourceClick}
+            onDraftChange={onAiDraftChange}
           />
         </div>
       </div>
@@ -46,7 +46,7 @@ export default function NoteListItem({ note, isSelected, onSelect }: NoteListIte
           <p className="text-xs text-gray-500 max-h-10 overflow-hidden text-ellipsis mt-0.5">
             {isDocument 
               ? formatFileSize(note.file_size || 0)
-              : (note.content?.slice(0, 50) || 'Click to start writing')
+              : ((note.preview ?? note.content)?.slice(0, 50) || 'Click to start writing')
             }
           </p>
         </div>
@@ -2,11 +2,12 @@ import { useCallback, useEffect, useRef, useState } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 import { socketService } from '../services/socket';
+import { NoteSync } from '../services/noteSync';
 import type { ChatMessage, Note } from '../services/socket';
 import type { Citation } from '../api/ai';
 import { getWorkspace, type Workspace } from '../api/workspaces';
 import { getCollaborators, type Collaborator } from '../api/auth';
-import { sendAIMessage } from '../api/ai';
+import { streamAIMessage, createChatSession } from '../api/ai';
 import { colorForSid, computeCaretCoordinates } from '../utils/cursorHelpers.ts';
 import WorkspaceSidebar from '../components/Sidebar/WorkspaceSidebar';
 import WorkspaceHeader from '../components/Layout/WorkspaceHeader';
@@ -37,12 +38,13 @@ export default function CollaborativeNotesPage() {
   const [aiMessages, setAiMessages] = useState<Array<{ role: 'user' | 'assistant'; content: string; sources?: any[]; citations?: Citation[]; }>>([]);
   const [aiInput, setAiInput] = useState('');
   const [isAiLoading, setIsAiLoading] = useState(false);
+  const aiSessionId = useRef<string | null>(null);
   const [collaborators, setCollaborators] = useState<Collaborator[]>([]);
   const [isOwner, setIsOwner] = useState(false);
 
   const chatBottomRef = useRef<HTMLDivElement | null>(null);
-  const typingRef = useRef(false);
   const selectedNoteIdRef = useRef<string | null>(null);
+  const noteSyncRef = useRef<NoteSync | null>(null);
 
   const textareaRef = useRef<HTMLTextAreaElement | null>(null);
   const mirrorRef = useRef<HTMLDivElement | null>(null);
@@ -75,16 +77,6 @@ export default function CollaborativeNotesPage() {
       handleConnect();
     }
 
-    socketService.onNoteLiveUpdate((payload) => {
-    const { note_id, content: liveContent, title: liveTitle, sid } = payload as any;
-    if (sid === socketService.getSocketId()) return;
-    setNotes((prev) => prev.map(n => n.id === note_id ? { ...n, content: liveContent, title: liveTitle ?? n.title } : n));
-    if (selectedNoteIdRef.current === note_id && !typingRef.current) {
-      setContent(liveContent);
-      if (liveTitle !== undefined) setTitle(liveTitle);
-    }
-  });
-
   socketService.onCursorUpdate((payload) => {
     const { sid, note_id, cursor } = payload as any;
     if (!sid || note_id == null || !cursor) return;
@@ -133,22 +125,37 @@ export default function CollaborativeNotesPage() {
     setIsAiLoading(true);
 
     try {
-      const response = await sendAIMessage({
+      if (!aiSessionId.current) {
+        aiSessionId.current = await createChatSession(workspaceId, token);
+      }
+      let streamed = '';
+      const response = await streamAIMessage({
         message: userMessage,
         workspace_id: workspaceId,
-        conversation_history: aiMessages.map(m => ({ role: m.role, content: m.content }))
-      }, token);
+        conversation_history: [],
+        session_id: aiSessionId.current
+      }, token, (delta) => {
+        // Show the answer as it is generated
+        streamed += delta;
+        setAiMessages([...newMessages, { role: 'assistant', content: streamed }]);
+      });
 
-      // Add AI response to messages
+      // Replace the streamed text with the final message, now with sources and citations
       setAiMessages([...newMessages, { role: 'assistant', content: response.message, sources: response.sources, citations: response.citations }]);
     } catch (error) {
       console.error('AI chat error:', error);
+      // the session may have expired; start a fresh one on the next message
+      aiSessionId.current = null;
       setAiMessages([...newMessages, { role: 'assistant', content: 'Sorry, I encountered an error. Please try again.' }]);
     } finally {
       setIsAiLoading(false);
     }
   };
 
+  const handleAiDraftChange = useCallback((draft: string) => {
+    socketService.sendAIDraft(draft);
+  }, []);
+
   const handleSourceClick = (noteId: string) => {
     const note = notes.find(n => n.id === noteId);
     if (note) {
@@ -158,24 +165,19 @@ export default function CollaborativeNotesPage() {
 
   function handleUpdateContent(newContent: string, e?: React.ChangeEvent<HTMLTextAreaElement>) {
     setContent(newContent);
-    typingRef.current = true;
     if (selectedNote) {
       // Update the notes array and selectedNote locally for immediate feedback
       const updatedNote = { ...selectedNote, content: newContent };
       setNotes((prev) => prev.map((n) => (n.id === selectedNote.id ? updatedNote : n)));
       setSelectedNote(updatedNote);
       
-      socketService.liveUpdate(selectedNote.id, newContent, title);
+      noteSyncRef.current?.localChange(newContent);
       if (e) {
         const start = e.target.selectionStart;
         const end = e.target.selectionEnd;
         socketService.sendCursorUpdate(selectedNote.id, { start, end });
       }
     }
-    window.clearTimeout((handleUpdateContent as any)._typingTimer);
-    (handleUpdateContent as any)._typingTimer = window.setTimeout(() => {
-      typingRef.current = false;
-    }, 300);
   }
 
   function handleCursorMove(e: React.SyntheticEvent<HTMLTextAreaElement>) {
@@ -194,7 +196,7 @@ export default function CollaborativeNotesPage() {
       setNotes((prev) => prev.map((n) => (n.id === selectedNote.id ? updatedNote : n)));
       setSelectedNote(updatedNote);
       
-      socketService.liveUpdate(selectedNote.id, content, newTitle);
+      noteSyncRef.current?.setTitle(newTitle);
     }
   }
 
@@ -276,10 +278,18 @@ export default function CollaborativeNotesPage() {
         });
         setSelectedNote((prev) => prev ?? note);
       }),
-      socketService.onNoteUpdated((note) => {
+      socketService.onNoteUpdated((updated) => {
+        // the open note's text comes from its live sync, which gets the same change as an operation
+        const sync = noteSyncRef.current;
+        const note = sync && sync.noteId === updated.id ? { ...updated, content: sync.content } : updated;
         setNotes((prev) => prev.map((n) => (n.id === note.id ? note : n)));
         setSelectedNote((prev) => (prev && prev.id === note.id ? note : prev));
       }),
+      socketService.onNoteSaved(({ id, title: savedTitle, preview, updated_at }) => {
+        setNotes((prev) => prev.map((n) => (
+          n.id === id ? { ...n, title: savedTitle, preview, updated_at: updated_at ?? n.updated_at } : n
+        )));
+      }),
       socketService.onNoteDeleted(({ id }) => {
         setNotes((prev) => prev.filter((n) => n.id !== id));
         setSelectedNote((prev) => (prev && prev.id === id ? null : prev));
@@ -297,6 +307,27 @@ export default function CollaborativeNotesPage() {
     };
   }, [workspaceId]);
 
+  // Keep the open note in step with other editors (operations, not whole-content broadcasts)
+  const selectedNoteId = selectedNote && !selectedNote.is_document ? selectedNote.id : null;
+  useEffect(() => {
+    if (!selectedNoteId || !socketId) return;
+    const sync = new NoteSync(selectedNoteId, (liveContent, liveTitle) => {
+      setContent(liveContent);
+      if (liveTitle !== undefined) setTitle(liveTitle);
+      const apply = (n: Note) => (
+        n.id === selectedNoteId ? { ...n, content: liveContent, title: liveTitle ?? n.title } : n
+      );
+      setNotes((prev) => prev.map(apply));
+      setSelectedNote((prev) => (prev ? apply(prev) : prev));
+    });
+    noteSyncRef.current = sync;
+    void sync.open();
+    return () => {
+      sync.close();
+      if (noteSyncRef.current === sync) noteSyncRef.current = null;
+    };
+  }, [selectedNoteId, socketId]);
+
   // Sync when note changes
   useEffect(() => {
     if (selectedNote) {
@@ -421,6 +452,7 @@ export default function CollaborativeNotesPage() {
             handleSendAiMessage={handleSendAiMessage}
             isAiLoading={isAiLoading}
             onSourceClick={handleSourceClick}
+            onAiDraftChange={handleAiDraftChange}
           />
         </div>
       </div>
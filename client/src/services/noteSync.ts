@@ -0,0 +1,129 @@
+import { socketService } from './socket';
+import type { NoteOpAck, NoteOpPayload, NoteSnapshot } from './socket';
+import * as ot from '../utils/textOperation';
+import type { TextOperation } from '../utils/textOperation';
+
+// Keeps the open note in step with the server's live copy. Local edits are sent as
+// operations, one batch in flight at a time; edits made meanwhile are composed into the
+// next batch. Remote operations are transformed past whatever has not been acknowledged
+// yet, so both sides end up with the same text without ever resending the whole note.
+export class NoteSync {
+  readonly noteId: string;
+  private onRemoteChange: (content: string, title?: string) => void;
+  private text = '';
+  private epoch = '';
+  private revision = 0;
+  private ready = false;
+  private closed = false;
+  private sending = false;
+  // sent, waiting for the server's ack
+  private outstanding: TextOperation | null = null;
+  // made since, not sent yet
+  private pending: TextOperation | null = null;
+  private pendingTitle: string | null = null;
+  private unsubscribes: Array<() => void> = [];
+
+  constructor(noteId: string, onRemoteChange: (content: string, title?: string) => void) {
+    this.noteId = noteId;
+    this.onRemoteChange = onRemoteChange;
+  }
+
+  get content() {
+    return this.text;
+  }
+
+  async open(): Promise<NoteSnapshot | null> {
+    this.unsubscribes = [
+      socketService.onNoteOp(this.handleRemote),
+      // rooms don't survive a reconnect, and ops sent meanwhile were missed: start over
+      socketService.onReconnect(() => void this.reopen()),
+    ];
+    return this.reopen();
+  }
+
+  close() {
+    this.closed = true;
+    this.unsubscribes.forEach((unsubscribe) => unsubscribe());
+    socketService.closeNote(this.noteId);
+  }
+
+  // The editor's text changed.
+  localChange(content: string) {
+    if (!this.ready || content === this.text) return;
+    const op = ot.diff(this.text, content);
+    this.text = content;
+    this.pending = this.pending ? ot.compose(this.pending, op) : op;
+    void this.flush();
+  }
+
+  setTitle(title: string) {
+    this.pendingTitle = title;
+    void this.flush();
+  }
+
+  private async reopen(): Promise<NoteSnapshot | null> {
+    const snapshot = await socketService.openNote(this.noteId);
+    if (!snapshot || this.closed) return null;
+    this.reset(snapshot);
+    return snapshot;
+  }
+
+  private reset(snapshot: NoteSnapshot) {
+    // unacknowledged local edits are dropped; the server's copy wins
+    this.text = snapshot.content ?? '';
+    this.epoch = snapshot.epoch;
+    this.revision = snapshot.revision;
+    this.outstanding = null;
+    this.pending = null;
+    this.ready = true;
+    this.onRemoteChange(this.text, snapshot.title);
+  }
+
+  private async flush() {
+    if (!this.ready || this.sending || this.closed) return;
+    if (this.pending === null && this.pendingTitle === null) return;
+    this.sending = true;
+    this.outstanding = this.pending;
+    this.pending = null;
+    const title = this.pendingTitle;
+    this.pendingTitle = null;
+    let ack: NoteOpAck | null = null;
+    try {
+      ack = await socketService.sendNoteOp(this.noteId, {
+        epoch: this.epoch,
+        revision: this.revision,
+        ops: this.outstanding,
+        title,
+      });
+    } catch (error) {
+      console.error('Failed to send note edit', error);
+    }
+    this.sending = false;
+    if (this.closed) return;
+    if (ack?.status === 'ok') {
+      this.revision = ack.revision;
+      this.outstanding = null;
+      void this.flush();
+    } else if (ack?.status === 'resync') {
+      this.reset(ack);
+    } else {
+      void this.reopen();
+    }
+  }
+
+  private handleRemote = (data: NoteOpPayload) => {
+    if (data.note_id !== this.noteId || !this.ready) return;
+    if (data.epoch !== this.epoch) {
+      void this.reopen();
+      return;
+    }
+    if (data.ops) {
+      let op = data.ops;
+      if (this.outstanding) [this.outstanding, op] = ot.transform(this.outstanding, op);
+      if (this.pending) [this.pending, op] = ot.transform(this.pending, op);
+      this.text = ot.apply(this.text, op);
+      this.revision = data.revision;
+    }
+    this.onRemoteChange(this.text, data.title ?? undefined);
+  };
+}
@@ -1,4 +1,5 @@
 import { io, Socket } from 'socket.io-client';
+import type { TextOperation } from '../utils/textOperation';
 
 interface Note {
   id: string;
@@ -12,6 +13,8 @@ interface Note {
   file_type?: string | null;
   file_size?: number | null;
   is_document?: boolean;
+  // start of the content, sent with note_saved while someone else is editing the note
+  preview?: string;
 }
 
 interface ChatMessage {
@@ -27,6 +30,37 @@ interface CursorPayload {
   end: number;
 }
 
+interface NoteSnapshot {
+  note_id: string;
+  epoch: string;
+  revision: number;
+  content: string;
+  title: string;
+}
+
+type NoteOpAck =
+  | { status: 'ok'; revision: number }
+  | ({ status: 'resync' } & NoteSnapshot)
+  | { status: 'invalid' | 'not_found' };
+
+interface NoteOpPayload {
+  note_id: string;
+  epoch: string;
+  revision: number;
+  // null for a title-only change
+  ops: TextOperation | null;
+  title?: string | null;
+  sid?: string;
+}
+
+interface NoteSavedPayload {
+  id: string;
+  title: string;
+  preview: string;
+  revision: number;
+  updated_at: string | null;
+}
+
 class SocketService {
   private socket: Socket | null = null;
   private workspaceId: string | null = null;
@@ -98,14 +132,23 @@ class SocketService {
     });
   }
 
-  liveUpdate(noteId: string, content: string, title?: string) {
-    if (!this.workspaceId) return;
-    this.socket?.emit("note_live_update", {
-      note_id: noteId,
-      workspace_id: this.workspaceId,
-      content,
-      title
-    });
+  // Start editing a note; resolves with the snapshot to send operations against.
+  async openNote(noteId: string): Promise<NoteSnapshot | null> {
+    if (!this.workspaceId || !this.socket) return null;
+    const ack = await this.socket.emitWithAck('note_open', { note_id: noteId, workspace_id: this.workspaceId });
+    return ack?.status === 'ok' ? ack : null;
+  }
+
+  closeNote(noteId: string) {
+    this.socket?.emit('note_close', { note_id: noteId });
+  }
+
+  async sendNoteOp(
+    noteId: string,
+    op: { epoch: string; revision: number; ops: TextOperation | null; title?: string | null },
+  ): Promise<NoteOpAck | null> {
+    if (!this.workspaceId || !this.socket) return null;
+    return this.socket.emitWithAck('note_op', { note_id: noteId, workspace_id: this.workspaceId, ...op });
   }
 
   sendCursorUpdate(noteId: string, cursor: CursorPayload, selection?: any) {
@@ -129,8 +172,20 @@ class SocketService {
     return () => this.socket?.off('note_created', callback);
   }
 
-  onNoteLiveUpdate(callback: (data: { note_id: string; content: string; title?: string; sid?: string }) => void) {
-    this.socket?.on("note_live_update", callback);
+  onNoteOp(callback: (data: NoteOpPayload) => void) {
+    this.socket?.on('note_op', callback);
+    return () => this.socket?.off('note_op', callback);
+  }
+
+  onNoteSaved(callback: (data: NoteSavedPayload) => void) {
+    this.socket?.on('note_saved', callback);
+    return () => this.socket?.off('note_saved', callback);
+  }
+
+  onReconnect(callback: () => void) {
+    const handler = () => callback();
+    this.socket?.io.on('reconnect', handler);
+    return () => this.socket?.io.off('reconnect', handler);
   }
 
   onNoteUpdated(callback: (note: Note) => void) {
@@ -171,6 +226,54 @@ class SocketService {
     });
   }
 
+  // Streamed AI answer for this client only; returns an unsubscribe function.
+  askAIStream(
+    message: string,
+    conversationHistory: { role: string; content: string }[],
+    handlers: {
+      onToken: (delta: string) => void;
+      onDone: (result: any) => void;
+      onError: (detail: string) => void;
+    },
+  ) {
+    const requestId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    const onToken = (data: { request_id: string; delta: string }) => {
+      if (data.request_id === requestId) handlers.onToken(data.delta);
+    };
+    const onDone = (data: { request_id: string }) => {
+      if (data.request_id !== requestId) return;
+      cleanup();
+      handlers.onDone(data);
+    };
+    const onError = (data: { request_id: string; detail: string }) => {
+      if (data.request_id !== requestId) return;
+      cleanup();
+      handlers.onError(data.detail);
+    };
+    const cleanup = () => {
+      this.socket?.off('ai_chat_token', onToken);
+      this.socket?.off('ai_chat_done', onDone);
+      this.socket?.off('ai_chat_error', onError);
+    };
+
+    this.socket?.on('ai_chat_token', onToken);
+    this.socket?.on('ai_chat_done', onDone);
+    this.socket?.on('ai_chat_error', onError);
+    this.socket?.emit('ai_chat_stream', {
+      request_id: requestId,
+      workspace_id: this.workspaceId,
+      message,
+      conversation_history: conversationHistory,
+    });
+    return cleanup;
+  }
+
+  // Question still being typed in the AI assistant; lets the server start retrieval early.
+  sendAIDraft(draft: string) {
+    if (!this.workspaceId) return;
+    this.socket?.emit('ai_draft', { workspace_id: this.workspaceId, draft });
+  }
+
   getSocketId() {
     return this.socket?.id ?? null;
   }
@@ -190,4 +293,4 @@ class SocketService {
 }
 
 export const socketService = new SocketService();
-export type { Note, ChatMessage };
\ No newline at end of file
+export type { Note, ChatMessage, NoteSnapshot, NoteOpAck, NoteOpPayload, NoteSavedPayload };
\ No newline at end of file
@@ -0,0 +1,186 @@
+// Plain-text operations in the ot.js format, the client half of server/services/text_ot.py.
+// An operation walks the whole document: a positive number keeps that many characters,
+// a negative number deletes that many and a string is inserted. Lengths are UTF-16 code
+// units, i.e. JavaScript string lengths.
+
+export type Component = number | string;
+export type TextOperation = Component[];
+
+class Builder {
+  ops: TextOperation = [];
+
+  retain(n: number) {
+    if (n <= 0) return;
+    const last = this.ops[this.ops.length - 1];
+    if (typeof last === 'number' && last > 0) this.ops[this.ops.length - 1] = last + n;
+    else this.ops.push(n);
+  }
+
+  insert(text: string) {
+    if (!text) return;
+    const ops = this.ops;
+    const last = ops[ops.length - 1];
+    if (typeof last === 'string') {
+      ops[ops.length - 1] = last + text;
+    } else if (typeof last === 'number' && last < 0) {
+      // an insert next to a delete goes first, so equal edits have one spelling
+      const before = ops[ops.length - 2];
+      if (typeof before === 'string') ops[ops.length - 2] = before + text;
+      else ops.splice(ops.length - 1, 0, text);
+    } else {
+      ops.push(text);
+    }
+  }
+
+  delete(n: number) {
+    if (n <= 0) return;
+    const last = this.ops[this.ops.length - 1];
+    if (typeof last === 'number' && last < 0) this.ops[this.ops.length - 1] = last - n;
+    else this.ops.push(-n);
+  }
+}
+
+export function baseLength(op: TextOperation): number {
+  return op.reduce<number>((n, c) => (typeof c === 'number' ? n + Math.abs(c) : n), 0);
+}
+
+export function targetLength(op: TextOperation): number {
+  return op.reduce<number>((n, c) => (typeof c === 'string' ? n + c.length : c > 0 ? n + c : n), 0);
+}
+
+export function isNoop(op: TextOperation): boolean {
+  return op.every((c) => typeof c === 'number' && c > 0);
+}
+
+export function apply(text: string, op: TextOperation): string {
+  if (baseLength(op) !== text.length) {
+    throw new Error(`operation spans ${baseLength(op)} characters, document has ${text.length}`);
+  }
+  const parts: string[] = [];
+  let pos = 0;
+  for (const c of op) {
+    if (typeof c === 'string') {
+      parts.push(c);
+    } else if (c > 0) {
+      parts.push(text.slice(pos, pos + c));
+      pos += c;
+    } else {
+      pos -= c;
+    }
+  }
+  return parts.join('');
+}
+
+// Split n units off the front of a retain or delete: [taken, rest or null].
+function take(c: number, n: number): [number, number | null] {
+  const sign = c > 0 ? 1 : -1;
+  const rest = Math.abs(c) - n;
+  return [sign * n, rest ? sign * rest : null];
+}
+
+// Given a and b applied to the same document, [a', b'] with apply(apply(doc, a), b') === apply(apply(doc, b), a').
+// Inserts of a go first at equal positions, as on the server.
+export function transform(a: TextOperation, b: TextOperation): [TextOperation, TextOperation] {
+  if (baseLength(a) !== baseLength(b)) throw new Error('concurrent operations must apply to the same document');
+  const aPrime = new Builder();
+  const bPrime = new Builder();
+  let i = 0;
+  let j = 0;
+  let ca: Component | null = a[i++] ?? null;
+  let cb: Component | null = b[j++] ?? null;
+  while (ca !== null || cb !== null) {
+    if (typeof ca === 'string') {
+      aPrime.insert(ca);
+      bPrime.retain(ca.length);
+      ca = a[i++] ?? null;
+      continue;
+    }
+    if (typeof cb === 'string') {
+      aPrime.retain(cb.length);
+      bPrime.insert(cb);
+      cb = b[j++] ?? null;
+      continue;
+    }
+    if (ca === null || cb === null) throw new Error('concurrent operations must apply to the same document');
+    const n = Math.min(Math.abs(ca), Math.abs(cb));
+    const [takeA, restA] = take(ca, n);
+    const [takeB, restB] = take(cb, n);
+    if (takeA > 0 && takeB > 0) {
+      aPrime.retain(n);
+      bPrime.retain(n);
+    } else if (takeA < 0 && takeB > 0) {
+      aPrime.delete(n);
+    } else if (takeA > 0 && takeB < 0) {
+      bPrime.delete(n);
+    }
+    // both deleted the same text: nothing left for either to do
+    ca = restA ?? a[i++] ?? null;
+    cb = restB ?? b[j++] ?? null;
+  }
+  return [aPrime.ops, bPrime.ops];
+}
+
+// One operation with the effect of a followed by b.
+export function compose(a: TextOperation, b: TextOperation): TextOperation {
+  if (targetLength(a) !== baseLength(b)) throw new Error('the second operation must apply to the result of the first');
+  const out = new Builder();
+  let i = 0;
+  let j = 0;
+  let ca: Component | null = a[i++] ?? null;
+  let cb: Component | null = b[j++] ?? null;
+  while (ca !== null || cb !== null) {
+    if (typeof ca === 'number' && ca < 0) {
+      out.delete(-ca);
+      ca = a[i++] ?? null;
+      continue;
+    }
+    if (typeof cb === 'string') {
+      out.insert(cb);
+      cb = b[j++] ?? null;
+      continue;
+    }
+    if (ca === null || cb === null) throw new Error('the second operation must apply to the result of the first');
+    if (typeof ca === 'string') {
+      const n = Math.min(ca.length, Math.abs(cb));
+      if (cb > 0) out.insert(ca.slice(0, n));
+      ca = n < ca.length ? ca.slice(n) : a[i++] ?? null;
+      const [, restB] = take(cb, n);
+      cb = restB ?? b[j++] ?? null;
+      continue;
+    }
+    const n = Math.min(ca, Math.abs(cb));
+    const [, restA] = take(ca, n);
+    const [takeB, restB] = take(cb, n);
+    if (takeB > 0) out.retain(n);
+    else out.delete(n);
+    ca = restA ?? a[i++] ?? null;
+    cb = restB ?? b[j++] ?? null;
+  }
+  return out.ops;
+}
+
+const isHighSurrogate = (code: number) => code >= 0xd800 && code < 0xdc00;
+const isLowSurrogate = (code: number) => code >= 0xdc00 && code < 0xe000;
+
+// An operation turning oldText into newText: everything between their common prefix and suffix is replaced.
+export function diff(oldText: string, newText: string): TextOperation {
+  const limit = Math.min(oldText.length, newText.length);
+  let prefix = 0;
+  while (prefix < limit && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) prefix++;
+  // don't cut a surrogate pair in half
+  if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) prefix--;
+  let suffix = 0;
+  while (
+    suffix < limit - prefix &&
+    oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)
+  ) {
+    suffix++;
+  }
+  if (suffix > 0 && isLowSurrogate(oldText.charCodeAt(oldText.length - suffix))) suffix--;
+  const builder = new Builder();
+  builder.retain(prefix);
+  builder.insert(newText.slice(prefix, newText.length - suffix));
+  builder.delete(oldText.length - prefix - suffix);
+  builder.retain(suffix);
+  return builder.ops;
+}
@@ -0,0 +1,77 @@
+"""Recall@k vs. latency report for the IVF index against exact search.
+
+Builds synthetic workspaces of clustered unit vectors (a stand-in for real
+chunk embeddings, which are far from uniformly distributed) and sweeps nprobe.
+
+Run from the server directory:
+    python -m benchmarks.bench_ann --sizes 20000 100000 300000 --k 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+from services.ann_index import IVFVectorIndex
+from services.vector_index import VectorIndex, normalize
+
+
+def synthetic_workspace(n, dim, topics, rng):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, n)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize(vectors)
+
+
+def queries_from(vectors, count, rng):
+    picks = vectors[rng.choice(len(vectors), count, replace=False)]
+    return normalize(picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32))
+
+
+def timed_search(index, queries, k, **kwargs):
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([item_id for item_id, _ in index.search(query, k, **kwargs)])
+        timings.append(time.perf_counter() - start)
+    return results, float(np.median(timings)) * 1000, float(np.percentile(timings, 95)) * 1000
+
+
+def recall(approx, exact):
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / sum(len(e) for e in exact)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20_000, 100_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'n':>8} {'mode':>12} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for n in args.sizes:
+        vectors = synthetic_workspace(n, args.dim, topics=max(50, n // 500), rng=rng)
+        queries = queries_from(vectors, args.queries, rng)
+        ids = list(range(n))
+
+        exact_index = VectorIndex.from_vectors(ids, vectors, dim=args.dim, precision="float32")
+        exact, p50, p95 = timed_search(exact_index, queries, args.k)
+        print(f"{n:>8} {'exact':>12} {1.0:>10.3f} {p50:>8.2f} {p95:>8.2f}")
+
+        start = time.perf_counter()
+        ivf = IVFVectorIndex.from_vectors(ids, vectors, dim=args.dim, threshold=0, precision="float32")
+        train_ms = (time.perf_counter() - start) * 1000
+        for nprobe in args.nprobe:
+            approx, p50, p95 = timed_search(ivf, queries, args.k, nprobe=nprobe)
+            label = f"ivf/{nprobe}"
+            print(f"{n:>8} {label:>12} {recall(approx, exact):>10.3f} {p50:>8.2f} {p95:>8.2f}")
+        lists = f"{len(ivf._centroids)} lists"
+        print(f"{n:>8} {'build ms':>12} {lists:>10} {train_ms:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Latency, memory and retrieval quality per embedding backend.
+
+Quality is measured on a small built-in set of workspace-style notes, each
+with a paraphrased question that should retrieve it (many share few or no
+words with their note, which is where the backends differ). Each backend runs
+in its own subprocess so load time and peak RSS are not polluted by the others.
+
+Run from the server directory:
+    python -m benchmarks.bench_embedding_backends --backends sentence-transformers onnx hashing
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+NOTES = [
+    "Quarterly budget review: marketing spend is 12% over plan, travel is under.",
+    "Invoice INV-2024-001 for 4,512.50 is due on March 3rd.",
+    "The onboarding checklist covers laptop setup, VPN access and the security training.",
+    "Postgres connection pool exhausted under load; raised max_connections to 200.",
+    "Team offsite will be held in Lisbon in May, flights booked through the travel desk.",
+    "Customer churn rose after the pricing change; enterprise accounts were unaffected.",
+    "Sprint retro: standups run too long, and code review is the main bottleneck.",
+    "The mobile app crashes on launch on Android 14 when notifications are disabled.",
+    "Hiring plan: two backend engineers and one designer before the end of Q3.",
+    "GDPR request from a user asking for all personal data to be exported and deleted.",
+    "Recipe notes: sourdough needs a 12 hour cold proof for a better crust.",
+    "The landing page A/B test showed the shorter headline converted 8% better.",
+    "Server costs doubled last month because autoscaling never scaled back down.",
+    "Meeting with legal about renewing the office lease, decision needed by Friday.",
+    "User research: people want keyboard shortcuts and a dark mode in the editor.",
+    "The release is blocked until the payment provider certifies the new checkout flow.",
+]
+
+QUERIES = [
+    ("are we overspending on advertising", 0),
+    ("when is INV-2024-001 due", 1),
+    ("what does a new starter need to do in week one", 2),
+    ("database ran out of connections", 3),
+    ("where is the company retreat", 4),
+    ("why are customers leaving", 5),
+    ("what slowed the team down last sprint", 6),
+    ("android startup crash", 7),
+    ("how many people are we recruiting", 8),
+    ("privacy data deletion request", 9),
+    ("how long should bread dough rest", 10),
+    ("which headline won the experiment", 11),
+    ("why did the cloud bill go up", 12),
+    ("office rental contract", 13),
+    ("feature requests from interviews", 14),
+    ("what is holding up the launch", 15),
+]
+
+
+def load_backend(name: str):
+    if name == "sentence-transformers":
+        from sentence_transformers import SentenceTransformer
+        from services.embedding_model import SENTENCE_TRANSFORMER_MODEL
+        return SentenceTransformer(SENTENCE_TRANSFORMER_MODEL)
+    if name == "onnx":
+        from services.embedding_backends import OnnxEmbeddingModel
+        return OnnxEmbeddingModel()
+    if name == "hashing":
+        from services.embedding_backends import HashingEmbeddingModel
+        return HashingEmbeddingModel()
+    raise ValueError(f"unknown backend {name}")
+
+
+def measure(name: str, repeats: int) -> dict:
+    start = time.perf_counter()
+    model = load_backend(name)
+    load_s = time.perf_counter() - start
+
+    def encode(texts):
+        vectors = np.atleast_2d(model.encode(texts, convert_to_numpy=True))
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    docs = encode(NOTES)
+    queries = encode([q for q, _ in QUERIES])
+    ranks = []
+    for query, (_, target) in zip(queries, QUERIES):
+        order = np.argsort(-(docs @ query))
+        ranks.append(int(np.flatnonzero(order == target)[0]) + 1)
+
+    timings = []
+    for _ in range(repeats):
+        for query, _ in QUERIES:
+            t = time.perf_counter()
+            encode([query])
+            timings.append(time.perf_counter() - t)
+    batch = NOTES * 4
+    t = time.perf_counter()
+    encode(batch)
+    docs_per_s = len(batch) / (time.perf_counter() - t)
+
+    return {
+        "backend": name,
+        "dim": int(docs.shape[1]),
+        "load_s": load_s,
+        "query_p50_ms": float(np.median(timings)) * 1000,
+        "docs_per_s": docs_per_s,
+        "recall@1": sum(r == 1 for r in ranks) / len(ranks),
+        "mrr": float(np.mean([1.0 / r for r in ranks])),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", nargs="+", default=["sentence-transformers", "onnx", "hashing"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(args.single, args.repeats)))
+        return
+
+    print(f"{'backend':>22} {'dim':>5} {'load s':>7} {'q p50 ms':>9} {'docs/s':>8} {'R@1':>5} {'MRR':>5} {'RSS MB':>7}")
+    for name in args.backends:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_embedding_backends", "--single", name, "--repeats", str(args.repeats)],
+            capture_output=True, text=True, cwd=os.getcwd(),
+        )
+        if proc.returncode != 0:
+            reason = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+            print(f"{name:>22}  skipped: {reason}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(
+            f"{name:>22} {r['dim']:>5} {r['load_s']:>7.2f} {r['query_p50_ms']:>9.2f} {r['docs_per_s']:>8.0f} "
+            f"{r['recall@1']:>5.2f} {r['mrr']:>5.2f} {r['peak_rss_mb']:>7.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Load test for the async LLM client against the fake OpenAI server.
+
+Fires a burst of concurrent streamed chat requests through services.llm_client
+and reports how many were served, rejected with 429 (queue full) or 503 (wait
+timed out), time to first token, and event-loop lag while the burst runs.
+`--mode blocking` makes the same calls with the synchronous OpenAI client
+inside the event loop (what /ai/chat used to do) for comparison.
+
+Run from the server directory, with the fake server up:
+    python -m benchmarks.fake_openai_server --port 8100 &
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake \\
+        python -m benchmarks.bench_llm_concurrency --requests 200 --concurrency 8 --queue 32
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from services.llm_client import LLMClient, LLMSaturated
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Summarise my notes about the budget."},
+]
+
+
+async def loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - t - interval) * 1000)
+
+
+async def one_async(client: LLMClient, results: list):
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async for chunk in client.stream(model="gpt-4o-mini", messages=MESSAGES, max_tokens=1000):
+            if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                ttft = (time.perf_counter() - start) * 1000
+        results.append(("ok", ttft, (time.perf_counter() - start) * 1000))
+    except LLMSaturated as e:
+        results.append((str(e.status_code), None, (time.perf_counter() - start) * 1000))
+    except Exception as e:
+        results.append((type(e).__name__, None, (time.perf_counter() - start) * 1000))
+
+
+async def one_blocking(client, results: list):
+    start = time.perf_counter()
+    ttft = None
+    for chunk in client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, max_tokens=1000, stream=True):
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = (time.perf_counter() - start) * 1000
+    results.append(("ok", ttft, (time.perf_counter() - start) * 1000))
+
+
+def pct(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+async def run(args):
+    results, lag = [], []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(loop_lag(stop, lag))
+    start = time.perf_counter()
+
+    if args.mode == "async":
+        client = LLMClient(max_concurrency=args.concurrency, max_queue=args.queue, queue_timeout=args.queue_timeout)
+        tasks = []
+        for _ in range(args.requests):
+            tasks.append(asyncio.create_task(one_async(client, results)))
+            if args.spacing_ms:
+                await asyncio.sleep(args.spacing_ms / 1000)
+        await asyncio.gather(*tasks)
+        await client.aclose()
+    else:
+        import os
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        tasks = [asyncio.create_task(one_blocking(client, results)) for _ in range(args.requests)]
+        await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    outcomes = {}
+    for status, _, _ in results:
+        outcomes[status] = outcomes.get(status, 0) + 1
+    ttfts = [t for s, t, _ in results if s == "ok" and t is not None]
+    totals = [total for s, _, total in results if s == "ok"]
+    rejected = [t for s, _, t in results if s in ("429", "503")]
+
+    print(f"mode={args.mode} requests={args.requests} elapsed={elapsed:.2f}s outcomes={outcomes}")
+    print(f"  served/s          {len(totals) / elapsed:8.1f}")
+    print(f"  ttft ms p50/p95   {pct(ttfts, 50):8.0f} {pct(ttfts, 95):8.0f}")
+    print(f"  total ms p50/p95  {pct(totals, 50):8.0f} {pct(totals, 95):8.0f}")
+    print(f"  reject ms p50     {pct(rejected, 50):8.1f}")
+    print(f"  loop lag ms p50/max {pct(lag, 50):6.1f} {max(lag) if lag else float('nan'):8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["async", "blocking"], default="async")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--queue", type=int, default=32)
+    parser.add_argument("--queue-timeout", type=float, default=10.0)
+    parser.add_argument("--spacing-ms", type=float, default=0.0, help="delay between request starts (0 = one burst)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Memory and recall@k of float16 / int8 vector storage against float32.
+
+Each quantized index is written to a segment in a temp directory and mapped
+back, the way rag_service loads workspaces, so the "rescore" rows read their
+float32 originals from the memory-mapped file.
+
+Run from the server directory:
+    python -m benchmarks.bench_quantization --sizes 10000 50000 --k 10
+"""
+import argparse
+import tempfile
+import uuid
+
+import numpy as np
+
+from benchmarks.bench_ann import queries_from, recall, synthetic_workspace, timed_search
+from services import index_segments
+from services.ann_index import IVFVectorIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    index_segments.RAG_SEGMENT_DIR = tempfile.mkdtemp(prefix="bench-segments-")
+    # exact search throughout so only the storage precision differs
+    threshold = 10 ** 9
+
+    print(f"{'n':>8} {'storage':>16} {'MB':>8} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for n in args.sizes:
+        vectors = synthetic_workspace(n, args.dim, topics=max(50, n // 500), rng=rng)
+        queries = queries_from(vectors, args.queries, rng)
+        note_id = uuid.uuid4()
+        ids = [(note_id, i) for i in range(n)]
+
+        baseline = IVFVectorIndex.from_vectors(ids, vectors, dim=args.dim, precision="float32", threshold=threshold)
+        exact, p50, p95 = timed_search(baseline, queries, args.k)
+        print(f"{n:>8} {'float32':>16} {baseline.nbytes / 2**20:>8.1f} {1.0:>10.3f} {p50:>8.2f} {p95:>8.2f}")
+
+        for precision in ("float16", "int8"):
+            built = IVFVectorIndex.from_vectors(
+                ids, vectors, dim=args.dim, precision=precision, threshold=threshold, keep_full=True
+            )
+            index_segments.write_segment(n, built, {}, "bench")
+            mapped, _ = index_segments.read_segment(n, "bench", precision)
+            mapped.threshold = threshold
+            for factor in (0, args.rescore_factor):
+                mapped.rescore_factor = factor
+                approx, p50, p95 = timed_search(mapped, queries, args.k)
+                label = f"{precision}+rescore" if factor else precision
+                print(f"{n:>8} {label:>16} {mapped.nbytes / 2**20:>8.1f} {recall(approx, exact):>10.3f} {p50:>8.2f} {p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
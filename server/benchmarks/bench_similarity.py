@@ -0,0 +1,67 @@
+"""Micro-benchmark: per-note cosine loop vs. the vectorised VectorIndex.
+
+Run from the server directory:
+    python -m benchmarks.bench_similarity --notes 10000 --top-n 3
+"""
+import argparse
+import time
+
+import numpy as np
+
+from services.vector_index import VectorIndex
+
+
+def cosine_sim(a, b):
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def loop_top_n(query, ids, vectors, top_n):
+    """The original retrieval scoring: one cosine_sim call per note, then a full sort."""
+    results = [(note_id, float(cosine_sim(query, vector))) for note_id, vector in zip(ids, vectors)]
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results[:top_n]
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.notes, args.dim)).astype(np.float32)
+    ids = list(range(args.notes))
+    query = rng.standard_normal(args.dim).astype(np.float32)
+
+    start = time.perf_counter()
+    index = VectorIndex.from_vectors(ids, vectors, dim=args.dim, precision="float32")
+    build_ms = (time.perf_counter() - start) * 1000
+
+    expected = [i for i, _ in loop_top_n(query, ids, vectors, args.top_n)]
+    got = [i for i, _ in index.search(query, args.top_n)]
+    assert expected == got, f"result mismatch: {expected} != {got}"
+
+    loop_best, loop_median = _time(lambda: loop_top_n(query, ids, vectors, args.top_n), args.repeat)
+    vec_best, vec_median = _time(lambda: index.search(query, args.top_n), args.repeat)
+
+    print(f"notes={args.notes} dim={args.dim} top_n={args.top_n} repeat={args.repeat}")
+    print(f"index build (one-off):  {build_ms:8.2f} ms")
+    print(f"python loop + sort:     best {loop_best:8.2f} ms   median {loop_median:8.2f} ms")
+    print(f"mat-vec + argpartition: best {vec_best:8.2f} ms   median {vec_median:8.2f} ms")
+    print(f"speed-up (median):      {loop_median / vec_median:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
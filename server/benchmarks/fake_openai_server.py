@@ -0,0 +1,130 @@
+"""A local stand-in for the OpenAI chat completions API, for load-testing without the network.
+
+Answers POST /v1/chat/completions (streamed and non-streamed) with canned text
+after a configurable delay, so the server's LLM client, concurrency limit and
+queue can be exercised at realistic latencies.
+
+Run from the server directory:
+    python -m benchmarks.fake_openai_server --port 8100 --ttft-ms 400 --tokens 60 --token-ms 20
+and start the API with OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake.
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = "The notes in this workspace mention the quarterly budget and the hiring plan".split()
+
+app = FastAPI(title="fake-openai")
+settings = {"ttft_ms": 400.0, "tokens": 60, "token_ms": 20.0}
+counters = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+
+def _tokens(n: int) -> list:
+    return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def _json_answer(messages: list) -> str:
+    """Canned JSON for response_format=json_object calls (the note summary worker's batch format)."""
+    text = str(messages[-1].get("content", "")) if messages else ""
+    ids = re.findall(r"### id: (\S+)", text)
+    return json.dumps({"summaries": [{"id": i, "summary": " ".join(WORDS[:12]) + "."} for i in ids]})
+
+
+def _usage(messages: list, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4o-mini")
+    messages = body.get("messages", [])
+    tokens = _tokens(min(settings["tokens"], body.get("max_tokens") or settings["tokens"]))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    counters["requests"] += 1
+    counters["in_flight"] += 1
+    counters["max_in_flight"] = max(counters["max_in_flight"], counters["in_flight"])
+
+    if not body.get("stream"):
+        try:
+            await asyncio.sleep((settings["ttft_ms"] + settings["token_ms"] * len(tokens)) / 1000)
+        finally:
+            counters["in_flight"] -= 1
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            tokens = [_json_answer(messages)]
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(messages, len(tokens)),
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: dict, finish_reason=None, usage=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage:
+            data["usage"] = usage
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def events():
+        try:
+            await asyncio.sleep(settings["ttft_ms"] / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                yield chunk({"content": token})
+                await asyncio.sleep(settings["token_ms"] / 1000)
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, usage=_usage(messages, len(tokens)))
+            yield "data: [DONE]\n\n"
+        finally:
+            counters["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft-ms", type=float, default=400.0, help="delay before the first token")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per answer")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="delay between tokens")
+    args = parser.parse_args()
+    settings.update(ttft_ms=args.ttft_ms, tokens=args.tokens, token_ms=args.token_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
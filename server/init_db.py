@@ -1,6 +1,7 @@
-from services.db import Base, engine
-from models import note, user, workspace
+from services.db import Base, engine, drop_superseded_tables
+from models import note, note_embedding, note_summary, note_neighbors, note_table_stats, workspace_digest, user, workspace
 
 if __name__ == "__main__":
     Base.metadata.create_all(bind=engine)
+    drop_superseded_tables()
     print("neon db created")
\ No newline at end of file
@@ -1,6 +1,7 @@
 print("=== STARTING main.py ===", flush=True)
 import uuid
 import io
+import asyncio
 from typing import Optional, Union
 from datetime import datetime
 
@@ -8,19 +9,49 @@ print("1. Importing FastAPI...", flush=True)
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query
 print("2. FastAPI imported. Importing CORS...", flush=True)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 print("3. Importing SQLAlchemy...", flush=True)
 from sqlalchemy.orm import Session
 print("4. Importing db service...", flush=True)
-from services.db import get_db, engine, Base
+from services.db import get_db, engine, Base, drop_superseded_tables
 print("5. Importing rag_service...", flush=True)
-from services.rag_service import retrieve_relevant_notes, build_rag_context, preload_model_async
+from services.rag_service import (
+    preload_model_async,
+    forget_workspace,
+    embedding_executor,
+    flush_index_segments,
+    retrieval_cache_stats,
+)
+from services.ai_chat import (
+    prepare_chat,
+    complete_chat,
+    final_payload,
+    run_streamed_chat,
+    finish_chat,
+    chat_latency,
+)
+from services.chat_sessions import chat_sessions
+from services.context_packer import count_tokens, preload_encoding_async
+from services.answer_cache import answer_cache
+from services.llm_client import llm_client, LLMSaturated
+from services.indexing_worker import indexing_worker
+from services.summary_worker import summary_worker
+from services.workspace_digest import digest_worker
+from services.retrieval_prefetch import retrieval_prefetcher
+from services.reranker import reranker
+from services.note_graph import note_graph, get_related, NOTE_GRAPH_K
+from services.table_stats import TABULAR_EXTENSIONS, refresh_table_stats, get_table_stats
+from services.live_documents import live_documents
+from services.note_log import note_log, LIVE_LOG_LEASE_SECONDS
 print("6. Importing auth service...", flush=True)
 from services.auth import (
     get_current_user, 
     get_current_user_optional,
+    get_ops_admin,
     check_workspace_permission,
     get_user_workspaces,
-    verify_token
+    verify_token_and_get_user
 )
 print("7. Importing models...", flush=True)
 from models.note import Note
@@ -32,20 +63,20 @@ from models.workspace_collaborator import (
     PERMISSION_EDITOR, 
     PERMISSION_OWNER
 )
-from models import user, workspace, note
+from models import user, workspace, note, note_embedding, note_summary, note_neighbors, note_table_stats, workspace_digest
 from models.workspace_collaborator import WorkspaceCollaborator as WC
 print("8. Importing routers...", flush=True)
-from routers.websocket_events import sio
+from routers.websocket_events import sio, sync_live_document, note_deleted
 from routers.auth import router as auth_router
 from routers.collaborators import router as collaborators_router
 
 import socketio
 from pydantic import BaseModel
 
-from openai import OpenAI
+import json
+import time
 import os
 from dotenv import load_dotenv
-from re import finditer
 
 load_dotenv()
 
@@ -54,6 +85,7 @@ print("Initializing database...", flush=True)
 
 try:
     Base.metadata.create_all(bind=engine)
+    drop_superseded_tables()
     print("Database initialized successfully!", flush=True)
 except Exception as e:
     # This is usually fine - tables already exist
@@ -67,6 +99,35 @@ app = FastAPI(title="AI Colab Workspace API", version="2.0.0")
 async def startup_event():
     """Preload heavy models in background after server starts."""
     preload_model_async()
+    preload_encoding_async()
+    reranker.preload_async()
+    indexing_worker.start()
+    asyncio.create_task(_recover_live_documents())
+    asyncio.create_task(indexing_worker.backfill())
+    summary_worker.start()
+    asyncio.create_task(summary_worker.backfill())
+    digest_worker.start()
+    asyncio.create_task(digest_worker.backfill())
+    note_graph.start()
+    asyncio.create_task(note_graph.backfill())
+
+async def _recover_live_documents():
+    """Compact edits logged but never saved by a server that stopped: at startup, and again whenever
+    the leases of one that stopped moments ago may have lapsed. Logs a running server holds are left alone."""
+    if not await asyncio.to_thread(note_log.connect):
+        return
+    while True:
+        for note_id, workspace_id in await live_documents.recover():
+            indexing_worker.enqueue(note_id, workspace_id)
+        await asyncio.sleep(LIVE_LOG_LEASE_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Write changed workspace vectors to their on-disk segments so the next start maps them,
+    and close the LLM connection pool."""
+    saved = await asyncio.to_thread(flush_index_segments)
+    print(f"Saved {saved} index segments", flush=True)
+    await llm_client.aclose()
 
 # CORS configuration - explicit origins required when using credentials
 cors_origins = [
@@ -87,37 +148,24 @@ app.add_middleware(
 app.include_router(auth_router)
 app.include_router(collaborators_router)
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 class ChatRequest(BaseModel):
     message: str
     workspace_id: str  # UUID as string
     conversation_history: list[dict] = []
     use_rag: bool = True
+    context_tokens: Optional[int] = None  # token budget for retrieved passages (server default if unset)
+    session_id: Optional[str] = None  # server-side chat session; replaces conversation_history
 
-def extract_citations(message, relevant_notes):
-    citation_pattern = r'\[Doc:\s*"([^"]+)"\]'
-    matches = finditer(citation_pattern, message)
-
-    title_to_note = {note["title"]: note["note_id"] for note in relevant_notes}
-
-    citations = []
-    for match in matches:
-        cited_title = match.group(1)
-        note_id = None
-        for note_title, nid in title_to_note.items():
-            if cited_title.lower() in note_title.lower() or note_title.lower() in cited_title.lower():
-                note_id = nid
-                break
-        if note_id:
-            citations.append({
-                "note_id": note_id,
-                "title": cited_title,
-                "position": match.start(),
-                "match_text": match.group(0)
-            })
+class ChatSessionCreate(BaseModel):
+    workspace_id: str
 
-    return citations
+def load_chat_session(session_id: Optional[str], ws_uuid: uuid.UUID, user: User) -> Optional[dict]:
+    if not session_id:
+        return None
+    session = chat_sessions.get(session_id, workspace_id=ws_uuid, user_id=user.id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return session
 
 @app.post("/ai/chat")
 async def ai_chat(
@@ -130,141 +178,179 @@ async def ai_chat(
     
     # Check permission (viewers can use AI)
     check_workspace_permission(db, current_user, ws_uuid, PERMISSION_VIEWER)
+    session = await asyncio.to_thread(load_chat_session, request.session_id, ws_uuid, current_user)
     
     try:
-        relevant_notes = []
-        rag_context = ""
-        use_documents = False
-
-        if request.use_rag:
-            relevant_notes = retrieve_relevant_notes(
-                query=request.message,
-                workspace_id=ws_uuid,
-                db=db,
-                top_n=3
-            )
-            if relevant_notes and relevant_notes[0]["similarity"] > 0.15:
-                rag_context = build_rag_context(relevant_notes)
-                use_documents = True
-        
-        system_prompt = """
-        You are an assistant that helps users work with their notes and documents in this workspace.
-
-        You should:
-        - Answer general questions using your own knowledge.
-        - When a question is about the user’s documents, use the provided document context.
-        - Keep answers concise, clear, and helpful.
-
-        Formatting (Markdown):
-        - Use **bold** for important terms or headings.
-        - Use *italics* for subtle emphasis or titles.
-        - Use `code` for inline code, variables, or technical identifiers.
-        - Use bullet lists (- item) for unordered lists.
-        - Use numbered lists (1. item) when order matters.
-        - Use > for short callouts or quotes.
-        """
-
-        if use_documents and rag_context:
-            system_prompt += f"""
-
-            The following documents may be relevant to the user’s question:
-
-            {rag_context}
-
-            When you use information from these documents, follow these rules for citations:
-
-            1. Citation format
-            - Whenever you rely on a specific document, include a citation in this exact format:
-                [Doc: "Document Title"]
-
-            2. What requires a citation
-            You must add a citation whenever you:
-            - Quote text from a document.
-            - Paraphrase or summarize its content.
-            - List data taken from it (numbers, bullet points, etc.).
-            - Analyse data that comes from it (e.g. means, ranges, trends).
-            - Refer to the document by name (e.g. “Big Numbers”, “Who am I?”).
-            - Describe what the document contains or shows.
-
-            3. Where to place the citation
-            - Prefer to introduce the document first, then describe its content.
-            - Good pattern: [Doc: "Who am I?"] includes the statement "Hello, I am Shakespeare, that is a big name."
-            - Good pattern: According to [Doc: "Meeting Notes"], the meeting is on Tuesday.
-            - Good pattern: [Doc: "Big Numbers"] contains the numbers 2, 9, 1, 7, 5, ...
-            - Avoid putting the citation as an afterthought at the very end of a sentence.
-
-            4. Multiple citations
-            - You can and should cite the same document more than once if you refer to it multiple times.
-            - If you are describing data or analysis that clearly comes from one document, keep citing that document as needed so the source is obvious.
-
-            5. General vs. document‑based answers
-            - If the user’s question is general knowledge (not about their documents), answer normally and do not mention the documents.
-            - If the question is clearly about the contents of the workspace (e.g. “Do I have any documents that mention Shakespeare?”, “What numbers appear in my files?”), base your answer on the documents above and use citations.
-
-            Examples:
-
-            - User: Do I have any documents that mention Shakespeare?
-            Assistant: Yes, you do. [Doc: "Who am I?"] includes the statement "Hello, I am Shakespeare, that is a big name."
-
-            - User: I have two files with numbers in them, find the files, list the numbers and then do statistical analysis.
-            Assistant:
-            - You have two documents with numbers:
-                - [Doc: "Big Numbers"] contains 2, 9, 1, 7, 5, 10, 9, 7, 8, 9, 10, 9.
-                - [Doc: "Really big numbers"] contains 18, 19, 36, 124, 9, 9, 4, 5, 4, 6.
-            - [Doc: "Big Numbers"] has a mean of …
-            - [Doc: "Really big numbers"] has a mean of …
-
-            If you are unsure whether something comes from a document or not, either check the context carefully or say you are not certain, rather than guessing.
-            """
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        messages.extend(request.conversation_history)
-        
-        messages.append({"role": "user", "content": request.message})
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.3
+        started = time.perf_counter()
+        prepared = await prepare_chat(
+            request.message,
+            ws_uuid,
+            request.conversation_history,
+            db,
+            use_rag=request.use_rag,
+            context_tokens=request.context_tokens,
+            session=session,
         )
-        
-        assistant_message = response.choices[0].message.content
+        if prepared["cached"]:
+            payload = dict(prepared["cached"])
+            await finish_chat(prepared, payload)
+            chat_latency.record(None, (time.perf_counter() - started) * 1000, streamed=False)
+            return payload
+
+        assistant_message, usage = await complete_chat(prepared["messages"])
         print(assistant_message)
 
-        citations = extract_citations(assistant_message, relevant_notes)
-        print(citations)
-        
-        source_data = [
-            {
-                "note_id": note["note_id"],
-                "title": note["title"],
-                "content": note["content"][:200],
-                "similarity": note["similarity"],
-                "created_at": note.get("created_at")
-            }
-            for note in relevant_notes
-        ] if relevant_notes else []
-        
-        return {
-            "message": assistant_message,
-            "model": "gpt-4o-mini",
-            "usage": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            },
-            "sources": source_data,
-            "citations": citations
-        }
+        payload = final_payload(assistant_message, prepared, usage)
+        print(payload["citations"])
+        await finish_chat(prepared, payload)
+        chat_latency.record(None, (time.perf_counter() - started) * 1000, streamed=False)
+        return payload
+    except LLMSaturated as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        chat_latency.record_error()
+        raise HTTPException(status_code=500, detail=f"AI chat error: {str(e)}")
+
+
+def sse_frame(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/ai/chat/stream")
+async def ai_chat_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Same as /ai/chat, but as Server-Sent Events: a `token` event per streamed delta,
+    then one `done` event with the full message, citations, sources, usage and timings
+    (retrieval_ms, ttft_ms, total_ms). Failures after the stream started arrive as `error`."""
+    ws_uuid = uuid.UUID(request.workspace_id)
+    check_workspace_permission(db, current_user, ws_uuid, PERMISSION_VIEWER)
+    session = await asyncio.to_thread(load_chat_session, request.session_id, ws_uuid, current_user)
+    started = time.perf_counter()
+    try:
+        prepared = await prepare_chat(
+            request.message,
+            ws_uuid,
+            request.conversation_history,
+            db,
+            use_rag=request.use_rag,
+            context_tokens=request.context_tokens,
+            session=session,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI chat error: {str(e)}")
+    # take the LLM slot up front so saturation is a plain 429/503, not an error event
+    slot = None
+    if not prepared["cached"]:
+        try:
+            slot = await llm_client.acquire()
+        except LLMSaturated as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+    def release():
+        if slot is not None:
+            slot.release()
+
+    async def events():
+        try:
+            async for event, data in run_streamed_chat(prepared, started, slot):
+                yield sse_frame(event, data)
+        except Exception as e:
+            print(f"AI chat stream error: {e}", flush=True)
+            yield sse_frame("error", {"detail": f"AI chat error: {str(e)}"})
+        finally:
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # proxies (nginx in particular) otherwise buffer the whole response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # if the client disconnects before the body starts, events() never runs
+        background=BackgroundTask(release),
+    )
+
+
+@app.post("/ai/sessions")
+async def create_chat_session(
+    request: ChatSessionCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Start a server-side chat session; pass its id as session_id on /ai/chat."""
+    try:
+        ws_uuid = uuid.UUID(request.workspace_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid workspace ID")
+    check_workspace_permission(db, current_user, ws_uuid, PERMISSION_VIEWER)
+    session = await asyncio.to_thread(chat_sessions.create, ws_uuid, current_user.id)
+    return {"session_id": session["id"], "workspace_id": session["workspace_id"]}
+
+
+@app.get("/ai/sessions/{session_id}")
+async def get_chat_session(session_id: str, current_user: User = Depends(get_current_user)):
+    session = await asyncio.to_thread(chat_sessions.get, session_id, None, current_user.id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {
+        "session_id": session["id"],
+        "workspace_id": session["workspace_id"],
+        "summary": session["summary"],
+        "summarized_turns": session["summarized_turns"],
+        "turns": session["turns"],
+        "history_tokens": sum(count_tokens(m["content"]) for m in chat_sessions.history(session)),
+    }
+
+
+@app.delete("/ai/sessions/{session_id}")
+async def delete_chat_session(session_id: str, current_user: User = Depends(get_current_user)):
+    session = await asyncio.to_thread(chat_sessions.get, session_id, None, current_user.id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    await asyncio.to_thread(chat_sessions.delete, session_id)
+    return {"message": "Chat session deleted"}
+
+
+@app.get("/ai/stats")
+async def ai_stats(current_user: User = Depends(get_ops_admin)):
+    """Operational counters for the AI pipeline (embedding queue depth, batch sizes, indexing, caches, chat latency).
+    Admins only: the counters span every workspace and the errors name notes."""
+    return {
+        "embedding": embedding_executor.stats(),
+        "indexing": indexing_worker.status(),
+        "summaries": summary_worker.status(),
+        "digest": digest_worker.status(),
+        "prefetch": retrieval_prefetcher.stats(),
+        "rerank": reranker.stats(),
+        "note_graph": note_graph.status(),
+        "retrieval_cache": retrieval_cache_stats(),
+        "chat": chat_latency.stats(),
+        "llm": llm_client.stats(),
+        "answer_cache": answer_cache.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "live_documents": live_documents.stats(),
+    }
+
+
+@app.get("/workspaces/{workspace_id}/index-status")
+async def workspace_index_status(
+    workspace_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """How many of a workspace's notes are still waiting to be (re-)indexed."""
+    try:
+        ws_uuid = uuid.UUID(workspace_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid workspace ID")
+    check_workspace_permission(db, current_user, ws_uuid, PERMISSION_VIEWER)
+    return indexing_worker.status(ws_uuid)
 
 
 # Supported file types for upload
-SUPPORTED_TEXT_EXTENSIONS = {'.txt', '.md', '.markdown', '.json', '.csv', '.xml', '.html', '.htm', '.py', '.js', '.ts', '.jsx', '.tsx', '.css', '.yaml', '.yml', '.toml', '.ini', '.cfg', '.log', '.sql', '.sh', '.bat', '.ps1'}
+SUPPORTED_TEXT_EXTENSIONS = {'.txt', '.md', '.markdown', '.json', '.csv', '.tsv', '.xml', '.html', '.htm', '.py', '.js', '.ts', '.jsx', '.tsx', '.css', '.yaml', '.yml', '.toml', '.ini', '.cfg', '.log', '.sql', '.sh', '.bat', '.ps1'}
 SUPPORTED_DOCUMENT_EXTENSIONS = {'.pdf', '.docx', '.doc', '.rtf', '.odt', '.pptx', '.xlsx'}
 ALL_SUPPORTED_EXTENSIONS = SUPPORTED_TEXT_EXTENSIONS | SUPPORTED_DOCUMENT_EXTENSIONS
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB for documents
@@ -448,6 +534,9 @@ async def upload_file(
     db.add(new_note)
     db.commit()
     db.refresh(new_note)
+    if ext in TABULAR_EXTENSIONS:
+        await asyncio.to_thread(refresh_table_stats, new_note.id, TABULAR_EXTENSIONS[ext])
+    indexing_worker.enqueue(new_note.id, new_note.workspace_id)
     
     # Emit socket event to notify other users
     from routers.websocket_events import sio
@@ -478,20 +567,6 @@ async def upload_file(
 
 from fastapi.responses import Response
 
-async def verify_token_and_get_user(token: str, db: Session) -> User:
-    """Verify a token string and return the associated user."""
-    payload = await verify_token(token)
-    auth0_id = payload.get("sub")
-    
-    if not auth0_id:
-        raise HTTPException(status_code=401, detail="Invalid token payload")
-    
-    user = db.query(User).filter(User.auth0_id == auth0_id).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return user
-
 @app.get("/notes/{note_id}/file")
 async def get_note_file(
     note_id: str,
@@ -535,6 +610,56 @@ async def get_note_file(
     )
 
 
+@app.get("/notes/{note_id}/table-stats")
+async def get_note_table_stats(
+    note_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Per-column statistics of a spreadsheet upload (CSV, TSV or XLSX)."""
+    try:
+        note_uuid = uuid.UUID(note_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid note ID")
+
+    note = db.query(Note).filter(Note.id == note_uuid).first()
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    check_workspace_permission(db, current_user, note.workspace_id, PERMISSION_VIEWER)
+
+    stats = get_table_stats(db, note_uuid)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="This note has no table statistics")
+    return stats
+
+
+@app.get("/notes/{note_id}/related")
+async def get_related_notes(
+    note_id: str,
+    limit: int = NOTE_GRAPH_K,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Notes in the same workspace most similar to this one, from the precomputed neighbour graph."""
+    try:
+        note_uuid = uuid.UUID(note_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid note ID")
+
+    note = db.query(Note).filter(Note.id == note_uuid).first()
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    check_workspace_permission(db, current_user, note.workspace_id, PERMISSION_VIEWER)
+
+    related = get_related(db, note_uuid, max(1, min(limit, NOTE_GRAPH_K)))
+    if related is None:
+        # not linked yet (new or never embedded); the indexing worker queues it once it is embedded
+        return {"note_id": note_id, "related": [], "pending": True}
+    return {"note_id": note_id, "related": related, "pending": False}
+
+
 @app.post("/workspaces/{workspace_id}/upload-multiple")
 async def upload_multiple_files(
     workspace_id: str,
@@ -615,6 +740,9 @@ async def upload_multiple_files(
             db.add(new_note)
             db.commit()
             db.refresh(new_note)
+            if ext in TABULAR_EXTENSIONS:
+                await asyncio.to_thread(refresh_table_stats, new_note.id, TABULAR_EXTENSIONS[ext])
+            indexing_worker.enqueue(new_note.id, new_note.workspace_id)
             
             # Emit socket event
             from routers.websocket_events import sio
@@ -695,10 +823,12 @@ def serialize_workspace(item: Workspace, include_stats: bool = False, db: Sessio
 
 
 def serialize_note(item: Note):
+    # a note being edited is ahead of the database until its next compaction
+    live = live_documents.get(item.id)
     return {
         "id": item.id,
-        "title": item.title,
-        "content": item.content,
+        "title": live.title if live else item.title,
+        "content": live.content if live else item.content,
         "workspace_id": item.workspace_id,
         "author_id": item.author_id,
         "created_at": item.created_at.isoformat() if item.created_at else None,
@@ -788,6 +918,7 @@ async def delete_workspace(
     
     db.delete(workspace)
     db.commit()
+    forget_workspace(ws_uuid)
     return {"message": "Workspace deleted"}
 
 
@@ -830,6 +961,7 @@ async def create_note(
     db.add(note)
     db.commit()
     db.refresh(note)
+    indexing_worker.enqueue(note.id, note.workspace_id)
     return serialize_note(note)
 
 
@@ -870,6 +1002,8 @@ async def update_note(
     
     db.commit()
     db.refresh(note)
+    await sync_live_document(note.id, payload.content, payload.title)
+    indexing_worker.enqueue(note.id, note.workspace_id)
     return serialize_note(note)
 
 
@@ -888,8 +1022,10 @@ async def delete_note(
     if workspace.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Only workspace owner can delete notes")
     
+    note_workspace_id, deleted_note_id = note.workspace_id, note.id
     db.delete(note)
     db.commit()
+    note_deleted(note_workspace_id, deleted_note_id)
     return {"message": "Note deleted"}
 
 
@@ -1,12 +1,22 @@
 from models.user import User
 from models.workspace import Workspace
 from models.note import Note
+from models.note_embedding import NoteEmbedding
+from models.note_summary import NoteSummaryState
+from models.note_neighbors import NoteNeighbors
+from models.note_table_stats import NoteTableStats
+from models.workspace_digest import WorkspaceDigestNode
 from models.workspace_collaborator import WorkspaceCollaborator, PERMISSION_VIEWER, PERMISSION_EDITOR, PERMISSION_OWNER
 
 __all__ = [
     "User",
     "Workspace", 
     "Note",
+    "NoteEmbedding",
+    "NoteSummaryState",
+    "NoteNeighbors",
+    "NoteTableStats",
+    "WorkspaceDigestNode",
     "WorkspaceCollaborator",
     "PERMISSION_VIEWER",
     "PERMISSION_EDITOR",
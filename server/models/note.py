@@ -23,3 +23,9 @@ class Note(Base):
 
     workspace = relationship("Workspace", back_populates="notes")
     author = relationship("User", back_populates="notes")
+    embeddings = relationship(
+        "NoteEmbedding",
+        back_populates="note",
+        order_by="NoteEmbedding.chunk_index",
+        cascade="all, delete-orphan",
+    )
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, LargeBinary, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from services.db import Base
+
+
+class NoteEmbedding(Base):
+    """Embedding vector for one chunk of a note, keyed by a hash of the note's embedded text."""
+    __tablename__ = "note_chunk_embeddings"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(UUID(as_uuid=True), ForeignKey("notes.id", ondelete="CASCADE"), nullable=False, index=True)
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id", ondelete="CASCADE"), nullable=True, index=True)
+    chunk_index = Column(Integer, nullable=False, default=0)
+    char_start = Column(Integer, nullable=False)  # offsets into Note.content
+    char_end = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False)  # sha256 of the whole note text that was chunked
+    model_name = Column(String, nullable=False)
+    dim = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)  # float32 bytes
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('note_id', 'chunk_index', name='uq_note_chunk'),
+    )
+
+    note = relationship("Note", back_populates="embeddings")
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, func
+from sqlalchemy.dialects.postgresql import UUID
+from services.db import Base
+
+
+class NoteNeighbors(Base):
+    """A note's row in its workspace's k-nearest-neighbour graph: the notes most similar to it, best first."""
+    __tablename__ = "note_neighbors"
+
+    note_id = Column(UUID(as_uuid=True), ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True)
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id", ondelete="CASCADE"), nullable=False, index=True)
+    content_hash = Column(String(64), nullable=False)  # of the embeddings the list was computed from
+    neighbor_count = Column(Integer, nullable=False)
+    neighbors = Column(Text, nullable=False)  # JSON: [[note_id, score], ...], best first
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
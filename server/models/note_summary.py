@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, ForeignKey, DateTime, func
+from sqlalchemy.dialects.postgresql import UUID
+from services.db import Base
+
+
+class NoteSummaryState(Base):
+    """What the current Note.summary was generated from, so unchanged notes are not re-summarised."""
+    __tablename__ = "note_summary_state"
+
+    note_id = Column(UUID(as_uuid=True), ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String(64), nullable=False)  # sha256 of the summarised title + content
+    model_name = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
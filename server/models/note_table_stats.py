@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, func
+from sqlalchemy.dialects.postgresql import UUID
+from services.db import Base
+
+
+class NoteTableStats(Base):
+    """Per-column statistics of a tabular upload (CSV/TSV/XLSX), computed when it is ingested."""
+    __tablename__ = "note_table_stats"
+
+    note_id = Column(UUID(as_uuid=True), ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True)
+    source = Column(String(8), nullable=False)  # csv, tsv or xlsx
+    content_hash = Column(String(64), nullable=False)  # sha256 of what the stats were computed from
+    row_count = Column(Integer, nullable=False)
+    column_count = Column(Integer, nullable=False)
+    stats = Column(Text, nullable=False)  # JSON: {"tables": [{"name", "rows", "columns": [...]}]}
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, func, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from services.db import Base
+
+
+class WorkspaceDigestNode(Base):
+    """One summary in a workspace's digest tree: level 1 summarises a section of notes,
+    each level above summarises the nodes below it, and the single top node is the
+    workspace summary. node_hash covers everything underneath, so an unchanged
+    subtree keeps its row (and its summary) across rebuilds."""
+    __tablename__ = "workspace_digest_nodes"
+
+    id = Column(Integer, primary_key=True)
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id", ondelete="CASCADE"), nullable=False, index=True)
+    node_hash = Column(String(64), nullable=False)
+    level = Column(Integer, nullable=False)
+    position = Column(Integer, nullable=False)
+    note_ids = Column(Text, nullable=False)  # JSON list of the notes underneath, in order
+    summary = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('workspace_id', 'node_hash', name='uq_workspace_digest_node'),
+    )
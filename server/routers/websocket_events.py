@@ -4,10 +4,23 @@ from datetime import datetime
 from typing import Optional, Union
 
 import asyncio
+import time
 import socketio
+from fastapi import HTTPException
 from services.redis_manager import get_redis_connection
 from services.db import SessionLocal
 from models.note import Note
+from services.rag_service import forget_note
+from services.indexing_worker import indexing_worker
+from services.auth import verify_token_and_get_user, check_workspace_permission
+from services.ai_chat import prepare_chat, run_streamed_chat
+from services.llm_client import LLMSaturated
+from services.chat_sessions import chat_sessions
+from services.retrieval_prefetch import retrieval_prefetcher
+from services.live_documents import live_documents
+from services.note_graph import note_graph
+from services.note_log import note_log
+from models.workspace_collaborator import PERMISSION_VIEWER
 
 sio = socketio.AsyncServer(
     async_mode="asgi",
@@ -17,14 +30,20 @@ sio = socketio.AsyncServer(
 redis = get_redis_connection()
 
 pending_saves = {}
-unsaved_changes = {}
+# note id -> when its pending save fires (time.monotonic())
+_save_due: dict[str, float] = {}
 _user_rooms: dict[str, str] = {}
+_sid_tokens: dict[str, str] = {}
+# (sid, workspace_id) -> user id, so drafts don't re-verify the token on every keystroke pause
+_draft_users: dict[tuple, str] = {}
 
 def _serialise_note_db(note: Note):
+    # a note being edited is ahead of the database until its next compaction
+    live = live_documents.get(note.id)
     return {
         "id": str(note.id) if note.id else None,
-        "title": note.title,
-        "content": note.content,
+        "title": live.title if live else note.title,
+        "content": live.content if live else note.content,
         "workspace_id": str(note.workspace_id) if note.workspace_id else None,
         "created_at": note.created_at.isoformat() if note.created_at else None,
         "updated_at": note.updated_at.isoformat() if note.updated_at else None,
@@ -45,47 +64,131 @@ def _coerce_note_id(raw_id) -> Optional[uuid.UUID]:
     except (TypeError, ValueError):
         return None
 
-async def _debounced_save(note_id: uuid.UUID, workspace_room: str, delay: float = 1.0, initiating_sid: Optional[str] = None):
+def _note_room(note_id) -> str:
+    return f"note:{note_id}"
+
+async def _save_live_document(note_id: uuid.UUID, workspace_room: str, delay: float):
+    """Compact a live document into its note after `delay`, then tell the workspace it was saved."""
     note_id_str = str(note_id)
-    print(f"_debounced_save started for note {note_id_str[:8]}..., delay={delay}s")
-    was_cancelled = False
+    print(f"_save_live_document started for note {note_id_str[:8]}..., delay={delay}s")
     try:
         await asyncio.sleep(delay)
-        payload = unsaved_changes.get(note_id_str)
-        if not payload:
+        # from here on this save is no longer pending: an edit that arrives while it runs
+        # gets a timer of its own instead of counting on a compaction that may be past it
+        _release_save(note_id_str)
+        doc = live_documents.get(note_id)
+        if doc is None or not doc.dirty:
             print(f"  No unsaved changes found for {note_id_str[:8]}...")
             return
 
-        print(f"  Saving note {note_id_str[:8]}... content_len={len(payload.get('content', ''))}")
-        with SessionLocal() as db:
-            note = db.query(Note).filter(
-                Note.id == note_id,
-                Note.workspace_id == _coerce_workspace_id(payload.get("workspace_id"))
-            ).first()
-
-            if not note:
-                print(f"  Note not found in database!")
+        async with doc.lock:
+            print(f"  Saving note {note_id_str[:8]}... revision={doc.revision} unsaved={doc.revision - doc.saved_revision}")
+            note = await live_documents.compact(doc)
+            if note is None:
+                print("  Note not found in database!")
                 return
-
-            if "content" in payload and payload["content"] is not None:
-                note.content = payload["content"]
-            if "title" in payload and payload["title"] is not None:
-                note.title = payload["title"]
-
-            db.commit()
-            db.refresh(note)
-            print(f"  Note saved successfully!")
-            await sio.emit("note_updated", _serialise_note_db(note), room=workspace_room, skip_sid=initiating_sid)
+            revision, preview = doc.saved_revision, doc.preview()
+        print("  Note saved successfully!")
+        # editors already have the text; everyone else only needs enough for the notes list
+        await sio.emit(
+            "note_saved",
+            {
+                "id": note_id_str,
+                "title": note.title,
+                "preview": preview,
+                "revision": revision,
+                "updated_at": note.updated_at.isoformat() if note.updated_at else None,
+            },
+            room=workspace_room,
+        )
+        indexing_worker.enqueue(note.id, note.workspace_id)
+        if doc.dirty and note_id_str not in pending_saves:
+            _schedule_save(doc)
+        live_documents.close_if_idle(doc)
 
     except asyncio.CancelledError:
         print(f"  Save cancelled for note {note_id_str[:8]}...")
-        was_cancelled = True
         raise  # Re-raise to properly handle cancellation
     finally:
-        # Only clean up if NOT cancelled - cancelled tasks should leave data for the next save
-        if not was_cancelled:
-            pending_saves.pop(note_id_str, None)
-            unsaved_changes.pop(note_id_str, None)
+        # a cancelled save has been replaced by a newer one, which owns the entry
+        _release_save(note_id_str)
+
+
+def _release_save(key: str) -> None:
+    if pending_saves.get(key) is asyncio.current_task():
+        del pending_saves[key]
+        _save_due.pop(key, None)
+
+
+def _schedule_save(doc) -> None:
+    """Queue the document's compaction. Edits held by the update log wait for the timer already
+    running; without the log every edit pushes the save back, so it happens once typing pauses."""
+    key = str(doc.note_id)
+    delay = live_documents.save_delay(doc)
+    due = time.monotonic() + delay
+    task = pending_saves.get(key)
+    if task and not task.done():
+        if note_log.enabled and not doc.unlogged and _save_due.get(key, due) <= due:
+            return
+        task.cancel()
+    _save_due[key] = due
+    pending_saves[key] = asyncio.create_task(_save_live_document(doc.note_id, str(doc.workspace_id), delay))
+
+
+# an update the log turned down leaves the edit only in memory, so it is saved at the next pause
+live_documents.on_unlogged = _schedule_save
+
+
+def _editor_left(doc) -> None:
+    if doc.dirty:
+        # saved soon rather than at the next compaction, then dropped
+        _schedule_save(doc)
+    else:
+        live_documents.close_if_idle(doc)
+
+
+async def _broadcast_op(doc, ops, title=None, sid: Optional[str] = None) -> None:
+    """Relay an applied operation to the note's other editors (ops is None for a title-only change)."""
+    await sio.emit(
+        "note_op",
+        {"note_id": str(doc.note_id), "epoch": doc.epoch, "revision": doc.revision, "ops": ops, "title": title, "sid": sid},
+        room=_note_room(doc.note_id),
+        skip_sid=sid,
+    )
+
+
+async def sync_live_document(note_id, content: Optional[str], title: Optional[str]) -> None:
+    """A note was written outside the live protocol (REST or update_note): if editors have it open,
+    bring their copy in line with an operation rather than a snapshot."""
+    doc = live_documents.get(note_id)
+    if doc is None:
+        return
+    async with doc.lock:
+        ops = live_documents.replace(doc, content) if content is not None else None
+        if title is not None:
+            live_documents.set_title(doc, title)
+        # the write that called us has already stored these
+        await live_documents.written(doc, content is not None, title is not None)
+        if ops is not None or title is not None:
+            await _broadcast_op(doc, ops, title)
+    if doc.dirty:
+        _schedule_save(doc)
+
+
+def _forget_live_document(note_id) -> None:
+    task = pending_saves.pop(str(note_id), None)
+    _save_due.pop(str(note_id), None)
+    if task and not task.done():
+        task.cancel()
+    live_documents.close(note_id)
+
+
+def note_deleted(workspace_id, note_id) -> None:
+    """Clean up after a deleted note, whether it went over REST or the socket."""
+    forget_note(workspace_id, note_id)
+    _forget_live_document(note_id)
+    # its neighbours' related-note lists lose it and are refilled in the background
+    note_graph.enqueue(note_id)
 
 
 def _coerce_workspace_id(raw_id) -> Optional[uuid.UUID]:
@@ -106,10 +209,17 @@ async def connect(sid, environ, auth=None):
     print(f"Client connected: {sid}")
     if auth:
         print(f"  Auth token provided: {bool(auth.get('token'))}")
+        if auth.get("token"):
+            _sid_tokens[sid] = auth["token"]
 
 @sio.event
 async def disconnect(sid):
     print(f"Client disconnected: {sid}")
+    _sid_tokens.pop(sid, None)
+    for key in [key for key in _draft_users if key[0] == sid]:
+        del _draft_users[key]
+    for doc in live_documents.leave(sid):
+        _editor_left(doc)
     workspace_room = _user_rooms.pop(sid, None)
     if workspace_room:
         await sio.emit("user_disconnected", {"sid": sid}, room=workspace_room, skip_sid=sid)
@@ -181,6 +291,7 @@ async def create_note(sid, data):
     
     # broadcast to all users in workspace
     await sio.emit("note_created", note_data, to=workspace_room)
+    indexing_worker.enqueue(note.id, uuid_workspace_id)
 
 @sio.event
 async def update_note(sid, data):
@@ -210,6 +321,8 @@ async def update_note(sid, data):
 
             # broadcast to all users in workspace
             await sio.emit("note_updated", note_data, to=workspace_room)
+            await sync_live_document(uuid_note_id, content, title)
+            indexing_worker.enqueue(uuid_note_id, uuid_workspace_id)
 
 @sio.event
 async def delete_note(sid, data):
@@ -228,6 +341,7 @@ async def delete_note(sid, data):
         if note:
             db.delete(note)
             db.commit()
+            note_deleted(uuid_workspace_id, uuid_note_id)
 
             # broadcast to all users in workspace
             await sio.emit("note_deleted", {"id": str(uuid_note_id)}, to=workspace_room)
@@ -259,43 +373,92 @@ async def message(sid, data):
         to=workspace_room,
     )
 
+async def _open_for_editor(sid, data):
+    """The live document for data's note with sid registered as an editor, or why not."""
+    uuid_workspace_id = _coerce_workspace_id(data.get("workspace_id"))
+    uuid_note_id = _coerce_note_id(data.get("note_id"))
+    if uuid_note_id is None or uuid_workspace_id is None:
+        return "invalid"
+    doc = live_documents.get(uuid_note_id)
+    if doc is not None and sid in doc.editors and doc.workspace_id == uuid_workspace_id:
+        return doc
+    doc = await live_documents.open(uuid_note_id, uuid_workspace_id, sid)
+    if doc is None:
+        return "not_found"
+    if doc.dirty:
+        # loaded with edits replayed from its update log
+        _schedule_save(doc)
+    # also covers editors coming back after a reconnect, which drops room membership
+    await sio.enter_room(sid, _note_room(uuid_note_id))
+    return doc
+
+@sio.event
+async def note_open(sid, data):
+    """Start editing a note: join its room and get a snapshot to send operations against."""
+    doc = await _open_for_editor(sid, data)
+    if isinstance(doc, str):
+        return {"status": doc}
+    return {"status": "ok", **doc.snapshot()}
+
+@sio.event
+async def note_close(sid, data):
+    uuid_note_id = _coerce_note_id(data.get("note_id"))
+    if uuid_note_id is None:
+        return
+    await sio.leave_room(sid, _note_room(uuid_note_id))
+    for doc in live_documents.leave(sid, uuid_note_id):
+        _editor_left(doc)
+
+@sio.event
+async def note_op(sid, data):
+    """An edit to an open note: {note_id, workspace_id, epoch, revision, ops, title?}.
+    Acks {"status": "ok", "revision"} once applied, or {"status": "resync", ...snapshot}
+    if the operation can no longer be placed, in which case the editor starts over from the snapshot."""
+    doc = await _open_for_editor(sid, data)
+    if isinstance(doc, str):
+        return {"status": doc}
+
+    async with doc.lock:
+        ops = data.get("ops")
+        if ops is not None:
+            ops = live_documents.receive(doc, data.get("epoch"), data.get("revision"), ops)
+            if ops is None:
+                return {"status": "resync", **doc.snapshot()}
+        title = data.get("title")
+        if title is not None:
+            live_documents.set_title(doc, title)
+        await _broadcast_op(doc, ops, title, sid)
+        revision = doc.revision
+    _schedule_save(doc)
+    # returned straight after the lock is released, so the ack goes out before any later operation
+    return {"status": "ok", "revision": revision}
+
 @sio.event
 async def note_live_update(sid, data):
+    """Whole-content edits from clients that predate note_op. The content is diffed against the live
+    document and only the resulting operation is relayed, so last-writer-wins is kept for these clients."""
     note_id = data.get("note_id")
     workspace_id_raw = data.get("workspace_id")
     content = data.get("content")
     title = data.get("title", None)
 
-    print(f"note_live_update received: note_id={note_id}, workspace_id={workspace_id_raw}, content_len={len(content) if content else 0}")
-
     uuid_workspace_id = _coerce_workspace_id(workspace_id_raw)
     uuid_note_id = _coerce_note_id(note_id)
     if uuid_note_id is None or uuid_workspace_id is None:
         print(f"  Invalid IDs: uuid_workspace_id={uuid_workspace_id}, uuid_note_id={uuid_note_id}")
         return
 
-    workspace_room = str(workspace_id_raw)
-
-    # broadcast live update to everyone else
-    await sio.emit(
-        "note_live_update",
-        {"note_id": str(uuid_note_id), "content": content, "title": title, "sid": sid},
-        room=workspace_room,
-        skip_sid=sid,
-    )
-
-    # store latest content
-    unsaved_changes[str(uuid_note_id)] = {
-        "content": content,
-        "title": title,
-        "workspace_id": workspace_id_raw,
-    }
-
-    # cancel existing pending save and schedule a new one
-    task = pending_saves.get(str(uuid_note_id))
-    if task and not task.done():
-        task.cancel()
-    pending_saves[str(uuid_note_id)] = asyncio.create_task(_debounced_save(uuid_note_id, workspace_room, delay=1.0, initiating_sid=sid))
+    doc = await live_documents.open(uuid_note_id, uuid_workspace_id)
+    if doc is None:
+        return
+    async with doc.lock:
+        ops = live_documents.replace(doc, content) if content is not None else None
+        if title is not None and title != doc.title:
+            live_documents.set_title(doc, title)
+        elif ops is None:
+            return
+        await _broadcast_op(doc, ops, title, sid)
+    _schedule_save(doc)
 
 @sio.event
 async def cursor_update(sid, data):
@@ -315,4 +478,81 @@ async def cursor_update(sid, data):
         {"sid": sid, "note_id": note_id, "cursor": cursor, "selection": selection},
         room=workspace_room,
         skip_sid=sid,
-    )
\ No newline at end of file
+    )
+
+@sio.event
+async def ai_chat_stream(sid, data):
+    """Streamed AI chat for the requesting client only: `ai_chat_token` per delta, then
+    `ai_chat_done` (message, citations, sources, timings) or `ai_chat_error`.
+    Every frame carries the caller's request_id so overlapping requests can be told apart."""
+    request_id = data.get("request_id")
+    started = time.perf_counter()
+    uuid_workspace_id = _coerce_workspace_id(data.get("workspace_id"))
+    token = data.get("token") or _sid_tokens.get(sid)
+    if uuid_workspace_id is None or not data.get("message"):
+        await sio.emit("ai_chat_error", {"request_id": request_id, "detail": "message and workspace_id are required"}, to=sid)
+        return
+    if not token:
+        await sio.emit("ai_chat_error", {"request_id": request_id, "detail": "Not authenticated"}, to=sid)
+        return
+
+    try:
+        with SessionLocal() as db:
+            user = await verify_token_and_get_user(token, db)
+            check_workspace_permission(db, user, uuid_workspace_id, PERMISSION_VIEWER)
+            session = None
+            if data.get("session_id"):
+                session = chat_sessions.get(data["session_id"], workspace_id=uuid_workspace_id, user_id=user.id)
+                if session is None:
+                    raise HTTPException(status_code=404, detail="Chat session not found or expired")
+            prepared = await prepare_chat(
+                data["message"],
+                uuid_workspace_id,
+                data.get("conversation_history") or [],
+                db,
+                use_rag=data.get("use_rag", True),
+                context_tokens=data.get("context_tokens"),
+                session=session,
+            )
+
+        async for event, payload in run_streamed_chat(prepared, started):
+            if not sio.manager.is_connected(sid, "/"):
+                # client went away; closing the generator stops the upstream stream
+                print(f"AI chat stream for {sid} abandoned (client disconnected)")
+                break
+            await sio.emit(f"ai_chat_{event}", {"request_id": request_id, **payload}, to=sid)
+    except HTTPException as e:
+        await sio.emit("ai_chat_error", {"request_id": request_id, "detail": e.detail}, to=sid)
+    except LLMSaturated as e:
+        await sio.emit(
+            "ai_chat_error",
+            {"request_id": request_id, "detail": e.detail, "status": e.status_code, "retry_after": e.retry_after},
+            to=sid,
+        )
+    except Exception as e:
+        print(f"AI chat stream error for {sid}: {e}")
+        await sio.emit("ai_chat_error", {"request_id": request_id, "detail": f"AI chat error: {str(e)}"}, to=sid)
+
+
+@sio.event
+async def ai_draft(sid, data):
+    """A question still being typed in the AI assistant (sent debounced): retrieve for it
+    speculatively so the real request finds its candidates ready. Acks with the outcome."""
+    uuid_workspace_id = _coerce_workspace_id(data.get("workspace_id"))
+    if uuid_workspace_id is None or not data.get("draft"):
+        return {"status": "invalid"}
+    user_id = _draft_users.get((sid, uuid_workspace_id))
+    if user_id is None:
+        token = data.get("token") or _sid_tokens.get(sid)
+        if not token:
+            return {"status": "unauthenticated"}
+        try:
+            with SessionLocal() as db:
+                user = await verify_token_and_get_user(token, db)
+                check_workspace_permission(db, user, uuid_workspace_id, PERMISSION_VIEWER)
+        except HTTPException as e:
+            return {"status": "forbidden", "detail": e.detail}
+        user_id = str(user.id)
+        _draft_users[(sid, uuid_workspace_id)] = user_id
+    status = await retrieval_prefetcher.prefetch(user_id, uuid_workspace_id, data["draft"])
+    return {"status": status}
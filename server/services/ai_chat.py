@@ -0,0 +1,483 @@
+"""Chat orchestration shared by the REST, SSE and Socket.IO entry points:
+retrieval + context packing, prompt assembly, (streamed) completion through
+the shared async LLM client and the final citations/sources payload."""
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+import re
+from re import finditer
+from typing import AsyncIterator, List, Optional
+
+from services.rag_service import retrieve_relevant_notes, get_note_embedding, workspace_overview
+from services.workspace_digest import get_workspace_digest
+from services.table_stats import attach_table_stats
+from services.embedding_model import is_embedding_model_ready
+from services.answer_cache import answer_cache
+from services.chat_sessions import chat_sessions
+from services.context_packer import (
+    pack_rag_context,
+    pack_summary_context,
+    pack_digest_context,
+    RAG_CONTEXT_TOKENS,
+    RAG_CONTEXT_MAX_TOKENS,
+    CONTEXT_CANDIDATE_NOTES,
+    CONTEXT_PASSAGES_PER_NOTE,
+)
+from services.indexing_worker import indexing_worker
+from services.retrieval_prefetch import retrieval_prefetcher
+from services.reranker import reranker
+from services.llm_client import llm_client, LLMSlot
+
+CHAT_MODEL = "gpt-4o-mini"
+CHAT_MAX_TOKENS = 1000
+CHAT_TEMPERATURE = 0.3
+
+SYSTEM_PROMPT = """
+        You are an assistant that helps users work with their notes and documents in this workspace.
+
+        You should:
+        - Answer general questions using your own knowledge.
+        - When a question is about the user’s documents, use the provided document context.
+        - Keep answers concise, clear, and helpful.
+
+        Formatting (Markdown):
+        - Use **bold** for important terms or headings.
+        - Use *italics* for subtle emphasis or titles.
+        - Use `code` for inline code, variables, or technical identifiers.
+        - Use bullet lists (- item) for unordered lists.
+        - Use numbered lists (1. item) when order matters.
+        - Use > for short callouts or quotes.
+        """
+
+# appended to the system prompt when retrieved passages are used; {rag_context} is filled in
+DOCUMENTS_PROMPT = """
+
+            The following documents may be relevant to the user’s question:
+
+            {rag_context}
+
+            When you use information from these documents, follow these rules for citations:
+
+            1. Citation format
+            - Whenever you rely on a specific document, include a citation in this exact format:
+                [Doc: "Document Title"]
+
+            2. What requires a citation
+            You must add a citation whenever you:
+            - Quote text from a document.
+            - Paraphrase or summarize its content.
+            - List data taken from it (numbers, bullet points, etc.).
+            - Analyse data that comes from it (e.g. means, ranges, trends).
+            - Refer to the document by name (e.g. “Big Numbers”, “Who am I?”).
+            - Describe what the document contains or shows.
+
+            3. Where to place the citation
+            - Prefer to introduce the document first, then describe its content.
+            - Good pattern: [Doc: "Who am I?"] includes the statement "Hello, I am Shakespeare, that is a big name."
+            - Good pattern: According to [Doc: "Meeting Notes"], the meeting is on Tuesday.
+            - Good pattern: [Doc: "Big Numbers"] contains the numbers 2, 9, 1, 7, 5, ...
+            - Avoid putting the citation as an afterthought at the very end of a sentence.
+
+            4. Multiple citations
+            - You can and should cite the same document more than once if you refer to it multiple times.
+            - If you are describing data or analysis that clearly comes from one document, keep citing that document as needed so the source is obvious.
+
+            5. General vs. document‑based answers
+            - If the user’s question is general knowledge (not about their documents), answer normally and do not mention the documents.
+            - If the question is clearly about the contents of the workspace (e.g. “Do I have any documents that mention Shakespeare?”, “What numbers appear in my files?”), base your answer on the documents above and use citations.
+
+            Examples:
+
+            - User: Do I have any documents that mention Shakespeare?
+            Assistant: Yes, you do. [Doc: "Who am I?"] includes the statement "Hello, I am Shakespeare, that is a big name."
+
+            - User: I have two files with numbers in them, find the files, list the numbers and then do statistical analysis.
+            Assistant:
+            - You have two documents with numbers:
+                - [Doc: "Big Numbers"] contains 2, 9, 1, 7, 5, 10, 9, 7, 8, 9, 10, 9.
+                - [Doc: "Really big numbers"] contains 18, 19, 36, 124, 9, 9, 4, 5, 4, 6.
+            - [Doc: "Big Numbers"] has a mean of …
+            - [Doc: "Really big numbers"] has a mean of …
+
+            If you are unsure whether something comes from a document or not, either check the context carefully or say you are not certain, rather than guessing.
+            """
+
+def extract_citations(message, relevant_notes):
+    citation_pattern = r'\[Doc:\s*"([^"]+)"\]'
+    matches = finditer(citation_pattern, message)
+
+    title_to_note = {note["title"]: note["note_id"] for note in relevant_notes}
+
+    citations = []
+    for match in matches:
+        cited_title = match.group(1)
+        note_id = None
+        for note_title, nid in title_to_note.items():
+            if cited_title.lower() in note_title.lower() or note_title.lower() in cited_title.lower():
+                note_id = nid
+                break
+        if note_id:
+            citations.append({
+                "note_id": note_id,
+                "title": cited_title,
+                "position": match.start(),
+                "match_text": match.group(0)
+            })
+
+    return citations
+
+
+# questions about the workspace as a whole, answered from note summaries rather than passages
+_OVERVIEW_PATTERN = re.compile(
+    r"\bwhat('s| is) (in|inside) (my|this|the) (workspace|notes|documents|docs|files)\b"
+    r"|\b(summari[sz]e|overview of|list) (all )?(of )?(my|this|the) (workspace|notes|documents|docs|files)\b"
+    r"|\bwhat (notes|documents|docs|files) (do i have|are (there|in))\b"
+    r"|\bwhat (do i have|have i got) in (my|this|the) workspace\b",
+    re.IGNORECASE,
+)
+
+
+# questions that span the workspace without asking for a tour of it ("which of my notes ...",
+# "across all my documents ..."); retrieval alone only sees a handful of notes, so these get the digest too
+_WORKSPACE_WIDE_PATTERN = re.compile(
+    r"\b(in|across|from|throughout|among|between) (all |every |each )?(of )?(my|the|this) (whole |entire )?(workspace|notes|documents|docs|files)\b"
+    r"|\b(all|every|each|any) (of )?(my|the) (notes|documents|docs|files)\b"
+    r"|\b(which|how many) (of my )?(notes|documents|docs|files)\b"
+    r"|\b(common|recurring|main) (themes?|topics?)\b",
+    re.IGNORECASE,
+)
+# share of the context budget the digest may take before passages or note summaries
+DIGEST_CONTEXT_SHARE = 0.4
+
+
+def is_overview_query(message: str) -> bool:
+    return bool(_OVERVIEW_PATTERN.search(message))
+
+
+def is_workspace_wide_query(message: str) -> bool:
+    return bool(_WORKSPACE_WIDE_PATTERN.search(message))
+
+
+def source_data(relevant_notes: List[dict]) -> List[dict]:
+    return [
+        {
+            "note_id": note["note_id"],
+            "title": note["title"],
+            "content": (note["passages"][0]["text"] if note.get("passages") else note.get("summary") or note["content"])[:200],
+            "similarity": note["similarity"],
+            "created_at": note.get("created_at")
+        }
+        for note in relevant_notes
+    ] if relevant_notes else []
+
+
+async def prepare_chat(
+    message: str,
+    workspace_id: uuid.UUID,
+    conversation_history: list,
+    db,
+    use_rag: bool = True,
+    context_tokens: Optional[int] = None,
+    session: Optional[dict] = None,
+) -> dict:
+    """Retrieve and pack context, then build the message list for the completion.
+    With a chat session, its summary and recent turns replace conversation_history.
+    Returns {"messages", "relevant_notes", "packed", "retrieval_ms", "cached", ...};
+    "cached" is a stored response for an equivalent question, if the answer cache has one."""
+    start = time.perf_counter()
+    # before anything is read, so an edit that lands during retrieval keeps the answer out of the cache
+    asked_at = time.time()
+    relevant_notes = []
+    rag_context = ""
+    packed = None
+    prefetch = None
+    rerank = None
+    if session is not None:
+        conversation_history = chat_sessions.history(session)
+
+    budget = context_tokens
+    if budget is not None:
+        budget = max(0, min(budget, RAG_CONTEXT_MAX_TOKENS))
+    overview_query = use_rag and is_overview_query(message)
+    digest_part = None
+    if overview_query or (use_rag and is_workspace_wide_query(message)):
+        total = RAG_CONTEXT_TOKENS if budget is None else budget
+        digest, digest_part = await asyncio.to_thread(_pack_digest, workspace_id, db, int(total * DIGEST_CONTEXT_SHARE))
+        if digest_part["context"]:
+            digest_part["note_ids"] = digest["note_ids"]
+            budget = total - digest_part["tokens_used"]
+        else:
+            digest_part = None
+
+    if overview_query:
+        overview, packed = await asyncio.to_thread(_pack_overview, workspace_id, db, budget)
+        rag_context = packed["context"]
+        packed_ids = set(packed["notes"])
+        relevant_notes = [note for note in overview if note["note_id"] in packed_ids]
+    elif use_rag:
+        indexing_worker.mark_workspace_queried(workspace_id)
+        prefetch = retrieval_prefetcher.record_question(workspace_id, message)
+        # embedding and index loading block, so keep them off the event loop
+        relevant_notes = await asyncio.to_thread(
+            retrieve_relevant_notes,
+            query=message,
+            workspace_id=workspace_id,
+            db=db,
+            top_n=CONTEXT_CANDIDATE_NOTES,
+            passages_per_note=CONTEXT_PASSAGES_PER_NOTE,
+        )
+        # a dense match above the threshold, or any exact keyword hit, counts as relevant
+        if relevant_notes and (
+            relevant_notes[0]["similarity"] > 0.15 or relevant_notes[0].get("lexical_score", 0) > 0
+        ):
+            # optional cross-encoder pass over the candidates, within its latency budget
+            relevant_notes, rerank = await reranker.rerank(message, relevant_notes)
+            packed = await asyncio.to_thread(_pack_passages, relevant_notes, db, budget)
+            rag_context = packed["context"]
+            # only notes that actually made it into the prompt are offered as sources
+            packed_ids = set(packed["notes"])
+            relevant_notes = [note for note in relevant_notes if note["note_id"] in packed_ids]
+        else:
+            relevant_notes = relevant_notes[:3]
+
+    if digest_part is not None:
+        rag_context = digest_part["context"] + ("\n\n" + rag_context if rag_context else "")
+        if packed is None:
+            packed = {"tokens_used": 0, "token_budget": budget, "passages": 0}
+        packed = {
+            **packed,
+            "tokens_used": packed["tokens_used"] + digest_part["tokens_used"],
+            "token_budget": packed["token_budget"] + digest_part["tokens_used"],
+            "digest_sections": digest_part["sections"],
+        }
+
+    system_prompt = SYSTEM_PROMPT
+    if rag_context:
+        system_prompt += DOCUMENTS_PROMPT.replace("{rag_context}", rag_context)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(conversation_history)
+    messages.append({"role": "user", "content": message})
+
+    prepared = {
+        "message": message,
+        "workspace_id": workspace_id,
+        "session_id": session["id"] if session is not None else None,
+        "messages": messages,
+        "relevant_notes": relevant_notes,
+        "packed": packed,
+        "cache_key": None,
+        "cached": None,
+        "asked_at": asked_at,
+        # an answer drawing on the digest depends on every note it covers
+        "digest_note_ids": digest_part["note_ids"] if digest_part else [],
+        # whether retrieval for this question was started while it was being typed
+        "prefetch": prefetch,
+        "rerank": rerank,
+    }
+    # follow-up questions depend on the conversation, so only first turns are cached
+    if use_rag and not conversation_history and is_embedding_model_ready():
+        await asyncio.to_thread(_lookup_answer, message, prepared)
+    prepared["retrieval_ms"] = (time.perf_counter() - start) * 1000
+    return prepared
+
+
+# Packing tokenizes whole notes and summaries, so it runs in the same worker thread as the
+# lookup it packs rather than on the event loop.
+
+def _pack_digest(workspace_id, db, budget: int) -> tuple:
+    digest = get_workspace_digest(workspace_id, db)
+    return digest, pack_digest_context(digest, budget)
+
+
+def _pack_overview(workspace_id, db, budget: Optional[int]) -> tuple:
+    overview = workspace_overview(workspace_id, db)
+    return overview, pack_summary_context(overview, budget)
+
+
+def _pack_passages(relevant_notes: List[dict], db, budget: Optional[int]) -> dict:
+    # spreadsheets go in as column statistics, not raw rows
+    attach_table_stats(relevant_notes, db)
+    return pack_rag_context(relevant_notes, budget)
+
+
+def _lookup_answer(message: str, prepared: dict) -> None:
+    # the query embedding is already cached by retrieval
+    embedding = get_note_embedding(message)
+    note_ids = [note["note_id"] for note in prepared["relevant_notes"]]
+    seen = {str(note_id) for note_id in note_ids}
+    note_ids += [note_id for note_id in prepared["digest_note_ids"] if note_id not in seen]
+    budget = prepared["packed"]["token_budget"] if prepared["packed"] else None
+    prepared["cache_key"] = (embedding, note_ids, budget)
+    prepared["cached"] = answer_cache.lookup(prepared["workspace_id"], embedding, note_ids, budget)
+
+
+async def finish_chat(prepared: dict, payload: dict) -> None:
+    """Record a delivered answer: in the answer cache (if it came from the model)
+    and in the chat session, if there is one."""
+    if not prepared["cached"]:
+        await asyncio.to_thread(remember_answer, prepared, payload)
+    if prepared["session_id"]:
+        payload["session_id"] = prepared["session_id"]
+        await chat_sessions.record_turn(prepared["session_id"], prepared["message"], payload["message"])
+
+
+def remember_answer(prepared: dict, payload: dict) -> None:
+    """Offer a finished answer to the answer cache (no-op if the request wasn't cacheable)."""
+    if prepared["cache_key"] is not None and payload["message"]:
+        embedding, note_ids, budget = prepared["cache_key"]
+        answer_cache.store(prepared["workspace_id"], embedding, note_ids, budget, payload, prepared["asked_at"])
+
+
+def final_payload(message: str, prepared: dict, usage: Optional[dict]) -> dict:
+    """The response body for /ai/chat and the last frame of a streamed answer."""
+    packed = prepared["packed"]
+    return {
+        "message": message,
+        "model": CHAT_MODEL,
+        "usage": usage,
+        "sources": source_data(prepared["relevant_notes"]),
+        "citations": extract_citations(message, prepared["relevant_notes"]),
+        "context": {
+            "tokens_used": packed["tokens_used"],
+            "token_budget": packed["token_budget"],
+            "passages": packed["passages"],
+            "digest_sections": packed.get("digest_sections"),
+        } if packed else None
+    }
+
+
+def _usage_dict(usage) -> Optional[dict]:
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens
+    }
+
+
+async def complete_chat(messages: list) -> tuple:
+    """Non-streamed completion: (text, usage dict)."""
+    response = await llm_client.complete(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=CHAT_MAX_TOKENS,
+        temperature=CHAT_TEMPERATURE
+    )
+    return response.choices[0].message.content, _usage_dict(response.usage)
+
+
+async def stream_chat(messages: list, slot: Optional[LLMSlot] = None) -> AsyncIterator[tuple]:
+    """Yield ("delta", text) as tokens arrive, then ("usage", dict)."""
+    async for chunk in llm_client.stream(
+        slot=slot,
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=CHAT_MAX_TOKENS,
+        temperature=CHAT_TEMPERATURE,
+        stream_options={"include_usage": True},
+    ):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield "delta", chunk.choices[0].delta.content
+        if getattr(chunk, "usage", None):
+            yield "usage", _usage_dict(chunk.usage)
+
+
+class ChatLatencyStats:
+    """Rolling time-to-first-token and total latency over the last `window` chat requests."""
+
+    def __init__(self, window: int = 500):
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streamed = 0
+        self.errors = 0
+
+    def record(self, ttft_ms: Optional[float], total_ms: float, streamed: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.streamed += int(streamed)
+            if ttft_ms is not None:
+                self._ttft.append(ttft_ms)
+            self._total.append(total_ms)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    @staticmethod
+    def _percentile(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "streamed": self.streamed,
+                "errors": self.errors,
+                "ttft_ms_p50": self._percentile(self._ttft, 0.5),
+                "ttft_ms_p95": self._percentile(self._ttft, 0.95),
+                "total_ms_p50": self._percentile(self._total, 0.5),
+                "total_ms_p95": self._percentile(self._total, 0.95),
+            }
+
+
+chat_latency = ChatLatencyStats()
+
+
+async def run_streamed_chat(prepared: dict, started: float, slot: Optional[LLMSlot] = None) -> AsyncIterator[tuple]:
+    """Stream a prepared chat: ("token", {"delta"}) frames, then one ("done", payload)
+    frame with citations, sources and timings (ms since `started`, a perf_counter value).
+    Pass an already-acquired LLM slot to have saturation reported before the stream starts."""
+    if prepared["cached"]:
+        # replay a cached answer as a single frame; no LLM slot needed
+        payload = dict(prepared["cached"])
+        ttft_ms = total_ms = (time.perf_counter() - started) * 1000
+        chat_latency.record(ttft_ms, total_ms, streamed=True)
+        yield "token", {"delta": payload["message"]}
+        await finish_chat(prepared, payload)
+        payload["timing"] = {
+            "retrieval_ms": prepared["retrieval_ms"],
+            "prefetch": prepared["prefetch"],
+            "rerank": prepared["rerank"],
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms,
+        }
+        yield "done", payload
+        return
+
+    parts = []
+    usage = None
+    ttft_ms = None
+    try:
+        async for kind, value in stream_chat(prepared["messages"], slot):
+            if kind == "delta":
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                parts.append(value)
+                yield "token", {"delta": value}
+            elif kind == "usage":
+                usage = value
+    except Exception:
+        chat_latency.record_error()
+        raise
+
+    total_ms = (time.perf_counter() - started) * 1000
+    chat_latency.record(ttft_ms, total_ms, streamed=True)
+    payload = final_payload("".join(parts), prepared, usage)
+    await finish_chat(prepared, payload)
+    payload["timing"] = {
+        "retrieval_ms": prepared["retrieval_ms"],
+        "prefetch": prepared["prefetch"],
+        "rerank": prepared["rerank"],
+        "ttft_ms": ttft_ms,
+        "total_ms": total_ms,
+    }
+    yield "done", payload
@@ -0,0 +1,138 @@
+import math
+import os
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from services.vector_index import VectorIndex, normalize
+
+# below this many vectors exact search is already fast enough and always exact
+ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "20000"))
+ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "32"))
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity; returns unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # reseed empty clusters from random points so every list stays useful
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFVectorIndex(VectorIndex):
+    """VectorIndex with an inverted-file (IVF) coarse quantizer for large workspaces.
+
+    Every row is assigned to its nearest k-means centroid. A query scores the
+    centroids, then only the rows in the nprobe closest clusters. Below
+    `threshold` rows (or before the quantizer is trained) search is exact.
+    Upserts are assigned to the current centroids. Training happens on the write
+    path when the index crosses the threshold and again whenever it doubles, so
+    a query never pays for k-means."""
+
+    def __init__(self, dim: Optional[int] = None, threshold: int = ANN_THRESHOLD, nprobe: int = ANN_NPROBE, **kwargs):
+        super().__init__(dim, **kwargs)
+        self.threshold = threshold
+        self.nprobe = nprobe
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+
+    @classmethod
+    def from_vectors(cls, ids, vectors, dim: Optional[int] = None, **kwargs) -> "IVFVectorIndex":
+        index = super().from_vectors(ids, vectors, dim, **kwargs)
+        index.maybe_train()
+        return index
+
+    @classmethod
+    def from_arrays(cls, ids, matrix, scales=None, full=None, centroids=None, assign=None, **kwargs) -> "IVFVectorIndex":
+        index = super().from_arrays(ids, matrix, scales, full, **kwargs)
+        if centroids is not None and assign is not None:
+            index._centroids, index._assign, index._trained_size = centroids, assign, len(index.ids)
+        else:
+            index.maybe_train()
+        return index
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    @property
+    def nbytes(self) -> int:
+        extra = self._assign.nbytes + (self._centroids.nbytes if self._centroids is not None else 0)
+        return super().nbytes + extra
+
+    def train(self, seed: int = 0) -> None:
+        n = len(self.ids)
+        n_clusters = int(min(4096, max(16, 2 * math.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, n_clusters * 32)
+        sample = np.sort(rng.choice(n, sample_size, replace=False)) if sample_size < n else np.arange(n)
+        self._centroids = spherical_kmeans(normalize(self.decode(sample)), n_clusters, seed=seed)
+        self._assign = np.empty(self._matrix.shape[0], dtype=np.int32)
+        self._assign[:n] = self._nearest_centroids(n)
+        self._trained_size = n
+
+    def maybe_train(self) -> None:
+        n = len(self.ids)
+        if n >= self.threshold and (self._centroids is None or n > 2 * self._trained_size):
+            self.train()
+
+    def _nearest_centroids(self, n: int) -> np.ndarray:
+        # chunked so a big retrain doesn't materialise an n x n_clusters matrix at once
+        out = np.empty(n, dtype=np.int32)
+        for start in range(0, n, 8192):
+            rows = self.decode(slice(start, min(n, start + 8192)))
+            out[start:start + 8192] = np.argmax(rows @ self._centroids.T, axis=1)
+        return out
+
+    def _ensure_writable(self) -> None:
+        super()._ensure_writable()
+        if not self._assign.flags.writeable:
+            self._assign = np.array(self._assign)
+
+    def upsert(self, item_id: Hashable, vector: np.ndarray) -> None:
+        super().upsert(item_id, vector)
+        if self._centroids is None or len(self.ids) > 2 * self._trained_size:
+            self.maybe_train()
+            return
+        if self._assign.shape[0] < self._matrix.shape[0]:
+            grown = np.empty(self._matrix.shape[0], dtype=np.int32)
+            grown[:self._assign.shape[0]] = self._assign
+            self._assign = grown
+        pos = self._positions[item_id]
+        self._assign[pos] = int(np.argmax(self._centroids @ self.decode(pos)))
+
+    def remove(self, item_id: Hashable) -> bool:
+        pos = self._positions.get(item_id)
+        last = len(self.ids) - 1
+        removed = super().remove(item_id)
+        if removed and self._centroids is not None and pos != last:
+            self._assign[pos] = self._assign[last]
+        return removed
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        if not self.ids or k <= 0:
+            return []
+        query = normalize(query)
+        return self._search(query, k, self._probe(query, k, nprobe))
+
+    def _probe(self, query: np.ndarray, k: int, nprobe: Optional[int]) -> Optional[np.ndarray]:
+        """Row positions in the nprobe nearest clusters, or None to scan everything."""
+        n = len(self.ids)
+        if n < self.threshold or self._centroids is None:
+            return None
+        nprobe = min(nprobe or self.nprobe, len(self._centroids))
+        centroid_scores = self._centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        candidates = np.flatnonzero(np.isin(self._assign[:n], probes))
+        return candidates if len(candidates) >= k else None
@@ -0,0 +1,298 @@
+"""Semantic cache of AI chat answers.
+
+A stored answer is reused for a new question in the same workspace when
+  * the question embeddings are at least ANSWER_CACHE_THRESHOLD cosine-similar,
+  * retrieval picked the same notes for the new question, under the same context budget, and
+  * the workspace content version has not moved since the answer was stored.
+The version is bumped when notes are deleted or the workspace is dropped; an edit
+to a note evicts just the answers that were built from it (their sources). Edits
+are evicted twice, when the note is queued for indexing and again once the index
+has it. Each eviction is also stamped, and an answer is not stored if one of its
+notes changed after the question was asked, because it may have been built from
+the old text.
+
+Entries live in Redis when it is reachable, so every API process shares them,
+and in process memory otherwise. Only first-turn questions are cached: with
+conversation history the same words can mean something else.
+"""
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_PER_WORKSPACE = int(os.getenv("ANSWER_CACHE_MAX_PER_WORKSPACE", "200"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+
+# key of the workspace-wide change stamp, next to the per-note ones
+_WORKSPACE_STAMP = "*"
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode("ascii")
+
+
+def _decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float16).astype(np.float32)
+
+
+class _MemoryBackend:
+    """Per-process store with the same layout as the Redis one."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._meta: Dict[str, "OrderedDict[str, dict]"] = {}
+        self._payloads: Dict[str, Dict[str, dict]] = {}
+        self._changed: Dict[str, Dict[str, float]] = {}
+
+    def version(self, ws: str) -> int:
+        with self._lock:
+            return self._versions.get(ws, 0)
+
+    def bump(self, ws: str) -> None:
+        with self._lock:
+            self._versions[ws] = self._versions.get(ws, 0) + 1
+            self._meta.pop(ws, None)
+            self._payloads.pop(ws, None)
+            self._changed[ws] = {_WORKSPACE_STAMP: time.time()}
+
+    def entries(self, ws: str) -> List[tuple]:
+        with self._lock:
+            now = time.time()
+            return [(eid, meta) for eid, meta in self._meta.get(ws, {}).items() if now - meta["t"] < ANSWER_CACHE_TTL]
+
+    def payload(self, ws: str, entry_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._payloads.get(ws, {}).get(entry_id)
+
+    def put(self, ws: str, entry_id: str, meta: dict, payload: dict) -> None:
+        with self._lock:
+            metas = self._meta.setdefault(ws, OrderedDict())
+            payloads = self._payloads.setdefault(ws, {})
+            metas[entry_id] = meta
+            payloads[entry_id] = payload
+            while len(metas) > ANSWER_CACHE_MAX_PER_WORKSPACE:
+                oldest, _ = metas.popitem(last=False)
+                payloads.pop(oldest, None)
+
+    def drop_note(self, ws: str, note_id: str) -> int:
+        with self._lock:
+            metas = self._meta.get(ws, {})
+            stale = [eid for eid, meta in metas.items() if note_id in meta["notes"]]
+            for eid in stale:
+                metas.pop(eid, None)
+                self._payloads.get(ws, {}).pop(eid, None)
+            now = time.time()
+            # a stamp older than any cached answer can't refuse one
+            changed = {key: t for key, t in self._changed.get(ws, {}).items() if now - t < ANSWER_CACHE_TTL}
+            changed[note_id] = now
+            self._changed[ws] = changed
+            return len(stale)
+
+    def changed_since(self, ws: str, note_ids: List[str], since: float) -> bool:
+        with self._lock:
+            changed = self._changed.get(ws, {})
+            return any(changed.get(key, 0.0) >= since for key in [*note_ids, _WORKSPACE_STAMP])
+
+
+class _RedisBackend:
+    """answer_cache:{ws}:version  counter
+    answer_cache:{ws}:meta     hash entry_id -> {v, notes, budget, emb, t} (small, read on every lookup)
+    answer_cache:{ws}:payload  hash entry_id -> response body (read on a hit)
+    answer_cache:{ws}:changed  hash note_id (or "*" for the workspace) -> when it last changed"""
+
+    name = "redis"
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    @staticmethod
+    def _key(ws: str, part: str) -> str:
+        return f"answer_cache:{ws}:{part}"
+
+    def version(self, ws: str) -> int:
+        return int(self._redis.get(self._key(ws, "version")) or 0)
+
+    def bump(self, ws: str) -> None:
+        pipe = self._redis.pipeline()
+        pipe.incr(self._key(ws, "version"))
+        pipe.delete(self._key(ws, "meta"), self._key(ws, "payload"))
+        self._stamp(pipe, ws, _WORKSPACE_STAMP)
+        pipe.execute()
+
+    def _stamp(self, pipe, ws: str, key: str) -> None:
+        changed_key = self._key(ws, "changed")
+        pipe.hset(changed_key, key, time.time())
+        # answers live no longer than this, so neither does a reason to refuse one
+        pipe.expire(changed_key, ANSWER_CACHE_TTL)
+
+    def entries(self, ws: str) -> List[tuple]:
+        raw = self._redis.hgetall(self._key(ws, "meta"))
+        return [(eid, json.loads(meta)) for eid, meta in raw.items()]
+
+    def payload(self, ws: str, entry_id: str) -> Optional[dict]:
+        raw = self._redis.hget(self._key(ws, "payload"), entry_id)
+        return json.loads(raw) if raw else None
+
+    def put(self, ws: str, entry_id: str, meta: dict, payload: dict) -> None:
+        meta_key, payload_key = self._key(ws, "meta"), self._key(ws, "payload")
+        pipe = self._redis.pipeline()
+        pipe.hset(meta_key, entry_id, json.dumps(meta))
+        pipe.hset(payload_key, entry_id, json.dumps(payload, default=str))
+        pipe.expire(meta_key, ANSWER_CACHE_TTL)
+        pipe.expire(payload_key, ANSWER_CACHE_TTL)
+        pipe.hlen(meta_key)
+        size = pipe.execute()[-1]
+        if size > ANSWER_CACHE_MAX_PER_WORKSPACE:
+            entries = sorted(self.entries(ws), key=lambda e: e[1]["t"])
+            oldest = [eid for eid, _ in entries[:size - ANSWER_CACHE_MAX_PER_WORKSPACE]]
+            if oldest:
+                self._redis.hdel(meta_key, *oldest)
+                self._redis.hdel(payload_key, *oldest)
+
+    def drop_note(self, ws: str, note_id: str) -> int:
+        stale = [eid for eid, meta in self.entries(ws) if note_id in meta["notes"]]
+        pipe = self._redis.pipeline()
+        if stale:
+            pipe.hdel(self._key(ws, "meta"), *stale)
+            pipe.hdel(self._key(ws, "payload"), *stale)
+        self._stamp(pipe, ws, note_id)
+        pipe.execute()
+        return len(stale)
+
+    def changed_since(self, ws: str, note_ids: List[str], since: float) -> bool:
+        stamps = self._redis.hmget(self._key(ws, "changed"), [*note_ids, _WORKSPACE_STAMP])
+        return any(stamp is not None and float(stamp) >= since for stamp in stamps)
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self._backend = None
+        self._backend_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.refused = 0
+        self.errors = 0
+
+    def _get_backend(self):
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    from services.redis_manager import get_redis_connection
+                    redis = get_redis_connection()
+                    self._backend = _RedisBackend(redis) if redis else _MemoryBackend()
+                    print(f"Answer cache using {self._backend.name} storage", flush=True)
+        return self._backend
+
+    def lookup(self, workspace_id, embedding: np.ndarray, note_ids: List, budget: Optional[int]) -> Optional[dict]:
+        """The stored response for a close-enough question over the same notes, or None."""
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        ws, notes = str(workspace_id), sorted(str(n) for n in note_ids)
+        try:
+            backend = self._get_backend()
+            version = backend.version(ws)
+            candidates = [
+                (eid, meta) for eid, meta in backend.entries(ws)
+                if meta["v"] == version and meta["notes"] == notes and meta["budget"] == budget
+            ]
+            if candidates:
+                query = np.asarray(embedding, dtype=np.float32)
+                query = query / max(float(np.linalg.norm(query)), 1e-12)
+                matrix = np.stack([_decode_vector(meta["emb"]) for _, meta in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    payload = backend.payload(ws, candidates[best][0])
+                    if payload is not None:
+                        self.hits += 1
+                        return {**payload, "cache": {"hit": True, "similarity": float(scores[best])}}
+        except Exception as e:
+            self.errors += 1
+            print(f"Answer cache lookup failed: {e}", flush=True)
+        self.misses += 1
+        return None
+
+    def store(
+        self,
+        workspace_id,
+        embedding: np.ndarray,
+        note_ids: List,
+        budget: Optional[int],
+        payload: dict,
+        asked_at: Optional[float] = None,
+    ) -> None:
+        """Keep an answer, unless one of its notes changed after `asked_at` (time.time() when the question came in)."""
+        if not ANSWER_CACHE_ENABLED:
+            return
+        ws, notes = str(workspace_id), sorted(str(n) for n in note_ids)
+        vector = np.asarray(embedding, dtype=np.float32)
+        try:
+            backend = self._get_backend()
+            if asked_at is not None and backend.changed_since(ws, notes, asked_at):
+                self.refused += 1
+                return
+            meta = {
+                "v": backend.version(ws),
+                "notes": notes,
+                "budget": budget,
+                "emb": _encode_vector(vector / max(float(np.linalg.norm(vector)), 1e-12)),
+                "t": time.time(),
+            }
+            # stored as plain JSON either way, so both backends hand back the same shape
+            backend.put(ws, uuid.uuid4().hex, meta, json.loads(json.dumps(payload, default=str)))
+            self.stores += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Answer cache store failed: {e}", flush=True)
+
+    def note_changed(self, workspace_id, note_id) -> None:
+        """Evict answers built from this note (it was edited)."""
+        if not ANSWER_CACHE_ENABLED or workspace_id is None:
+            return
+        try:
+            self.evictions += self._get_backend().drop_note(str(workspace_id), str(note_id))
+        except Exception as e:
+            self.errors += 1
+            print(f"Answer cache eviction failed: {e}", flush=True)
+
+    def workspace_changed(self, workspace_id) -> None:
+        """Invalidate every answer for the workspace (notes deleted, workspace dropped)."""
+        if not ANSWER_CACHE_ENABLED or workspace_id is None:
+            return
+        try:
+            self._get_backend().bump(str(workspace_id))
+        except Exception as e:
+            self.errors += 1
+            print(f"Answer cache invalidation failed: {e}", flush=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "backend": self._backend.name if self._backend else None,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "refused": self.refused,
+            "errors": self.errors,
+        }
+
+
+answer_cache = AnswerCache()
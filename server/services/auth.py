@@ -18,6 +18,9 @@ AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "")
 AUTH0_API_AUDIENCE = os.getenv("AUTH0_API_AUDIENCE", "")
 AUTH0_ALGORITHMS = ["RS256"]
 
+# Comma-separated emails of the users allowed to read operational endpoints such as /ai/stats
+OPS_ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("OPS_ADMIN_EMAILS", "").split(",") if e.strip()}
+
 security = HTTPBearer(auto_error=False)
 
 # Cache for JWKS
@@ -141,6 +144,31 @@ async def get_current_user(
     return user
 
 
+async def get_ops_admin(current_user: User = Depends(get_current_user)) -> User:
+    """Get the current user if they are listed in OPS_ADMIN_EMAILS, or raise 403"""
+    if not current_user.email or current_user.email.lower() not in OPS_ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed"
+        )
+    return current_user
+
+
+async def verify_token_and_get_user(token: str, db: Session) -> User:
+    """Verify a token string and return the associated user."""
+    payload = await verify_token(token)
+    auth0_id = payload.get("sub")
+    
+    if not auth0_id:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    
+    user = db.query(User).filter(User.auth0_id == auth0_id).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    return user
+
+
 def get_or_create_user(db: Session, auth0_id: str, email: str, name: str, 
                        email_verified: bool = False, picture: Optional[str] = None) -> User:
     """Get existing user or create new one from Auth0 data"""
@@ -0,0 +1,97 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, List, Tuple
+
+# identifiers like INV-2024-001, v1.2.3 or a.b@c.com are kept whole *and* split into their parts
+_COMPOUND_RE = re.compile(r"\w+(?:[-.:/@#]\w+)*")
+_PART_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _COMPOUND_RE.finditer(text.lower()):
+        compound = match.group(0)
+        tokens.append(compound)
+        parts = _PART_RE.findall(compound)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Fuse several best-first rankings: score(d) = sum over rankings of 1 / (k + rank)."""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, 1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Incrementally maintained inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Counter] = {}
+        self._doc_lengths: Dict[Hashable, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._doc_lengths
+
+    @property
+    def nbytes(self) -> int:
+        # rough: one dict slot per posting plus the vocabulary itself
+        postings = sum(len(docs) for docs in self._postings.values())
+        return postings * 64 + sum(len(term) + 64 for term in self._postings)
+
+    def add(self, doc_id: Hashable, text: str) -> None:
+        self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: Hashable) -> bool:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            docs = self._postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self._postings[term]
+        return True
+
+    def search(self, query: str, k: int) -> List[Tuple[Hashable, float]]:
+        """Return up to k (doc_id, BM25 score) pairs with a positive score, best first."""
+        n = len(self._doc_lengths)
+        if n == 0 or k <= 0:
+            return []
+
+        avg_length = self._total_length / n or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            df = len(docs)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1.0 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,247 @@
+"""Server-side AI chat sessions with a rolling summary.
+
+A session keeps the recent turns of one user's conversation in one workspace,
+so a chat request only has to send its session_id. Once the stored turns cost
+more than CHAT_SESSION_SUMMARY_TRIGGER tokens, everything but the last
+CHAT_SESSION_KEEP_TURNS messages is folded into a running summary by the LLM
+(in the background, after the answer has been sent). The history sent to the
+model is then the summary plus the recent turns, capped at
+CHAT_SESSION_MAX_TOKENS, so prompt size stays bounded however long the
+conversation runs.
+
+Sessions live in Redis when it is reachable (shared by every API process) and
+in process memory otherwise, and expire after CHAT_SESSION_TTL of inactivity.
+Changes to a stored session are read-modify-writes that retry (Redis WATCH) or
+hold the store's lock, so a turn is never lost to a concurrent summary.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from services.context_packer import count_tokens
+from services.llm_client import llm_client, LLMSaturated
+
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(7 * 24 * 3600)))
+CHAT_SESSION_SUMMARY_TRIGGER = int(os.getenv("CHAT_SESSION_SUMMARY_TRIGGER", "1500"))
+CHAT_SESSION_MAX_TOKENS = int(os.getenv("CHAT_SESSION_MAX_TOKENS", "2500"))
+CHAT_SESSION_KEEP_TURNS = int(os.getenv("CHAT_SESSION_KEEP_TURNS", "4"))
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 400
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant about the notes in their workspace.
+Merge the previous summary and the new messages into one updated summary of at most 250 words.
+Keep facts, decisions, names, numbers, document titles the assistant cited, and any open questions or instructions the user gave.
+Drop greetings and small talk. Write in the third person ("The user asked...")."""
+
+
+class _MemoryStore:
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, tuple] = {}
+
+    def _get(self, session_id: str) -> Optional[dict]:
+        entry = self._sessions.get(session_id)
+        if entry is None or time.time() - entry[0] > CHAT_SESSION_TTL:
+            self._sessions.pop(session_id, None)
+            return None
+        return json.loads(entry[1])
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._get(session_id)
+
+    def put(self, session: dict) -> None:
+        with self._lock:
+            self._sessions[session["id"]] = (time.time(), json.dumps(session))
+
+    def update(self, session_id: str, change: Callable[[dict], bool]) -> Optional[dict]:
+        with self._lock:
+            session = self._get(session_id)
+            if session is None or not change(session):
+                return None
+            self._sessions[session_id] = (time.time(), json.dumps(session))
+            return session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class _RedisStore:
+    name = "redis"
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"chat_session:{session_id}"
+
+    def get(self, session_id: str) -> Optional[dict]:
+        raw = self._redis.get(self._key(session_id))
+        return json.loads(raw) if raw else None
+
+    def put(self, session: dict) -> None:
+        self._redis.set(self._key(session["id"]), json.dumps(session), ex=CHAT_SESSION_TTL)
+
+    def update(self, session_id: str, change: Callable[[dict], bool]) -> Optional[dict]:
+        key = self._key(session_id)
+
+        def apply(pipe):
+            # WATCHed: if another write lands first the transaction is retried from a fresh read
+            raw = pipe.get(key)
+            session = json.loads(raw) if raw else None
+            if session is None or not change(session):
+                return None
+            pipe.multi()
+            pipe.set(key, json.dumps(session), ex=CHAT_SESSION_TTL)
+            return session
+
+        return self._redis.transaction(apply, key, value_from_callable=True)
+
+    def delete(self, session_id: str) -> None:
+        self._redis.delete(self._key(session_id))
+
+
+class ChatSessionStore:
+    def __init__(self):
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._compacting = set()
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def _get_store(self):
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    from services.redis_manager import get_redis_connection
+                    redis = get_redis_connection()
+                    self._store = _RedisStore(redis) if redis else _MemoryStore()
+                    print(f"Chat sessions using {self._store.name} storage", flush=True)
+        return self._store
+
+    def create(self, workspace_id, user_id) -> dict:
+        session = {
+            "id": uuid.uuid4().hex,
+            "workspace_id": str(workspace_id),
+            "user_id": str(user_id),
+            "summary": "",
+            "summarized_turns": 0,
+            "turns": [],
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+        self._get_store().put(session)
+        return session
+
+    def get(self, session_id: str, workspace_id=None, user_id=None) -> Optional[dict]:
+        """The session, or None if it does not exist, expired, or belongs to someone else."""
+        session = self._get_store().get(session_id)
+        if session is None:
+            return None
+        if user_id is not None and session["user_id"] != str(user_id):
+            return None
+        if workspace_id is not None and session["workspace_id"] != str(workspace_id):
+            return None
+        return session
+
+    def delete(self, session_id: str) -> None:
+        self._get_store().delete(session_id)
+
+    def history(self, session: dict) -> List[dict]:
+        """Messages to send ahead of the new question: the summary, then as many recent
+        turns as fit in CHAT_SESSION_MAX_TOKENS (a pending or failed compaction can't grow the prompt)."""
+        budget = CHAT_SESSION_MAX_TOKENS
+        prefix = []
+        if session["summary"]:
+            summary = f"Summary of the earlier conversation:\n{session['summary']}"
+            prefix.append({"role": "system", "content": summary})
+            budget -= count_tokens(summary)
+        recent = []
+        for turn in reversed(session["turns"]):
+            cost = count_tokens(turn["content"]) + 4
+            if cost > budget and recent:
+                break
+            budget -= cost
+            recent.append({"role": turn["role"], "content": turn["content"]})
+        return prefix + recent[::-1]
+
+    def append_turn(self, session_id: str, question: str, answer: str) -> Optional[dict]:
+        def append(session: dict) -> bool:
+            session["turns"].append({"role": "user", "content": question})
+            session["turns"].append({"role": "assistant", "content": answer})
+            session["updated_at"] = time.time()
+            return True
+
+        return self._get_store().update(session_id, append)
+
+    def needs_summary(self, session: dict) -> bool:
+        if len(session["turns"]) <= CHAT_SESSION_KEEP_TURNS:
+            return False
+        return sum(count_tokens(t["content"]) for t in session["turns"]) > CHAT_SESSION_SUMMARY_TRIGGER
+
+    async def record_turn(self, session_id: str, question: str, answer: str) -> None:
+        """Store a finished exchange and, if the session got too long, start compacting it."""
+        session = await asyncio.to_thread(self.append_turn, session_id, question, answer)
+        if session is not None and self.needs_summary(session) and session_id not in self._compacting:
+            self._compacting.add(session_id)
+            asyncio.create_task(self._compact(session_id))
+
+    async def _compact(self, session_id: str) -> None:
+        try:
+            session = await asyncio.to_thread(self._get_store().get, session_id)
+            if session is None:
+                return
+            old = session["turns"][:-CHAT_SESSION_KEEP_TURNS]
+            transcript = "\n".join(f"{t['role'].upper()}: {t['content']}" for t in old)
+            response = await llm_client.complete(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Previous summary:\n{session['summary'] or '(none)'}\n\nNew messages:\n{transcript}"},
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.2,
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            if summary:
+                await asyncio.to_thread(self._apply_summary, session_id, old, summary)
+        except LLMSaturated:
+            # the assistant is busy answering people; try again after the next turn
+            pass
+        except Exception as e:
+            self.summary_failures += 1
+            print(f"Chat session summary failed for {session_id}: {e}", flush=True)
+        finally:
+            self._compacting.discard(session_id)
+
+    def _apply_summary(self, session_id: str, summarized: List[dict], summary: str) -> None:
+        def fold(session: dict) -> bool:
+            # turns are only ever appended, so the summarized ones are still the prefix
+            if session["turns"][:len(summarized)] != summarized:
+                return False
+            session["summary"] = summary
+            session["turns"] = session["turns"][len(summarized):]
+            session["summarized_turns"] += len(summarized)
+            return True
+
+        if self._get_store().update(session_id, fold) is not None:
+            self.summaries += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": self._store.name if self._store else None,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "compacting": len(self._compacting),
+        }
+
+
+chat_sessions = ChatSessionStore()
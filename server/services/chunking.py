@@ -0,0 +1,55 @@
+import re
+from typing import List, Tuple
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces; leave room for the title prefix and special tokens
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 40
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def _token_spans(text: str, tokenizer=None) -> List[Tuple[int, int]]:
+    """Character span of every token in text.
+
+    Uses the embedding model's (fast) tokenizer when given so chunks line up with
+    what the model actually sees; falls back to whitespace-separated words."""
+    if tokenizer is not None:
+        try:
+            encoded = tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                truncation=False,
+                verbose=False,
+            )
+            return [(start, end) for start, end in encoded["offset_mapping"] if end > start]
+        except Exception:
+            pass
+    return [match.span() for match in _WORD_RE.finditer(text)]
+
+
+def chunk_text(
+    text: str,
+    tokenizer=None,
+    max_tokens: int = CHUNK_TOKENS,
+    overlap: int = CHUNK_OVERLAP,
+) -> List[Tuple[int, int]]:
+    """Split text into overlapping windows of at most max_tokens tokens.
+
+    Returns (start, end) character offsets into text so callers can slice out
+    passages without storing them twice."""
+    spans = _token_spans(text, tokenizer)
+    if not spans:
+        return []
+    if len(spans) <= max_tokens:
+        return [(spans[0][0], spans[-1][1])]
+
+    step = max(1, max_tokens - overlap)
+    chunks = []
+    for first in range(0, len(spans), step):
+        last = min(first + max_tokens, len(spans)) - 1
+        chunks.append((spans[first][0], spans[last][1]))
+        if last == len(spans) - 1:
+            break
+    return chunks
+
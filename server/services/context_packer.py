@@ -0,0 +1,248 @@
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional
+
+# default prompt budget for retrieved passages; callers can override per request
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1500"))
+# upper bound for a per-request budget
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "8000"))
+# how much retrieval hands the packer to choose from
+CONTEXT_CANDIDATE_NOTES = 6
+CONTEXT_PASSAGES_PER_NOTE = 4
+# a passage that doesn't fit is cut down to the remaining budget if at least this much is left
+MIN_TRUNCATED_TOKENS = 48
+# the chat model's encoding (gpt-4o / gpt-4o-mini)
+RAG_CONTEXT_ENCODING = os.getenv("RAG_CONTEXT_ENCODING", "o200k_base")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    # downloaded on first use unless TIKTOKEN_CACHE_DIR already holds it
+                    _encoding = tiktoken.get_encoding(RAG_CONTEXT_ENCODING)
+                except Exception as e:
+                    print(f"tiktoken unavailable ({e}); estimating context tokens from length", flush=True)
+                _encoding_loaded = True
+    return _encoding
+
+
+def preload_encoding_async():
+    """Load the tokenizer in a background thread at startup, so no request waits for it."""
+    threading.Thread(target=_get_encoding, daemon=True).start()
+
+
+def count_tokens(text: str) -> int:
+    """Tokens `text` costs in the chat prompt (about 4 characters per token without tiktoken)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _prefix_length(text: str, max_tokens: int) -> int:
+    """Length of the longest whole-word prefix of text that fits in max_tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        limit = max_tokens * 4
+    else:
+        limit = len(encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]).rstrip("\ufffd"))
+    if limit >= len(text):
+        return len(text)
+    cut = text.rfind(" ", 0, limit + 1)
+    return cut if cut > 0 else 0
+
+
+def _fingerprint(text: str) -> bytes:
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).digest()
+
+
+def _note_header(note: dict) -> str:
+    return f"\n--- Title: \"{note['title']}\" (ID: {note['note_id']}, relevance: {note['similarity']:.2f}) ---"
+
+
+def _uncovered(spans: List[tuple], start: int, end: int) -> List[tuple]:
+    """Parts of [start, end) not already covered by the (sorted, disjoint) spans."""
+    pieces = []
+    cursor = start
+    for s, e in spans:
+        if e <= cursor or s >= end:
+            continue
+        if s > cursor:
+            pieces.append((cursor, s))
+        cursor = max(cursor, e)
+    if cursor < end:
+        pieces.append((cursor, end))
+    return pieces
+
+
+def _merge(spans: List[tuple], start: int, end: int) -> List[tuple]:
+    merged = []
+    for s, e in sorted(spans + [(start, end)]):
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def _candidates(relevant_notes: List[dict]) -> List[tuple]:
+    """(score, note index, start, end) for every retrieved passage, best first.
+    A note without passages offers its whole content, or just its title line."""
+    out = []
+    for i, note in enumerate(relevant_notes):
+        passages = [p for p in note.get("passages", []) if p["text"].strip()]
+        if passages:
+            out.extend((p["score"], i, p["start"], p["end"]) for p in passages)
+        else:
+            out.append((note.get("score", 0.0), i, 0, len((note.get("content") or "").rstrip())))
+    out.sort(key=lambda c: (-c[0], c[1], c[2]))
+    return out
+
+
+def pack_rag_context(relevant_notes: List[dict], token_budget: Optional[int] = None) -> Dict:
+    """Greedily fill a token budget with the highest-scoring retrieved passages.
+
+    Overlapping chunks of the same note are merged so shared text is only paid
+    for once, and passages whose text already appears elsewhere in the context
+    are skipped. A passage too big for what is left is cut at a word boundary
+    (if a useful amount of room remains). Passages are laid out per note in document order. Returns
+    {"context", "tokens_used", "token_budget", "notes", "passages", "truncated", "skipped"};
+    "notes" are the note ids that made it in, in ranking order."""
+    budget = RAG_CONTEXT_TOKENS if token_budget is None else max(0, token_budget)
+    intro = "Here are the most relevant passages from the workspace:\n"
+    used = count_tokens(intro)
+    selected: Dict[int, List[tuple]] = {}
+    seen_text = set()
+    passages = 0
+    skipped = 0
+    truncated = 0
+
+    for _, i, start, end in _candidates(relevant_notes):
+        note = relevant_notes[i]
+        content = note["content"] or ""
+        spans = selected.get(i, [])
+        pieces = [(s, e) for s, e in _uncovered(spans, start, end) if _fingerprint(content[s:e]) not in seen_text]
+        if not pieces and (start < end or i in selected):
+            skipped += 1
+            continue
+
+        # +3 per part for the joining newline and the "..." markers
+        header = count_tokens(_note_header(note)) + 1 if i not in selected else 0
+        cost = header + sum(count_tokens(content[s:e]) + 3 for s, e in pieces)
+        if used + cost > budget:
+            room = budget - used - header - 3
+            if len(pieces) != 1 or room < MIN_TRUNCATED_TOKENS:
+                skipped += 1
+                continue
+            s, e = pieces[0]
+            cut = _prefix_length(content[s:e], room)
+            if not content[s:s + cut].strip():
+                skipped += 1
+                continue
+            pieces = [(s, s + cut)]
+            cost = header + count_tokens(content[s:s + cut]) + 3
+            truncated += 1
+
+        used += cost
+        passages += 1
+        for s, e in pieces:
+            seen_text.add(_fingerprint(content[s:e]))
+            spans = _merge(spans, s, e)
+        selected[i] = spans
+
+    if not selected:
+        return {"context": "", "tokens_used": 0, "token_budget": budget, "notes": [], "passages": 0, "truncated": 0, "skipped": skipped}
+
+    parts = [intro]
+    order = sorted(selected)
+    for i in order:
+        note = relevant_notes[i]
+        content = note["content"] or ""
+        parts.append(_note_header(note))
+        # keep passages in document order so the excerpt reads naturally
+        for s, e in selected[i]:
+            prefix = "..." if s > 0 else ""
+            suffix = "..." if e < len(content) else ""
+            parts.append(f"{prefix}{content[s:e]}{suffix}")
+    context = "\n".join(parts)
+
+    return {
+        "context": context,
+        "tokens_used": count_tokens(context),
+        "token_budget": budget,
+        "notes": [relevant_notes[i]["note_id"] for i in order],
+        "passages": passages,
+        "truncated": truncated,
+        "skipped": skipped,
+    }
+
+
+def pack_summary_context(notes: List[dict], token_budget: Optional[int] = None) -> Dict:
+    """Workspace overview for broad questions: one entry per note, using its stored
+    summary (or the opening of a short note), in the order given until the budget
+    is spent. Same return shape as pack_rag_context."""
+    budget = RAG_CONTEXT_TOKENS if token_budget is None else max(0, token_budget)
+    intro = f"Here is an overview of the {len(notes)} notes in the workspace:\n"
+    used = count_tokens(intro)
+    parts = [intro]
+    included = []
+    skipped = 0
+    for note in notes:
+        text = (note.get("summary") or note.get("content") or "").strip()
+        header = f"\n--- Title: \"{note['title']}\" (ID: {note['note_id']}) ---"
+        cost = count_tokens(header) + count_tokens(text) + 2
+        if used + cost > budget:
+            skipped += 1
+            continue
+        used += cost
+        parts.append(header)
+        if text:
+            parts.append(text)
+        included.append(note["note_id"])
+
+    if not included:
+        return {"context": "", "tokens_used": 0, "token_budget": budget, "notes": [], "passages": 0, "truncated": 0, "skipped": skipped}
+    context = "\n".join(parts)
+    return {
+        "context": context,
+        "tokens_used": count_tokens(context),
+        "token_budget": budget,
+        "notes": included,
+        "passages": len(included),
+        "truncated": 0,
+        "skipped": skipped,
+    }
+
+
+def pack_digest_context(digest: Optional[dict], token_budget: int) -> Dict:
+    """The workspace digest (services/workspace_digest.py) for whole-workspace questions:
+    the workspace summary, then section summaries in order while they fit.
+    Returns {"context", "tokens_used", "sections"}."""
+    if not digest or not digest.get("summary"):
+        return {"context": "", "tokens_used": 0, "sections": 0}
+    parts = [f"Summary of the whole workspace:\n{digest['summary']}"]
+    used = count_tokens(parts[0])
+    if used > token_budget:
+        return {"context": "", "tokens_used": 0, "sections": 0}
+    sections = 0
+    for section in digest.get("sections", []):
+        text = f"\nSection {sections + 1} ({len(section['note_ids'])} notes):\n{section['summary']}"
+        cost = count_tokens(text)
+        if used + cost > token_budget:
+            break
+        used += cost
+        parts.append(text)
+        sections += 1
+    context = "\n".join(parts)
+    return {"context": context, "tokens_used": count_tokens(context), "sections": sections}
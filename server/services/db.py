@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
@@ -25,6 +25,16 @@ else:
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
+# tables of earlier schemas that nothing reads any more; there are no migrations to remove them
+SUPERSEDED_TABLES = [
+    "note_embeddings",  # one vector per note, replaced by note_chunk_embeddings
+]
+
+def drop_superseded_tables():
+    with engine.begin() as conn:
+        for table in SUPERSEDED_TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,164 @@
+"""Embedding backends that avoid loading torch.
+
+Every backend looks like a SentenceTransformer as far as the rest of the
+server is concerned: `encode(texts, convert_to_numpy=True, **kwargs)` returns a
+(len(texts), dim) float32 array, and an optional `tokenizer` attribute gives
+chunking real token offsets. services/embedding_model.py picks one from
+EMBEDDING_BACKEND.
+
+onnx     ONNX Runtime over an exported (optionally int8-quantized) copy of the
+         sentence-transformers model. Needs `pip install onnxruntime`; the
+         directory holds model.onnx / model_quantized.onnx and tokenizer.json:
+
+             optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 models/minilm-onnx
+             python -m services.embedding_backends quantize models/minilm-onnx
+
+hashing  scikit-learn HashingVectorizer over word unigrams and bigrams with
+         sublinear term frequencies. No model download and near-zero memory,
+         but it only matches shared words, so it suits small deployments.
+"""
+import argparse
+import os
+
+import numpy as np
+
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "models/minilm-onnx")
+EMBEDDING_ONNX_MAX_TOKENS = int(os.getenv("EMBEDDING_ONNX_MAX_TOKENS", "256"))
+EMBEDDING_HASHING_DIM = int(os.getenv("EMBEDDING_HASHING_DIM", "1024"))
+
+
+def _as_list(sentences) -> tuple:
+    if isinstance(sentences, str):
+        return [sentences], True
+    return list(sentences), False
+
+
+class OffsetTokenizer:
+    """Adapts a `tokenizers.Tokenizer` to the HF call signature services.chunking uses."""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def __call__(self, text: str, add_special_tokens: bool = False, **kwargs) -> dict:
+        encoding = self._tokenizer.encode(text, add_special_tokens=add_special_tokens)
+        return {"input_ids": encoding.ids, "offset_mapping": encoding.offsets}
+
+
+def _onnx_model_file(path: str) -> str:
+    if os.path.isfile(path):
+        return path
+    for name in ("model_quantized.onnx", "model.onnx"):
+        candidate = os.path.join(path, name)
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"no model.onnx or model_quantized.onnx in {path}")
+
+
+def onnx_model_name(path: str = EMBEDDING_ONNX_PATH) -> str:
+    """Key stored with ONNX embeddings; quantizing the model changes it so notes get re-embedded."""
+    try:
+        model_file = _onnx_model_file(path)
+    except FileNotFoundError:
+        return f"onnx:{os.path.normpath(path)}"
+    return f"onnx:{os.path.basename(os.path.dirname(os.path.abspath(model_file)))}/{os.path.basename(model_file)}"
+
+
+class OnnxEmbeddingModel:
+    """Mean-pooled, L2-normalised sentence embeddings from an ONNX export of a
+    sentence-transformers model (the same pooling all-MiniLM-L6-v2 uses)."""
+
+    def __init__(self, path: str = EMBEDDING_ONNX_PATH, threads: int = 0, max_tokens: int = EMBEDDING_ONNX_MAX_TOKENS):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx needs `pip install onnxruntime tokenizers`") from e
+
+        model_file = _onnx_model_file(path)
+        directory = os.path.dirname(model_file)
+        self.name = onnx_model_name(path)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+
+        raw = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer = OffsetTokenizer(raw)
+        self._encoder = Tokenizer.from_str(raw.to_str())
+        self._encoder.enable_truncation(max_length=max_tokens)
+        self._encoder.enable_padding()
+
+    def encode(self, sentences, convert_to_numpy: bool = True, batch_size: int = 32, **kwargs) -> np.ndarray:
+        texts, single = _as_list(sentences)
+        out = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self._encoder.encode_batch(texts[start:start + batch_size])
+            input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+            attention = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {"input_ids": input_ids, "attention_mask": attention}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self._session.run(None, feed)[0]
+            mask = attention[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+        vectors = np.vstack(out) if out else np.empty((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+class HashingEmbeddingModel:
+    """Stateless bag-of-words vectors: hashed unigrams + bigrams, log-scaled counts, L2 norm.
+
+    Inverse document frequency is deliberately left out: IDF depends on the whole
+    corpus, so every write would change every stored vector. BM25 already brings
+    corpus statistics into hybrid retrieval."""
+
+    def __init__(self, dim: int = EMBEDDING_HASHING_DIM):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.dim = dim
+        self._vectorizer = HashingVectorizer(
+            n_features=dim,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None,
+            lowercase=True,
+            token_pattern=r"(?u)\b\w[\w\-\.]*\w\b|\b\w\b",
+            dtype=np.float32,
+        )
+
+    def encode(self, sentences, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        texts, single = _as_list(sentences)
+        counts = self._vectorizer.transform(texts)
+        counts.data = np.log1p(counts.data)
+        vectors = counts.toarray()
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+
+
+def quantize_onnx(path: str) -> str:
+    """Write model_quantized.onnx (dynamic int8 weights) next to model.onnx."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = os.path.join(path, "model.onnx")
+    target = os.path.join(path, "model_quantized.onnx")
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    print(f"{source}: {os.path.getsize(source) / 2**20:.1f} MB -> {target}: {os.path.getsize(target) / 2**20:.1f} MB")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    quantize = sub.add_parser("quantize", help="int8-quantize an exported ONNX model in place")
+    quantize.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "quantize":
+        quantize_onnx(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+import numpy as np
+
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+# leave at least one core for the event loop so Socket.IO traffic keeps flowing during a forward pass
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+PRIORITY_QUERY = 0
+PRIORITY_DOCUMENT = 1
+# guesses at a question still being typed; never delays real work
+PRIORITY_SPECULATIVE = 2
+
+
+class EmbeddingExecutor:
+    """Runs every model.encode call on one dedicated thread.
+
+    Query requests that arrive within EMBEDDING_MAX_WAIT_MS of each other are
+    encoded together in a single forward pass. Document batches are split into
+    EMBEDDING_MAX_BATCH slices at a lower priority, so a big upload being indexed
+    never holds a user's question up for more than one slice."""
+
+    def __init__(
+        self,
+        load_model: Callable,
+        max_batch: int = EMBEDDING_MAX_BATCH,
+        max_wait_ms: float = EMBEDDING_MAX_WAIT_MS,
+        torch_threads: int = EMBEDDING_TORCH_THREADS,
+    ):
+        self._load_model = load_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.torch_threads = torch_threads
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {"batches": 0, "texts": 0, "largest_batch": 0, "encode_seconds": 0.0}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-executor", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts: List[str], priority: int = PRIORITY_QUERY) -> Future:
+        """Queue texts for encoding; the future resolves to a (len(texts), dim) array."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((priority, next(self._seq), list(texts), future))
+        return future
+
+    def embed_query_sync(self, text: str) -> np.ndarray:
+        return self.submit([text], PRIORITY_QUERY).result()[0]
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        result = await asyncio.wrap_future(self.submit([text], PRIORITY_QUERY))
+        return result[0]
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        futures = [
+            self.submit(texts[start:start + self.max_batch], PRIORITY_DOCUMENT)
+            for start in range(0, len(texts), self.max_batch)
+        ]
+        return np.vstack([future.result() for future in futures])
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["queue_depth"] = self.queue_depth()
+        stats["avg_batch"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        stats["max_batch"] = self.max_batch
+        stats["max_wait_ms"] = self.max_wait * 1000.0
+        stats["torch_threads"] = self.torch_threads
+        return stats
+
+    def _collect(self, first) -> list:
+        """Gather more query requests behind `first` until the batch is full or the wait expires."""
+        batch = [first]
+        if first[0] != PRIORITY_QUERY:
+            return batch
+        size = len(first[2])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] != PRIORITY_QUERY:
+                self._queue.put(item)
+                break
+            batch.append(item)
+            size += len(item[2])
+        return batch
+
+    def _configure_torch(self) -> None:
+        # only touch torch if the model actually pulled it in (not when talking to a remote model)
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            try:
+                torch.set_num_threads(self.torch_threads)
+            except Exception as e:
+                print(f"Could not cap torch threads: {e}", flush=True)
+
+    def _run(self) -> None:
+        configured = False
+        while True:
+            batch = self._collect(self._queue.get())
+            texts = [text for _, _, item_texts, _ in batch for text in item_texts]
+            try:
+                model = self._load_model()
+                if not configured:
+                    self._configure_torch()
+                    configured = True
+                kwargs = {"priority": batch[0][0]} if getattr(model, "supports_priority", False) else {}
+                start = time.perf_counter()
+                vectors = np.atleast_2d(model.encode(texts, convert_to_numpy=True, batch_size=len(texts), **kwargs))
+                self._stats["encode_seconds"] += time.perf_counter() - start
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self._stats["batches"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(texts))
+            offset = 0
+            for _, _, item_texts, future in batch:
+                future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
@@ -0,0 +1,86 @@
+import os
+import threading
+
+# sentence-transformers (torch) | onnx | hashing, see services/embedding_backends.py
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+SENTENCE_TRANSFORMER_MODEL = 'all-MiniLM-L6-v2'
+# when set, this process talks to a shared embedding server instead of loading a model itself
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET")
+
+
+def _model_name() -> str:
+    """Stored with every embedding; vectors from a different backend are never mixed in."""
+    if EMBEDDING_BACKEND == "onnx":
+        from services.embedding_backends import onnx_model_name
+        return onnx_model_name()
+    if EMBEDDING_BACKEND == "hashing":
+        from services.embedding_backends import EMBEDDING_HASHING_DIM
+        return f"hashing:{EMBEDDING_HASHING_DIM}"
+    return SENTENCE_TRANSFORMER_MODEL
+
+
+EMBEDDING_MODEL_NAME = _model_name()
+
+# Lazy loading for the embedding model AND imports
+_embedding_model = None
+_SentenceTransformer = None
+_model_loading = False
+_model_lock = threading.Lock()
+
+def get_embedding_model():
+    """Lazily load the embedding model (and heavy imports)"""
+    global _embedding_model, _SentenceTransformer, _model_loading
+
+    # Fast path - model already loaded
+    if _embedding_model is not None:
+        return _embedding_model
+
+    with _model_lock:
+        # Double-check after acquiring lock
+        if _embedding_model is None:
+            if EMBEDDING_SERVER_SOCKET:
+                from services.embedding_server import RemoteEmbeddingModel
+                print(f"Using shared embedding server at {EMBEDDING_SERVER_SOCKET}", flush=True)
+                _embedding_model = RemoteEmbeddingModel(EMBEDDING_SERVER_SOCKET)
+                return _embedding_model
+
+            if EMBEDDING_BACKEND == "onnx":
+                from services.embedding_backends import OnnxEmbeddingModel
+                from services.embedding_executor import EMBEDDING_TORCH_THREADS
+                _embedding_model = OnnxEmbeddingModel(threads=EMBEDDING_TORCH_THREADS)
+                print(f"Loaded ONNX embedding model {EMBEDDING_MODEL_NAME}", flush=True)
+                return _embedding_model
+            if EMBEDDING_BACKEND == "hashing":
+                from services.embedding_backends import HashingEmbeddingModel
+                _embedding_model = HashingEmbeddingModel()
+                print(f"Using hashing embeddings ({EMBEDDING_MODEL_NAME})", flush=True)
+                return _embedding_model
+
+            print("Loading sentence-transformers model... (this may take a moment)", flush=True)
+            # Lazy import to avoid slow startup
+            from sentence_transformers import SentenceTransformer
+            _SentenceTransformer = SentenceTransformer
+            _embedding_model = SentenceTransformer(SENTENCE_TRANSFORMER_MODEL)
+            print("Model loaded successfully!", flush=True)
+    return _embedding_model
+
+
+def preload_model_async():
+    """Start loading the model in a background thread.
+    Call this after server startup for faster first AI query."""
+    def _load():
+        try:
+            get_embedding_model()
+        except Exception as e:
+            print(f"Background model loading failed: {e}", flush=True)
+
+    thread = threading.Thread(target=_load, daemon=True)
+    thread.start()
+    print("Started background model preloading...", flush=True)
+
+def is_embedding_model_ready() -> bool:
+    """True once the embedding model is loaded; retrieval falls back to lexical-only until then."""
+    if _embedding_model is None:
+        return False
+    is_ready = getattr(_embedding_model, "is_ready", None)
+    return is_ready() if is_ready is not None else True
@@ -0,0 +1,267 @@
+"""Shared embedding model process for multi-worker deployments.
+
+One process owns the SentenceTransformer (and torch); web workers set
+EMBEDDING_SERVER_SOCKET and talk to it over a Unix socket, so the model's
+memory is paid once however many uvicorn workers run.
+
+    python -m services.embedding_server --socket /tmp/ai-workspace-embedding.sock
+
+Wire protocol (all integers big-endian):
+
+    request   b"EMB1" | op:u8 | priority:u8 | count:u32 | count x (len:u32 | utf-8 bytes)
+    response  status:u8 (0 ok, 1 error) | body
+
+    OP_ENCODE   body = rows:u32 | dim:u32 | rows*dim little-endian float32
+    OP_OFFSETS  body = count:u32 | count x (n:u32 | n x (start:u32, end:u32))
+    OP_PING     body = ready:u8
+    error       body = len:u32 | utf-8 message
+
+A connection carries any number of request/response pairs in sequence.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+MAGIC = b"EMB1"
+OP_ENCODE = 1
+OP_OFFSETS = 2
+OP_PING = 3
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_HEADER = struct.Struct("!4sBBI")
+_U32 = struct.Struct("!I")
+_DIMS = struct.Struct("!II")
+
+DEFAULT_SOCKET = "/tmp/ai-workspace-embedding.sock"
+
+
+def encode_request(op: int, texts: List[str], priority: int = 0) -> bytes:
+    parts = [_HEADER.pack(MAGIC, op, priority, len(texts))]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(_U32.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_vectors(vectors: np.ndarray) -> bytes:
+    vectors = np.ascontiguousarray(vectors, dtype="<f4")
+    rows, dim = vectors.shape
+    return bytes([STATUS_OK]) + _DIMS.pack(rows, dim) + vectors.tobytes()
+
+
+def encode_offsets(offsets: List[List[tuple]]) -> bytes:
+    parts = [bytes([STATUS_OK]), _U32.pack(len(offsets))]
+    for spans in offsets:
+        parts.append(_U32.pack(len(spans)))
+        parts.append(np.asarray(spans, dtype=">u4").reshape(-1).tobytes())
+    return b"".join(parts)
+
+
+def encode_error(message: str) -> bytes:
+    data = message.encode("utf-8")
+    return bytes([STATUS_ERROR]) + _U32.pack(len(data)) + data
+
+
+# --- server ---
+
+async def _read_request(reader: asyncio.StreamReader):
+    magic, op, priority, count = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("bad magic")
+    texts = []
+    for _ in range(count):
+        (length,) = _U32.unpack(await reader.readexactly(_U32.size))
+        texts.append((await reader.readexactly(length)).decode("utf-8"))
+    return op, priority, texts
+
+
+def _token_offsets(model, texts: List[str]) -> List[List[tuple]]:
+    tokenizer = model.tokenizer
+    out = []
+    for text in texts:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, truncation=False, verbose=False)
+        out.append([tuple(span) for span in encoded["offset_mapping"]])
+    return out
+
+
+async def serve(socket_path: str) -> None:
+    from services import embedding_model
+    from services.embedding_executor import EmbeddingExecutor
+    from services.embedding_model import get_embedding_model, preload_model_async, is_embedding_model_ready
+
+    # this process *is* the server: always load the model locally, even if the env var is set
+    embedding_model.EMBEDDING_SERVER_SOCKET = None
+
+    # requests from all workers are micro-batched together here
+    executor = EmbeddingExecutor(get_embedding_model)
+    preload_model_async()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    op, priority, texts = await _read_request(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    if op == OP_ENCODE:
+                        vectors = await asyncio.wrap_future(executor.submit(texts, priority))
+                        response = encode_vectors(vectors)
+                    elif op == OP_OFFSETS:
+                        model = await asyncio.to_thread(get_embedding_model)
+                        response = encode_offsets(await asyncio.to_thread(_token_offsets, model, texts))
+                    elif op == OP_PING:
+                        response = bytes([STATUS_OK, 1 if is_embedding_model_ready() else 0])
+                    else:
+                        response = encode_error(f"unknown op {op}")
+                except Exception as e:
+                    response = encode_error(str(e))
+                writer.write(response)
+                await writer.drain()
+        except ValueError as e:
+            print(f"Embedding server: dropping connection ({e})", flush=True)
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    os.chmod(socket_path, 0o660)
+    print(f"Embedding server listening on {socket_path}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+# --- client ---
+
+class _Connection:
+    def __init__(self, socket_path: str, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+
+    def _read_exact(self, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError("embedding server closed the connection")
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def request(self, op: int, texts: List[str], priority: int):
+        self.sock.sendall(encode_request(op, texts, priority))
+        status = self._read_exact(1)[0]
+        if status == STATUS_ERROR:
+            (length,) = _U32.unpack(self._read_exact(_U32.size))
+            raise RuntimeError(f"embedding server error: {self._read_exact(length).decode('utf-8')}")
+        if op == OP_ENCODE:
+            rows, dim = _DIMS.unpack(self._read_exact(_DIMS.size))
+            data = self._read_exact(rows * dim * 4)
+            return np.frombuffer(data, dtype="<f4").astype(np.float32).reshape(rows, dim)
+        if op == OP_OFFSETS:
+            (count,) = _U32.unpack(self._read_exact(_U32.size))
+            out = []
+            for _ in range(count):
+                (n,) = _U32.unpack(self._read_exact(_U32.size))
+                flat = np.frombuffer(self._read_exact(n * 8), dtype=">u4")
+                out.append([(int(flat[i]), int(flat[i + 1])) for i in range(0, len(flat), 2)])
+            return out
+        return self._read_exact(1)[0] == 1
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RemoteTokenizer:
+    """Just enough of the HF tokenizer call signature for services.chunking."""
+
+    def __init__(self, model: "RemoteEmbeddingModel"):
+        self._model = model
+
+    def __call__(self, text: str, **kwargs) -> dict:
+        return {"offset_mapping": self._model.request(OP_OFFSETS, [text])[0]}
+
+
+class RemoteEmbeddingModel:
+    """Drop-in stand-in for SentenceTransformer that forwards to the embedding server.
+    Each thread keeps its own persistent connection."""
+
+    supports_priority = True
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.tokenizer = RemoteTokenizer(self)
+        self._local = threading.local()
+        self._ready = False
+        self._ping_lock = threading.Lock()
+        self._pinger: Optional[threading.Thread] = None
+
+    def _connection(self) -> _Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _Connection(self.socket_path, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def request(self, op: int, texts: List[str], priority: int = 0):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                return conn.request(op, texts, priority)
+            except (ConnectionError, OSError):
+                # server restarted or the socket went stale: reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def encode(self, sentences, convert_to_numpy: bool = True, priority: int = 0, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = self.request(OP_ENCODE, texts, priority)
+        return vectors[0] if single else vectors
+
+    def is_ready(self) -> bool:
+        """Cached; the server is pinged from a background thread, so callers on the event loop never wait on it."""
+        if not self._ready:
+            with self._ping_lock:
+                if self._pinger is None or not self._pinger.is_alive():
+                    self._pinger = threading.Thread(target=self._ping_until_ready, daemon=True)
+                    self._pinger.start()
+        return self._ready
+
+    def _ping_until_ready(self) -> None:
+        delay = 0.5
+        while not self._ready:
+            try:
+                self._ready = bool(self.request(OP_PING, []))
+            except OSError:
+                pass
+            if not self._ready:
+                time.sleep(delay)
+                delay = min(delay * 2, 10.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding model server")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET", DEFAULT_SOCKET))
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
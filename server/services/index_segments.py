@@ -0,0 +1,144 @@
+"""Memory-mapped on-disk snapshots of workspace vector indexes.
+
+A segment holds one workspace's chunk vectors exactly as the in-memory index
+stores them (quantized matrix, scales, IVF centroids/assignments) plus the
+float32 originals used for rescoring. Loading maps the files instead of reading
+and decoding every embedding blob from the database, and workers on the same
+machine share the mapped pages.
+
+Each note's content hash is recorded too, so a loader can tell which notes
+changed since the snapshot and only re-read those from the database.
+"""
+import json
+import os
+import uuid
+from typing import Dict, Optional
+
+import numpy as np
+
+from services.ann_index import IVFVectorIndex
+
+# "" disables segments (indexes are then always rebuilt from the database)
+RAG_SEGMENT_DIR = os.getenv("RAG_SEGMENT_DIR", "index_segments")
+SEGMENT_VERSION = 1
+
+_ARRAYS = ("ids", "matrix", "scales", "full", "centroids", "assign")
+
+
+def segments_enabled() -> bool:
+    return bool(RAG_SEGMENT_DIR)
+
+
+def _workspace_dir(workspace_id) -> str:
+    return os.path.join(RAG_SEGMENT_DIR, f"workspace_{workspace_id}")
+
+
+def write_segment(workspace_id, vectors: IVFVectorIndex, notes: Dict, model_name: str) -> None:
+    """Snapshot `vectors` and the per-note {"hash", "chunks"} metadata for a workspace.
+
+    Files are written under a fresh token and meta.json is swapped in atomically,
+    so readers never see a half-written segment; files from older snapshots are
+    removed afterwards (already-open maps stay valid)."""
+    n = len(vectors)
+    if not n:
+        delete_segment(workspace_id)
+        return
+    directory = _workspace_dir(workspace_id)
+    os.makedirs(directory, exist_ok=True)
+    token = uuid.uuid4().hex[:12]
+
+    # rows are stored as (position in the note list, chunk_index); note ids are UUIDs
+    note_ids = list({note_id for note_id, _ in vectors.ids})
+    note_positions = {note_id: pos for pos, note_id in enumerate(note_ids)}
+    arrays = {
+        "ids": np.asarray([(note_positions[note_id], chunk_index) for note_id, chunk_index in vectors.ids], dtype=np.int64),
+        "matrix": vectors._matrix[:n],
+    }
+    if vectors.precision == "int8":
+        arrays["scales"] = vectors._scales[:n]
+    if vectors.is_trained:
+        arrays["centroids"] = vectors._centroids
+        arrays["assign"] = vectors._assign[:n]
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{token}.{name}.npy"), np.ascontiguousarray(array))
+
+    if vectors.keep_full:
+        # streamed into the file block by block rather than materialised in RAM
+        full = np.lib.format.open_memmap(
+            os.path.join(directory, f"{token}.full.npy"), mode="w+", dtype=np.float32, shape=(n, vectors.dim)
+        )
+        for start in range(0, n, 8192):
+            full[start:start + 8192] = vectors.full_vectors(vectors.ids[start:start + 8192])
+        full.flush()
+        del full
+        arrays["full"] = None
+
+    meta = {
+        "version": SEGMENT_VERSION,
+        "token": token,
+        "model_name": model_name,
+        "precision": vectors.precision,
+        "arrays": sorted(arrays),
+        "note_ids": [str(note_id) for note_id in note_ids],
+        "notes": {str(note_id): note for note_id, note in notes.items()},
+    }
+    tmp = os.path.join(directory, f"meta.{token}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, "meta.json"))
+
+    for name in os.listdir(directory):
+        if name != "meta.json" and not name.startswith(token):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def read_segment(workspace_id, model_name: str, precision: str) -> Optional[tuple]:
+    """(IVFVectorIndex over memory-mapped arrays, {note_id: {"hash", "chunks"}}) or None
+    if there is no usable segment for this model and precision."""
+    directory = _workspace_dir(workspace_id)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if (
+            meta.get("version") != SEGMENT_VERSION
+            or meta.get("model_name") != model_name
+            or meta.get("precision") != precision
+        ):
+            return None
+        token = meta["token"]
+        loaded = {
+            name: np.load(os.path.join(directory, f"{token}.{name}.npy"), mmap_mode="r")
+            for name in meta["arrays"] if name in _ARRAYS
+        }
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring index segment for workspace {workspace_id}: {e}", flush=True)
+        return None
+
+    note_ids = [uuid.UUID(note_id) for note_id in meta["note_ids"]]
+    ids = [(note_ids[pos], int(chunk_index)) for pos, chunk_index in loaded.pop("ids").tolist()]
+    vectors = IVFVectorIndex.from_arrays(ids, **loaded)
+    notes = {
+        uuid.UUID(note_id): {"hash": note["hash"], "chunks": [tuple(span) for span in note["chunks"]]}
+        for note_id, note in meta["notes"].items()
+    }
+    return vectors, notes
+
+
+def delete_segment(workspace_id) -> None:
+    directory = _workspace_dir(workspace_id)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import func, or_
+
+from models.note import Note
+from models.note_embedding import NoteEmbedding
+from services.db import SessionLocal
+from services.embedding_model import EMBEDDING_MODEL_NAME
+from services.rag_service import refresh_note_embedding
+from services.answer_cache import answer_cache
+from services.summary_worker import summary_worker
+from services.workspace_digest import digest_worker
+from services.table_stats import refresh_table_stats
+from services.note_graph import note_graph
+
+INDEXING_CONCURRENCY = int(os.getenv("INDEXING_CONCURRENCY", "2"))
+# workspaces asked a question within this window get their pending notes indexed first
+RECENT_QUERY_WINDOW = float(os.getenv("INDEXING_RECENT_QUERY_SECONDS", "600"))
+
+PRIORITY_HOT = 0       # workspace was queried recently
+PRIORITY_NORMAL = 1    # ordinary save / create / upload
+PRIORITY_BACKFILL = 2  # startup catch-up for notes that were never embedded
+
+_PRIORITY_NAMES = {PRIORITY_HOT: "hot", PRIORITY_NORMAL: "normal", PRIORITY_BACKFILL: "backfill"}
+
+
+def _stale_notes() -> list:
+    """(note_id, workspace_id) for notes with no embeddings from the current model,
+    or edited since they were embedded."""
+    with SessionLocal() as db:
+        latest = (
+            db.query(NoteEmbedding.note_id, func.max(NoteEmbedding.updated_at).label("embedded_at"))
+            .filter(NoteEmbedding.model_name == EMBEDDING_MODEL_NAME)
+            .group_by(NoteEmbedding.note_id)
+            .subquery()
+        )
+        rows = (
+            db.query(Note.id, Note.workspace_id)
+            .outerjoin(latest, latest.c.note_id == Note.id)
+            .filter(or_(latest.c.embedded_at.is_(None), Note.updated_at > latest.c.embedded_at))
+            .all()
+        )
+        return [(row.id, row.workspace_id) for row in rows]
+
+
+class IndexingWorker:
+    """Keeps note embeddings fresh in the background so saves never wait on the model.
+
+    The queue coalesces: a note is pending at most once however many times it
+    is enqueued before a worker picks it up. Pending notes are served by
+    priority (recently queried workspace > normal write > backfill). enqueue()
+    and mark_workspace_queried() are safe to call from any thread."""
+
+    def __init__(self, concurrency: int = INDEXING_CONCURRENCY):
+        self.concurrency = concurrency
+        self._queues: Dict[int, "OrderedDict"] = {p: OrderedDict() for p in _PRIORITY_NAMES}
+        self._priority_of: Dict = {}
+        self._workspace_pending: Dict = {}
+        self._recent_queries: Dict = {}
+        self._in_flight: Dict = {}
+        self._deferred: Dict = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._stats = {"enqueued": 0, "coalesced": 0, "indexed": 0, "failed": 0, "backfill_total": 0}
+        self._last_error: Optional[str] = None
+
+    # --- producers ---
+
+    def enqueue(self, note_id, workspace_id, backfill: bool = False) -> None:
+        if note_id is None:
+            return
+        if not backfill:
+            # every note write passes through here; cached answers built on the note are now stale
+            self._off_loop(answer_cache.note_changed, workspace_id, note_id)
+            summary_worker.enqueue(note_id, workspace_id)
+            digest_worker.schedule(workspace_id)
+        with self._lock:
+            if note_id in self._in_flight:
+                # picked up again once the current run finishes, never run twice at once
+                self._stats["coalesced"] += 1
+                self._deferred[note_id] = (workspace_id, backfill)
+                return
+            priority = PRIORITY_BACKFILL if backfill else PRIORITY_NORMAL
+            if self._is_recent(workspace_id):
+                priority = PRIORITY_HOT
+            current = self._priority_of.get(note_id)
+            if current is not None:
+                self._stats["coalesced"] += 1
+                if current <= priority:
+                    return
+                del self._queues[current][note_id]
+            else:
+                self._stats["enqueued"] += 1
+            self._queues[priority][note_id] = workspace_id
+            self._priority_of[note_id] = priority
+            self._workspace_pending.setdefault(workspace_id, set()).add(note_id)
+        self._wake()
+
+    def mark_workspace_queried(self, workspace_id) -> None:
+        """Record a question against a workspace and move its pending notes to the front."""
+        with self._lock:
+            self._recent_queries[workspace_id] = time.monotonic()
+            for note_id in self._workspace_pending.get(workspace_id, ()):
+                current = self._priority_of[note_id]
+                if current != PRIORITY_HOT:
+                    del self._queues[current][note_id]
+                    self._queues[PRIORITY_HOT][note_id] = workspace_id
+                    self._priority_of[note_id] = PRIORITY_HOT
+
+    def _is_recent(self, workspace_id) -> bool:
+        queried_at = self._recent_queries.get(workspace_id)
+        return queried_at is not None and time.monotonic() - queried_at < RECENT_QUERY_WINDOW
+
+    @staticmethod
+    def _off_loop(fn, *args) -> None:
+        """Call fn(*args), in a thread when called on an event loop (it may block on Redis)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            fn(*args)
+            return
+        loop.run_in_executor(None, fn, *args)
+
+    def _wake(self) -> None:
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # --- consumers ---
+
+    def _pop(self):
+        with self._lock:
+            for priority in sorted(self._queues):
+                queue = self._queues[priority]
+                if queue:
+                    note_id, workspace_id = queue.popitem(last=False)
+                    del self._priority_of[note_id]
+                    pending = self._workspace_pending.get(workspace_id)
+                    if pending is not None:
+                        pending.discard(note_id)
+                        if not pending:
+                            del self._workspace_pending[workspace_id]
+                    self._in_flight[note_id] = workspace_id
+                    return note_id
+            return None
+
+    async def _run(self) -> None:
+        while True:
+            note_id = self._pop()
+            if note_id is None:
+                self._wakeup.clear()
+                # re-check after clearing so a wake between pop and clear isn't lost
+                note_id = self._pop()
+                if note_id is None:
+                    await self._wakeup.wait()
+                    continue
+            try:
+                if await asyncio.to_thread(refresh_note_embedding, note_id):
+                    self._stats["indexed"] += 1
+                    # an edited CSV note gets its column statistics recomputed
+                    await asyncio.to_thread(refresh_table_stats, note_id)
+                    note_graph.enqueue(note_id)
+                else:
+                    self._stats["failed"] += 1
+                    self._last_error = f"note {note_id}"
+            except Exception as e:
+                self._stats["failed"] += 1
+                self._last_error = f"note {note_id}: {e}"
+                print(f"Indexing failed for note {note_id}: {e}", flush=True)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(note_id, None)
+                    deferred = self._deferred.pop(note_id, None)
+                if deferred is not None:
+                    self.enqueue(note_id, *deferred)
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop (call from app startup)."""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        print(f"Indexing worker started ({self.concurrency} tasks)", flush=True)
+
+    async def backfill(self) -> int:
+        """Queue every note whose embeddings are missing or older than the note."""
+        try:
+            stale = await asyncio.to_thread(_stale_notes)
+        except Exception as e:
+            print(f"Indexing backfill query failed: {e}", flush=True)
+            return 0
+        for note_id, workspace_id in stale:
+            self.enqueue(note_id, workspace_id, backfill=True)
+        self._stats["backfill_total"] += len(stale)
+        if stale:
+            print(f"Indexing backfill queued {len(stale)} notes", flush=True)
+        return len(stale)
+
+    # --- reporting ---
+
+    def status(self, workspace_id=None) -> dict:
+        with self._lock:
+            if workspace_id is not None:
+                return {
+                    "pending": len(self._workspace_pending.get(workspace_id, ())),
+                    "in_flight": sum(1 for ws in self._in_flight.values() if ws == workspace_id),
+                    "recently_queried": self._is_recent(workspace_id),
+                }
+            status = dict(self._stats)
+            status["pending"] = {name: len(self._queues[p]) for p, name in _PRIORITY_NAMES.items()}
+            status["in_flight"] = len(self._in_flight)
+            status["running"] = bool(self._tasks)
+            status["last_error"] = self._last_error
+            return status
+
+
+indexing_worker = IndexingWorker()
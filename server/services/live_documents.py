@@ -0,0 +1,379 @@
+"""Server copies of the notes being edited, kept in step by operational transformation.
+
+An editor opens a note and gets one snapshot: text, title, revision and the
+document's epoch. After that it sends operations (services/text_ot.py) made
+against the last revision it saw; the server transforms each one past the
+operations accepted since, applies it, and relays only that operation to the
+note's other editors. A snapshot is sent again only when an editor has fallen
+further behind than the kept history (a resync).
+
+The epoch is new each time a document is loaded from the database, so a
+revision from before a restart or an eviction is never taken for a current one.
+Documents stay in memory while they have editors or unsaved changes.
+
+Accepted operations are appended to the note's update log (services/note_log.py)
+as they are applied, in batches written off the event loop. The log, not the
+database, is what keeps an edit: a
+document is compacted into Note.content every LIVE_COMPACT_INTERVAL seconds
+while it is being edited, once LIVE_COMPACT_MAX_UPDATES updates have piled up,
+and shortly after its last editor leaves. Loading a document replays its log,
+so edits made since the last compaction survive a restart.
+
+A note's log and database I/O (loading, log batches, compaction, discarding the
+log) runs in threads one piece at a time, in the order it was started, so a log
+is never written to out of turn.
+"""
+import asyncio
+import os
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models.note import Note
+from services.db import SessionLocal
+from services.note_log import note_log
+from services.text_ot import (
+    OperationError,
+    apply_encoded,
+    decode,
+    diff_encoded,
+    encode,
+    is_noop,
+    normalize,
+    transform,
+)
+
+# operations kept per document for transforming late ones; editors further behind resync
+LIVE_HISTORY_LIMIT = int(os.getenv("LIVE_HISTORY_LIMIT", "1000"))
+LIVE_COMPACT_INTERVAL = float(os.getenv("LIVE_COMPACT_INTERVAL", "30"))
+LIVE_COMPACT_MAX_UPDATES = int(os.getenv("LIVE_COMPACT_MAX_UPDATES", "500"))
+# pause before saving a document whose edits are not all in the log (or that nobody is editing)
+LIVE_SAVE_DELAY = 1.0
+PREVIEW_CHARS = 200
+
+
+class StaleRevision(Exception):
+    """The operation was made against a revision this document can no longer transform from."""
+
+
+class LiveDocument:
+    def __init__(self, note_id, workspace_id, content: str, title: Optional[str]):
+        self.note_id = note_id
+        self.workspace_id = workspace_id
+        self.epoch = uuid.uuid4().hex[:12]
+        self.title = title
+        self.revision = 0
+        self.saved_revision = 0
+        self.saved_title = title
+        self.editors = set()
+        # some unsaved edits never reached the update log, so they are only in memory
+        self.unlogged = False
+        # log entries waiting for the next batch, and whether that batch is queued yet
+        self.outbox: List[dict] = []
+        self.flushing = False
+        # held from applying an operation until it has been relayed, so every editor
+        # receives operations (and the acks of its own) in revision order
+        self.lock = asyncio.Lock()
+        # kept as UTF-16 so applying an operation is slicing, not re-encoding the note
+        self._data = encode(content or "")
+        # history[-1] produced the current revision
+        self._history: deque = deque(maxlen=LIVE_HISTORY_LIMIT)
+
+    @property
+    def content(self) -> str:
+        return decode(self._data)
+
+    def storable_content(self) -> str:
+        """The text for the database: a half surrogate pair left by a misbehaving client becomes U+FFFD."""
+        return self._data.decode("utf-16-le", "replace")
+
+    @property
+    def dirty(self) -> bool:
+        return self.saved_revision != self.revision or self.saved_title != self.title
+
+    def mark_saved(self, revision: int, title: Optional[str]) -> None:
+        self.saved_revision = revision
+        self.saved_title = title
+
+    def receive(self, revision: int, ops) -> List:
+        """Apply an editor's operation made against `revision`; returns it as applied to the current text."""
+        ops = normalize(ops)
+        behind = self.revision - revision
+        if behind < 0 or behind > len(self._history):
+            raise StaleRevision()
+        for concurrent in list(self._history)[len(self._history) - behind:]:
+            ops, _ = transform(ops, concurrent)
+        self._data = apply_encoded(self._data, ops)
+        self._history.append(ops)
+        self.revision += 1
+        return ops
+
+    def replace(self, content: str) -> Optional[List]:
+        """Turn a whole-content write into an operation at the current revision (None if nothing changed)."""
+        ops = diff_encoded(self._data, encode(content or ""))
+        if is_noop(ops):
+            return None
+        return self.receive(self.revision, ops)
+
+    def snapshot(self) -> dict:
+        return {
+            "note_id": str(self.note_id),
+            "epoch": self.epoch,
+            "revision": self.revision,
+            "content": self.content,
+            "title": self.title,
+        }
+
+    def preview(self) -> str:
+        return decode(self._data[:2 * PREVIEW_CHARS])
+
+
+class LiveDocuments:
+    def __init__(self):
+        self._docs: Dict = {}
+        # note_id -> the last I/O started for the note
+        self._io: Dict = {}
+        # called with a document whose edits turn out not to have reached the log
+        self.on_unlogged: Optional[Callable[[LiveDocument], None]] = None
+        self._stats = {"opened": 0, "closed": 0, "ops": 0, "resyncs": 0, "rejected": 0, "compactions": 0, "recovered": 0}
+
+    def get(self, note_id) -> Optional[LiveDocument]:
+        return self._docs.get(note_id)
+
+    def _serialised(self, note_id, job, *args) -> asyncio.Future:
+        """Await job(*args) once the note's I/O started before it is done; job is a coroutine
+        function, usually asyncio.to_thread."""
+        previous = self._io.get(note_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait({previous})
+            return await job(*args)
+
+        task = asyncio.ensure_future(run())
+        self._io[note_id] = task
+
+        def done(_):
+            if self._io.get(note_id) is task:
+                del self._io[note_id]
+
+        task.add_done_callback(done)
+        # a cancelled caller must not cancel I/O that later I/O is ordered after
+        return asyncio.shield(task)
+
+    def _load(self, note_id, workspace_id=None) -> Optional[LiveDocument]:
+        """A document for the note as stored plus whatever its update log adds."""
+        with SessionLocal() as db:
+            query = db.query(Note).filter(Note.id == note_id)
+            if workspace_id is not None:
+                query = query.filter(Note.workspace_id == workspace_id)
+            note = query.first()
+            if note is None:
+                return None
+            doc = LiveDocument(note.id, note.workspace_id, note.content, note.title)
+            stored = note.content
+        entries = note_log.entries(note_id, stored)
+        if entries is None:
+            doc.unlogged = note_log.enabled and not note_log.reset(note_id, stored)
+            return doc
+        note_log.hold(note_id)
+        for entry in entries:
+            try:
+                if "o" in entry:
+                    doc.receive(doc.revision, entry["o"])
+                if "t" in entry:
+                    doc.title = entry["t"]
+            except (OperationError, TypeError) as e:
+                # nothing after a bad entry can be placed; save what was recovered soon
+                print(f"Warning: stopped replaying the edit log of note {note_id}: {e}", flush=True)
+                doc.unlogged = True
+                break
+        return doc
+
+    async def open(self, note_id, workspace_id, sid: Optional[str] = None) -> Optional[LiveDocument]:
+        """The note's live document, loaded if needed; None if the note is not in the workspace."""
+        doc = self._docs.get(note_id)
+        while doc is None:
+            busy = self._io.get(note_id)
+            if busy is not None:
+                # another editor's load, a recovery or a discard: see what it leaves behind
+                await asyncio.wait({busy})
+                doc = self._docs.get(note_id)
+                continue
+            doc = await self._serialised(note_id, asyncio.to_thread, self._load, note_id, workspace_id)
+            if doc is None:
+                return None
+            self._docs[note_id] = doc
+            self._stats["opened"] += 1
+        if doc.workspace_id != workspace_id:
+            return None
+        if sid is not None:
+            doc.editors.add(sid)
+        return doc
+
+    def _log(self, doc: LiveDocument, ops=None, title: Optional[str] = None) -> None:
+        """Queue an update for the log; entries queued while a batch is being written go in the next."""
+        doc.outbox.append(note_log.entry(ops, title))
+        if not doc.flushing:
+            doc.flushing = True
+            self._serialised(doc.note_id, self._flush, doc)
+
+    async def _flush(self, doc: LiveDocument) -> None:
+        doc.flushing = False
+        batch, doc.outbox = doc.outbox, []
+        if not batch or await asyncio.to_thread(note_log.append, doc.note_id, batch):
+            return
+        if not doc.unlogged:
+            doc.unlogged = True
+            if self.on_unlogged is not None:
+                self.on_unlogged(doc)
+
+    def receive(self, doc: LiveDocument, epoch: Optional[str], revision, ops) -> Optional[List]:
+        """Apply an editor's operation; None means the editor must resync from a snapshot."""
+        if epoch != doc.epoch or not isinstance(revision, int):
+            self._stats["resyncs"] += 1
+            return None
+        try:
+            applied = doc.receive(revision, ops)
+        except StaleRevision:
+            self._stats["resyncs"] += 1
+            return None
+        except OperationError:
+            # built against text the editor doesn't really have; its snapshot sets it straight
+            self._stats["rejected"] += 1
+            return None
+        self._stats["ops"] += 1
+        self._log(doc, applied)
+        return applied
+
+    def replace(self, doc: LiveDocument, content: str) -> Optional[List]:
+        """Apply a whole-content write as an operation (None if nothing changed)."""
+        applied = doc.replace(content)
+        if applied is not None:
+            self._log(doc, applied)
+        return applied
+
+    def set_title(self, doc: LiveDocument, title: str) -> None:
+        if title != doc.title:
+            doc.title = title
+            self._log(doc, title=title)
+
+    def _restart_log(self, note_id, stored: str, title: Optional[str] = None) -> bool:
+        """Restart the note's log from `stored`, then log `title` if it wasn't stored with it.
+        False if edits made on top of `stored` can't be logged."""
+        logged = note_log.reset(note_id, stored)
+        if logged and title is not None:
+            logged = note_log.append(note_id, [note_log.entry(title=title)])
+        return logged or not note_log.enabled
+
+    def _store(self, doc: LiveDocument, content: str, title: Optional[str]) -> Optional[Note]:
+        """Write the text and title to the document's note and restart its log from them; None if the note is gone."""
+        with SessionLocal() as db:
+            note = db.query(Note).filter(Note.id == doc.note_id, Note.workspace_id == doc.workspace_id).first()
+            if note is None:
+                return None
+            note.content = content
+            if title is not None:
+                note.title = title
+            db.commit()
+            db.refresh(note)
+        doc.unlogged = not self._restart_log(doc.note_id, content)
+        return note
+
+    async def compact(self, doc: LiveDocument) -> Optional[Note]:
+        """Write the document to its note and restart its log from there; None if the note is gone.
+        The caller holds doc.lock, so nothing is applied between reading the text and restarting the log."""
+        content, title, revision = doc.storable_content(), doc.title, doc.revision
+        # the text being stored has every update still waiting for the log
+        doc.outbox = []
+        note = await self._serialised(doc.note_id, asyncio.to_thread, self._store, doc, content, title)
+        if note is None:
+            self.close(doc.note_id)
+            return None
+        doc.mark_saved(revision, title)
+        self._stats["compactions"] += 1
+        return note
+
+    async def written(self, doc: LiveDocument, content_written: bool, title_written: bool) -> None:
+        """The note's text and/or title were just stored by a write outside the live protocol.
+        The caller holds doc.lock."""
+        doc.mark_saved(
+            doc.revision if content_written else doc.saved_revision,
+            doc.title if title_written else doc.saved_title,
+        )
+        if content_written:
+            doc.outbox = []
+            unsaved_title = doc.title if doc.title != doc.saved_title else None
+            logged = await self._serialised(
+                doc.note_id, asyncio.to_thread, self._restart_log, doc.note_id, doc.storable_content(), unsaved_title
+            )
+            doc.unlogged = not logged
+
+    def save_delay(self, doc: LiveDocument) -> float:
+        """How long the document's unsaved edits may wait to be compacted."""
+        if not note_log.enabled or doc.unlogged or not doc.editors:
+            return LIVE_SAVE_DELAY
+        if doc.revision - doc.saved_revision >= LIVE_COMPACT_MAX_UPDATES:
+            return 0.0
+        return LIVE_COMPACT_INTERVAL
+
+    def leave(self, sid: str, note_id=None) -> List[LiveDocument]:
+        """Remove an editor from one document (or all of them); returns the documents it left."""
+        if note_id is None:
+            docs = list(self._docs.values())
+        else:
+            docs = [self._docs[note_id]] if note_id in self._docs else []
+        left = [doc for doc in docs if sid in doc.editors]
+        for doc in left:
+            doc.editors.discard(sid)
+        return left
+
+    def close(self, note_id) -> None:
+        if self._docs.pop(note_id, None) is not None:
+            self._stats["closed"] += 1
+        self._serialised(note_id, asyncio.to_thread, note_log.discard, note_id)
+
+    def close_if_idle(self, doc: LiveDocument) -> None:
+        """Drop a document nobody is editing once it has been saved."""
+        if not doc.editors and not doc.dirty and self._docs.get(doc.note_id) is doc:
+            self.close(doc.note_id)
+
+    def _recover_log(self, note_id) -> Optional[LiveDocument]:
+        """Claim and compact a log nobody holds; the document it was replayed into if that changed the note."""
+        if not note_log.claim(note_id):
+            return None
+        doc = self._load(note_id)
+        changed = doc is not None and doc.dirty and self._store(doc, doc.storable_content(), doc.title) is not None
+        note_log.discard(note_id)
+        return doc if changed else None
+
+    async def recover(self) -> List[Tuple]:
+        """Compact the update logs left by documents that were never saved (the server stopped first).
+        Logs another process still holds are left alone. Returns (note_id, workspace_id) of the notes that changed."""
+        recovered = []
+        for raw_id, updates in await asyncio.to_thread(note_log.pending):
+            try:
+                note_id = uuid.UUID(raw_id)
+            except ValueError:
+                continue
+            if note_id in self._docs or note_id in self._io:
+                continue
+            doc = await self._serialised(note_id, asyncio.to_thread, self._recover_log, note_id)
+            if doc is not None:
+                print(f"Recovered {updates} logged updates of note {raw_id[:8]}...", flush=True)
+                recovered.append((doc.note_id, doc.workspace_id))
+        self._stats["compactions"] += len(recovered)
+        self._stats["recovered"] += len(recovered)
+        return recovered
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "open": len(self._docs),
+            "editors": sum(len(doc.editors) for doc in self._docs.values()),
+            "unsaved": sum(1 for doc in self._docs.values() if doc.dirty),
+            "log": note_log.stats(),
+        }
+
+
+live_documents = LiveDocuments()
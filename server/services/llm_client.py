@@ -0,0 +1,168 @@
+"""Shared async OpenAI client with a concurrency limit and a bounded wait queue.
+
+All chat completions go through one AsyncOpenAI instance backed by a single
+keep-alive httpx pool. At most LLM_MAX_CONCURRENCY calls are in flight; up to
+LLM_MAX_QUEUE more wait for a slot (for at most LLM_QUEUE_TIMEOUT seconds).
+Past that, callers get LLMSaturated straight away so the API can answer
+429/503 instead of piling up requests it will not serve in time.
+
+Point OPENAI_BASE_URL at benchmarks/fake_openai_server.py to load-test
+without the network.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+# keep-alive connections to the API; a few more than the concurrency limit
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(LLM_MAX_CONCURRENCY + 4)))
+
+
+class LLMSaturated(Exception):
+    """No slot available: 429 when the wait queue is full, 503 when the wait timed out."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class LLMSlot:
+    """A held concurrency slot. release() is idempotent so streams can release it from several places."""
+
+    def __init__(self, client: "LLMClient"):
+        self._client = client
+        self._released = False
+        self.acquired_at = time.perf_counter()
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._client._release()
+
+
+class LLMClient:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        pool_size: int = LLM_POOL_SIZE,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.pool_size = pool_size
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._waits = deque(maxlen=500)
+        self.completed = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def _get_client(self) -> AsyncOpenAI:
+        # created lazily so the pool belongs to the running event loop
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60,
+                ),
+                timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=5.0),
+            )
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=1)
+        return self._client
+
+    async def acquire(self) -> LLMSlot:
+        """Wait for a concurrency slot, or raise LLMSaturated."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._in_flight + self._waiting >= self.max_concurrency + self.max_queue:
+            self.rejected_full += 1
+            raise LLMSaturated(429, "AI assistant is busy, please retry shortly")
+        self._waiting += 1
+        start = time.perf_counter()
+        # wait on a task of our own: wait_for can drop a permit acquired just as it times out
+        # (before Python 3.12), so a waiter that got one anyway gives it back here
+        waiter = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except BaseException as e:
+            if not waiter.cancel() and not waiter.cancelled() and waiter.exception() is None:
+                self._semaphore.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout += 1
+                raise LLMSaturated(503, "AI assistant is overloaded, please retry", retry_after=int(self.queue_timeout))
+            raise
+        finally:
+            self._waiting -= 1
+        self._waits.append((time.perf_counter() - start) * 1000)
+        self._in_flight += 1
+        return LLMSlot(self)
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        held = await self.acquire()
+        try:
+            yield held
+        finally:
+            held.release()
+
+    async def complete(self, **kwargs):
+        """chat.completions.create under a concurrency slot."""
+        async with self.slot():
+            return await self._get_client().chat.completions.create(**kwargs)
+
+    async def stream(self, slot: Optional[LLMSlot] = None, **kwargs) -> AsyncIterator:
+        """Streamed chat.completions.create; yields chunks. The slot (acquired here unless
+        passed in) is held until the stream finishes or the consumer stops iterating."""
+        held = slot or await self.acquire()
+        try:
+            stream = await self._get_client().chat.completions.create(stream=True, **kwargs)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.close()
+        finally:
+            held.release()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_ms_p50": waits[len(waits) // 2] if waits else None,
+            "wait_ms_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else None,
+        }
+
+
+llm_client = LLMClient()
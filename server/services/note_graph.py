@@ -0,0 +1,247 @@
+"""Precomputed k-nearest-neighbour graph over each workspace's notes.
+
+Every embedded note gets a row in note_neighbors listing the NOTE_GRAPH_K
+notes most similar to it (closest pair of chunk embeddings, via the
+workspace's vector index). GET /notes/{id}/related is then a single primary
+key lookup instead of a search.
+
+The graph is kept up to date incrementally. When a note's embeddings change
+its own list is recomputed and the change is pushed to the notes at the other
+end: a new neighbour is merged into their lists if it beats their k-th entry,
+and a list the note drops out of is recomputed to fill the gap.
+A deleted note is removed from every list that held it, and those lists are
+refilled in the background.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from models.note import Note
+from models.note_embedding import NoteEmbedding
+from models.note_neighbors import NoteNeighbors
+from services.db import SessionLocal
+from services.embedding_model import EMBEDDING_MODEL_NAME, is_embedding_model_ready
+from services.rag_service import similar_notes
+
+NOTE_GRAPH_ENABLED = os.getenv("NOTE_GRAPH_ENABLED", "true").lower() in ("1", "true", "yes")
+NOTE_GRAPH_K = int(os.getenv("NOTE_GRAPH_K", "10"))
+# weaker matches than this are not worth showing as related
+NOTE_GRAPH_MIN_SCORE = float(os.getenv("NOTE_GRAPH_MIN_SCORE", "0.3"))
+
+
+def _embedding_hash(db, note_id) -> Optional[str]:
+    row = (
+        db.query(NoteEmbedding.content_hash)
+        .filter(NoteEmbedding.note_id == note_id, NoteEmbedding.model_name == EMBEDDING_MODEL_NAME)
+        .first()
+    )
+    return row.content_hash if row else None
+
+
+def _load(row: Optional[NoteNeighbors]) -> "OrderedDict[str, float]":
+    return OrderedDict((note_id, score) for note_id, score in json.loads(row.neighbors)) if row else OrderedDict()
+
+
+def _store(row: NoteNeighbors, neighbors: Dict[str, float]) -> None:
+    ranked = sorted(neighbors.items(), key=lambda item: -item[1])[:NOTE_GRAPH_K]
+    row.neighbors = json.dumps([[note_id, round(score, 4)] for note_id, score in ranked])
+    row.neighbor_count = len(ranked)
+
+
+def update_note(note_id, force: bool = False) -> List:
+    """Recompute a note's neighbour list (unless its embeddings are unchanged) and patch the
+    lists of the notes it gained or lost. Returns the notes whose lists need a full recompute."""
+    with SessionLocal() as db:
+        note = db.get(Note, note_id)
+        content_hash = _embedding_hash(db, note_id) if note is not None else None
+        row = db.get(NoteNeighbors, note_id)
+        if content_hash is None or note.workspace_id is None:
+            # deleted, emptied or not embedded yet: nothing to link
+            if row is not None:
+                db.delete(row)
+                db.commit()
+            return remove_note(note_id) if note is None else []
+        changed = row is None or row.content_hash != content_hash
+        if not changed and not force:
+            return []
+
+        key = str(note_id)
+        previous = _load(row)
+        current = {
+            str(other_id): score
+            for other_id, score in similar_notes(note.workspace_id, note.id, db, NOTE_GRAPH_K)
+            if score >= NOTE_GRAPH_MIN_SCORE
+        }
+        if row is None:
+            row = NoteNeighbors(note_id=note.id, workspace_id=note.workspace_id)
+            db.add(row)
+        row.content_hash = content_hash
+        _store(row, current)
+
+        # similarity is symmetric, so the other ends of this note's edges may need it too
+        recompute = []
+        others = db.query(NoteNeighbors).filter(
+            NoteNeighbors.note_id.in_([uuid.UUID(other_id) for other_id in set(previous) | set(current)])
+        )
+        for other in others:
+            neighbors = _load(other)
+            score = current.get(str(other.note_id))
+            if score is not None:
+                if key in neighbors or len(neighbors) < NOTE_GRAPH_K or score > min(neighbors.values()):
+                    neighbors[key] = score
+                    _store(other, neighbors)
+            elif changed and key in neighbors:
+                # this note moved away; whoever replaces it in the other's list needs a search
+                del neighbors[key]
+                _store(other, neighbors)
+                recompute.append(other.note_id)
+        db.commit()
+        return recompute
+
+
+def remove_note(note_id) -> List:
+    """Drop a deleted note from every list that holds it. Returns the notes whose lists need refilling."""
+    key = str(note_id)
+    with SessionLocal() as db:
+        holders = [
+            row for row in db.query(NoteNeighbors).filter(NoteNeighbors.neighbors.contains(key))
+            if key in _load(row)
+        ]
+        for row in holders:
+            neighbors = _load(row)
+            del neighbors[key]
+            _store(row, neighbors)
+        db.commit()
+        return [row.note_id for row in holders]
+
+
+def _unlinked_notes() -> list:
+    with SessionLocal() as db:
+        linked = db.query(NoteNeighbors.note_id)
+        rows = (
+            db.query(NoteEmbedding.note_id)
+            .filter(NoteEmbedding.model_name == EMBEDDING_MODEL_NAME, ~NoteEmbedding.note_id.in_(linked))
+            .distinct()
+            .all()
+        )
+        return [row.note_id for row in rows]
+
+
+def get_related(db, note_id, limit: int = NOTE_GRAPH_K) -> Optional[List[dict]]:
+    """The note's precomputed neighbours, best first, or None if its list has not been computed yet."""
+    row = db.get(NoteNeighbors, note_id)
+    if row is None:
+        return None
+    neighbors = json.loads(row.neighbors)[:limit]
+    if not neighbors:
+        return []
+    notes = {
+        str(note.id): note
+        for note in db.query(Note.id, Note.title, Note.file_name, Note.file_type, Note.updated_at).filter(
+            Note.id.in_([uuid.UUID(other_id) for other_id, _ in neighbors])
+        )
+    }
+    return [
+        {
+            "id": other_id,
+            "title": notes[other_id].title,
+            "file_name": notes[other_id].file_name,
+            "file_type": notes[other_id].file_type,
+            "updated_at": notes[other_id].updated_at.isoformat() if notes[other_id].updated_at else None,
+            "score": score,
+        }
+        # a neighbour deleted moments ago may not have been unlinked yet
+        for other_id, score in neighbors if other_id in notes
+    ]
+
+
+class NoteGraphWorker:
+    """Background upkeep of the neighbour graph, one note at a time. enqueue() is safe from any thread."""
+
+    def __init__(self):
+        # note id -> force a recompute even if its embeddings are unchanged
+        self._pending: "OrderedDict[object, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self._stats = {"updated": 0, "repaired": 0, "failed": 0}
+        self._last_error: Optional[str] = None
+
+    def enqueue(self, note_id, force: bool = False) -> None:
+        if not NOTE_GRAPH_ENABLED:
+            return
+        with self._lock:
+            self._pending[note_id] = self._pending.get(note_id, False) or force
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop(self):
+        with self._lock:
+            return self._pending.popitem(last=False) if self._pending else None
+
+    async def _run(self) -> None:
+        while True:
+            item = self._pop()
+            if item is None:
+                self._wakeup.clear()
+                item = self._pop()
+                if item is None:
+                    await self._wakeup.wait()
+                    continue
+            note_id, force = item
+            if not is_embedding_model_ready():
+                # similar_notes needs the vector index; try again once the model is up
+                self.enqueue(note_id, force)
+                await asyncio.sleep(5.0)
+                continue
+            try:
+                recompute = await asyncio.to_thread(update_note, note_id, force)
+                self._stats["updated"] += 1
+                self._stats["repaired"] += len(recompute)
+                for other_id in recompute:
+                    self.enqueue(other_id, force=True)
+            except Exception as e:
+                self._stats["failed"] += 1
+                self._last_error = f"note {note_id}: {e}"
+                print(f"Note graph update failed for note {note_id}: {e}", flush=True)
+
+    def start(self) -> None:
+        """Start the worker task on the running event loop (call from app startup)."""
+        if self._task is not None or not NOTE_GRAPH_ENABLED:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print("Note graph worker started", flush=True)
+
+    async def backfill(self) -> int:
+        """Queue every embedded note that has no neighbour list yet."""
+        if not NOTE_GRAPH_ENABLED:
+            return 0
+        try:
+            missing = await asyncio.to_thread(_unlinked_notes)
+        except Exception as e:
+            print(f"Note graph backfill query failed: {e}", flush=True)
+            return 0
+        for note_id in missing:
+            self.enqueue(note_id)
+        if missing:
+            print(f"Note graph backfill queued {len(missing)} notes", flush=True)
+        return len(missing)
+
+    def status(self) -> dict:
+        with self._lock:
+            status = dict(self._stats)
+            status["pending"] = len(self._pending)
+        status["running"] = self._task is not None
+        status["k"] = NOTE_GRAPH_K
+        status["last_error"] = self._last_error
+        return status
+
+
+note_graph = NoteGraphWorker()
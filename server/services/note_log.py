@@ -0,0 +1,199 @@
+"""Append-only log of the edits made to live documents since they were last compacted.
+
+Every operation a live document (services/live_documents.py) accepts is appended
+to a Redis list for its note, a batch per round trip, which makes the edit durable
+without touching the database. Compaction writes the document's text to
+Note.content and restarts the log from it, so the database is written once per
+compaction rather than once per pause in typing.
+
+note_log:{note_id}        list: a header {"base": hash of the text the log starts from},
+                          then one entry per update: {"o": operation} and/or {"t": title}
+note_log_lease:{note_id}  the process holding the note's live document; refreshed on every
+                          write to the log, so it lapses only once that process has stopped
+
+A document loaded from the database replays its note's log. A log whose base is
+not the stored text (the compaction committed but restarting the log didn't, or
+the note was rewritten meanwhile) is stale and dropped: the database already has
+newer text. Logs holding updates whose lease has lapsed were left by a stopped
+server and are compacted by whichever process claims them first. Without Redis
+there is no log, and live documents are saved shortly after every pause instead.
+"""
+import hashlib
+import json
+import os
+import uuid
+from typing import List, Optional, Tuple
+
+LIVE_LOG_ENABLED = os.getenv("LIVE_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+# must outlast LIVE_COMPACT_INTERVAL: a log with updates is written to at least that often
+LIVE_LOG_LEASE_SECONDS = int(os.getenv("LIVE_LOG_LEASE_SECONDS", "120"))
+
+_KEY_PREFIX = "note_log:"
+_LEASE_PREFIX = "note_log_lease:"
+
+
+def _base_hash(content: Optional[str]) -> str:
+    return hashlib.sha1((content or "").encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class NoteLog:
+    def __init__(self):
+        self._redis = None
+        self._connected = False
+        # identifies this process's leases
+        self._owner = uuid.uuid4().hex
+        self._stats = {"appended": 0, "batches": 0, "replayed": 0, "resets": 0, "stale": 0, "errors": 0}
+
+    def _get_redis(self):
+        if not self._connected:
+            self._connected = True
+            if LIVE_LOG_ENABLED:
+                from services.redis_manager import get_redis_connection
+                self._redis = get_redis_connection()
+            print(f"Live document log {'in Redis' if self._redis else 'disabled'}", flush=True)
+        return self._redis
+
+    @property
+    def enabled(self) -> bool:
+        return self._get_redis() is not None
+
+    def connect(self) -> bool:
+        """Connect now rather than on first use (connecting blocks); whether the log is enabled."""
+        return self._get_redis() is not None
+
+    @staticmethod
+    def _key(note_id) -> str:
+        return f"{_KEY_PREFIX}{note_id}"
+
+    @staticmethod
+    def _lease_key(note_id) -> str:
+        return f"{_LEASE_PREFIX}{note_id}"
+
+    def _failed(self, action: str, note_id, error: Exception) -> None:
+        self._stats["errors"] += 1
+        print(f"Warning: could not {action} the edit log of note {note_id}: {error}", flush=True)
+
+    @staticmethod
+    def entry(ops=None, title: Optional[str] = None) -> dict:
+        """One update for append()."""
+        entry = {}
+        if ops is not None:
+            entry["o"] = ops
+        if title is not None:
+            entry["t"] = title
+        return entry
+
+    def append(self, note_id, entries: List[dict]) -> bool:
+        """Record updates in order; False if they aren't durable (no log, or the log has no header to append to)."""
+        redis = self._get_redis()
+        if redis is None:
+            return False
+        try:
+            pipe = redis.pipeline()
+            # RPUSHX: never start a log without the header saying what it applies to
+            pipe.rpushx(self._key(note_id), *(json.dumps(entry, separators=(",", ":")) for entry in entries))
+            pipe.set(self._lease_key(note_id), self._owner, ex=LIVE_LOG_LEASE_SECONDS)
+            appended = pipe.execute()[0] > 0
+        except Exception as e:
+            self._failed("append to", note_id, e)
+            return False
+        if appended:
+            self._stats["appended"] += len(entries)
+            self._stats["batches"] += 1
+        return appended
+
+    def reset(self, note_id, content: Optional[str]) -> bool:
+        """Restart the log from `content`, which the database now holds."""
+        redis = self._get_redis()
+        if redis is None:
+            return False
+        key = self._key(note_id)
+        try:
+            pipe = redis.pipeline()
+            pipe.delete(key)
+            pipe.rpush(key, json.dumps({"base": _base_hash(content)}))
+            pipe.set(self._lease_key(note_id), self._owner, ex=LIVE_LOG_LEASE_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            self._failed("reset", note_id, e)
+            return False
+        self._stats["resets"] += 1
+        return True
+
+    def entries(self, note_id, content: Optional[str]) -> Optional[List[dict]]:
+        """The updates logged on top of `content` (the stored text), or None if there is no usable log."""
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = redis.lrange(self._key(note_id), 0, -1)
+        except Exception as e:
+            self._failed("read", note_id, e)
+            return None
+        if not raw:
+            return None
+        try:
+            header = json.loads(raw[0])
+            if header.get("base") != _base_hash(content):
+                self._stats["stale"] += 1
+                return None
+            entries = [json.loads(entry) for entry in raw[1:]]
+        except (TypeError, ValueError, AttributeError) as e:
+            self._failed("parse", note_id, e)
+            return None
+        self._stats["replayed"] += len(entries)
+        return entries
+
+    def discard(self, note_id) -> None:
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            redis.delete(self._key(note_id))
+            lease_key = self._lease_key(note_id)
+            if redis.get(lease_key) == self._owner:
+                redis.delete(lease_key)
+        except Exception as e:
+            self._failed("delete", note_id, e)
+
+    def hold(self, note_id) -> None:
+        """Take the lease on a log this process has just loaded a document from."""
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            redis.set(self._lease_key(note_id), self._owner, ex=LIVE_LOG_LEASE_SECONDS)
+        except Exception as e:
+            self._failed("lease", note_id, e)
+
+    def claim(self, note_id) -> bool:
+        """Take the lease on a log nobody holds, e.g. to recover it; False if a live process has it."""
+        redis = self._get_redis()
+        if redis is None:
+            return False
+        try:
+            return bool(redis.set(self._lease_key(note_id), self._owner, nx=True, ex=LIVE_LOG_LEASE_SECONDS))
+        except Exception as e:
+            self._failed("claim", note_id, e)
+            return False
+
+    def pending(self) -> List[Tuple[str, int]]:
+        """(note_id, updates) for every log holding updates, whether or not a process holds it."""
+        redis = self._get_redis()
+        if redis is None:
+            return []
+        found = []
+        try:
+            for key in redis.scan_iter(match=f"{_KEY_PREFIX}*", count=500):
+                length = redis.llen(key)
+                if length > 1:
+                    found.append((key[len(_KEY_PREFIX):], length - 1))
+        except Exception as e:
+            self._failed("scan", "*", e)
+        return found
+
+    def stats(self) -> dict:
+        return {**self._stats, "enabled": self._redis is not None}
+
+
+note_log = NoteLog()
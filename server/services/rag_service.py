@@ -1,102 +1,583 @@
+import hashlib
+import os
 import numpy as np
 import threading
-from typing import List, Dict
-from sqlalchemy.orm import Session
+from collections import OrderedDict
+from typing import List, Dict, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
 from models.note import Note
+from models.note_embedding import NoteEmbedding
+from services.db import SessionLocal
+from services.vector_index import normalize, VECTOR_PRECISION
+from services.ann_index import IVFVectorIndex
+from services.index_segments import segments_enabled, read_segment, write_segment, delete_segment
+from services.chunking import chunk_text, CHUNK_TOKENS, CHUNK_OVERLAP
+from services.bm25 import BM25Index, reciprocal_rank_fusion
+from services.embedding_executor import EmbeddingExecutor, PRIORITY_SPECULATIVE
+from services.query_cache import LRUCache, normalize_query, query_key
+from services.context_packer import pack_rag_context, pack_summary_context
+from services.answer_cache import answer_cache
+from services.workspace_digest import digest_worker
+from services.embedding_model import (
+    EMBEDDING_MODEL_NAME,
+    get_embedding_model,
+    preload_model_async,
+    is_embedding_model_ready,
+)
 
-# Lazy loading for the embedding model AND imports
-_embedding_model = None
-_SentenceTransformer = None
-_model_loading = False
-_model_lock = threading.Lock()
+RAG_INDEX_CACHE_MB = int(os.getenv("RAG_INDEX_CACHE_MB", "256"))
+PASSAGES_PER_NOTE = 2
+RRF_K = 60
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+RAG_RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", "512"))
 
-def get_embedding_model():
-    """Lazily load the embedding model (and heavy imports)"""
-    global _embedding_model, _SentenceTransformer, _model_loading
-    
-    # Fast path - model already loaded
-    if _embedding_model is not None:
-        return _embedding_model
-    
-    with _model_lock:
-        # Double-check after acquiring lock
-        if _embedding_model is None:
-            print("Loading sentence-transformers model... (this may take a moment)", flush=True)
-            # Lazy import to avoid slow startup
-            from sentence_transformers import SentenceTransformer
-            _SentenceTransformer = SentenceTransformer
-            _embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            print("Model loaded successfully!", flush=True)
-    return _embedding_model
-
-
-def preload_model_async():
-    """Start loading the model in a background thread.
-    Call this after server startup for faster first AI query."""
-    def _load():
+# every encode goes through one batching thread; see services/embedding_executor.py
+embedding_executor = EmbeddingExecutor(get_embedding_model)
+
+# repeated questions skip the model: normalized query text -> embedding
+_query_embedding_cache = LRUCache(RAG_QUERY_CACHE_SIZE)
+# (workspace_id, index generation, query hash, top_n, passages) -> results; a write bumps the generation
+_result_cache = LRUCache(RAG_RESULT_CACHE_SIZE)
+
+def get_note_embedding(text):
+    """Embed one string (query priority, micro-batched with concurrent queries, cached)
+    or a list of strings (document priority). Blocks the calling thread, so
+    call it from a worker thread rather than the event loop."""
+    if isinstance(text, str):
+        key = normalize_query(text)
+        vector = _query_embedding_cache.get(key)
+        if vector is None:
+            # own copy: the executor hands back a view into the whole batch
+            vector = np.array(embedding_executor.embed_query_sync(text))
+            vector.flags.writeable = False
+            _query_embedding_cache.put(key, vector)
+        return vector
+    return embedding_executor.embed_documents(list(text))
+
+
+def prefetch_query_embedding(text: str) -> bool:
+    """Embed a question that is still being typed, behind queries and document
+    indexing, and cache it as get_note_embedding would. Returns False if it was cached already."""
+    key = normalize_query(text)
+    if _query_embedding_cache.peek(key) is not None:
+        return False
+    vector = np.array(embedding_executor.submit([text], PRIORITY_SPECULATIVE).result()[0])
+    vector.flags.writeable = False
+    _query_embedding_cache.put(key, vector)
+    return True
+
+
+def retrieval_cache_stats() -> dict:
+    return {
+        "query_embeddings": _query_embedding_cache.stats(),
+        "results": _result_cache.stats(),
+    }
+
+def note_embedding_text(note: Note) -> str:
+    """The text that gets hashed to decide whether a note needs re-embedding."""
+    return f"{note.title}\n\n{note.content}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _note_hash(note: Note) -> str:
+    # chunking parameters are part of the key so changing them re-embeds everything
+    return content_hash(f"{CHUNK_TOKENS}:{CHUNK_OVERLAP}\n{note_embedding_text(note)}")
+
+
+def note_chunks(note: Note, use_model_tokenizer: bool = True) -> List[tuple]:
+    """Token-bounded, overlapping (start, end) spans over a note's content."""
+    content = note.content or ""
+    tokenizer = getattr(get_embedding_model(), "tokenizer", None) if use_model_tokenizer else None
+    spans = chunk_text(content, tokenizer)
+    if not spans and (note.title or "").strip():
+        # title-only note: embed the title on its own
+        spans = [(0, 0)]
+    return spans
+
+
+def upsert_note_chunks(db: Session, note: Note) -> Optional[tuple]:
+    """Return (spans, vectors) for a note's chunks, re-embedding only if its text changed.
+    The caller is responsible for committing."""
+    if not note_embedding_text(note).strip():
+        if note.embeddings:
+            note.embeddings = []
+        return None
+
+    text_hash = _note_hash(note)
+    stored = note.embeddings
+    if stored and all(
+        row.content_hash == text_hash and row.model_name == EMBEDDING_MODEL_NAME
+        for row in stored
+    ):
+        if _stamped_before(stored, note.updated_at):
+            # saved without a text change: mark the rows current so the startup backfill leaves the note alone
+            for row in stored:
+                row.updated_at = func.now()
+        spans = [(row.char_start, row.char_end) for row in stored]
+        vectors = np.vstack([np.frombuffer(row.vector, dtype=np.float32) for row in stored])
+        return spans, vectors
+
+    spans = note_chunks(note)
+    content = note.content or ""
+    texts = [_chunk_text(note.title, content, span) for span in spans]
+    # stored pre-normalised so retrieval can score with a plain dot product
+    vectors = normalize(get_note_embedding(texts))
+
+    # reuse existing rows in place so (note_id, chunk_index) stays unique within the flush
+    rows = list(note.embeddings)
+    for i, (start, end) in enumerate(spans):
+        if i < len(rows):
+            row = rows[i]
+        else:
+            row = NoteEmbedding(note_id=note.id, chunk_index=i)
+            note.embeddings.append(row)
+        row.workspace_id = note.workspace_id
+        row.char_start = start
+        row.char_end = end
+        row.content_hash = text_hash
+        row.model_name = EMBEDDING_MODEL_NAME
+        row.dim = int(vectors.shape[1])
+        row.vector = vectors[i].tobytes()
+    del note.embeddings[len(spans):]
+    return spans, vectors
+
+
+def _stamped_before(rows, when) -> bool:
+    return when is not None and any(row.updated_at is None or row.updated_at < when for row in rows)
+
+
+def _chunk_text(title: str, content: str, span: tuple) -> str:
+    return f"{title}\n\n{content[span[0]:span[1]]}"
+
+
+def _note_record(note: Note, spans: List[tuple]) -> dict:
+    return {
+        "title": note.title,
+        "content": note.content,
+        "created_at": note.created_at.isoformat() if note.created_at else None,
+        "chunks": spans,
+        "hash": _note_hash(note),
+    }
+
+
+class WorkspaceIndex:
+    """Everything retrieval needs for one workspace, held in memory: one dense vector
+    and one BM25 document per (note_id, chunk_index), plus the note fields that end up
+    in results. A lexical-only index (built while the model is loading) has no vectors.
+    `dirty` means the vectors changed since they were last written to a segment."""
+
+    def __init__(self, vectors: Optional[IVFVectorIndex] = None):
+        # exact below RAG_ANN_THRESHOLD chunks, IVF approximate search above it;
+        # float32 originals are only kept for rescoring when segments can hold them
+        self.vectors = vectors if vectors is not None else IVFVectorIndex(keep_full=segments_enabled())
+        self.lexical = BM25Index()
+        self.notes: Dict = {}
+        self.dirty = False
+        self._text_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.lexical)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.lexical.nbytes + self._text_bytes
+
+    def upsert(self, note_id, vectors: Optional[np.ndarray], record: dict) -> None:
+        self.remove(note_id)
+        for chunk_index, span in enumerate(record["chunks"]):
+            chunk_id = (note_id, chunk_index)
+            if vectors is not None:
+                self.vectors.upsert(chunk_id, vectors[chunk_index])
+                self.dirty = True
+            self.lexical.add(chunk_id, _chunk_text(record["title"], record["content"] or "", span))
+        self.notes[note_id] = record
+        self._text_bytes += len(record["title"] or "") + len(record["content"] or "")
+
+    def remove(self, note_id) -> None:
+        record = self.notes.pop(note_id, None)
+        if record:
+            for chunk_index in range(len(record["chunks"])):
+                if self.vectors.remove((note_id, chunk_index)):
+                    self.dirty = True
+                self.lexical.remove((note_id, chunk_index))
+            self._text_bytes -= len(record["title"] or "") + len(record["content"] or "")
+
+    def segment_notes(self) -> Dict:
+        """Per-note metadata stored alongside the vectors in a segment."""
+        return {
+            note_id: {"hash": record["hash"], "chunks": record["chunks"]}
+            for note_id, record in self.notes.items()
+            if (note_id, 0) in self.vectors
+        }
+
+
+class WorkspaceIndexCache:
+    """LRU cache of WorkspaceIndex objects bounded by an approximate memory budget.
+
+    Writers update cached indexes in place. A generation counter per workspace
+    stops an index that was loaded from the DB while a write was in flight
+    from being cached with stale data. `on_evict(workspace_id, index)` runs
+    outside the lock for every index pushed out of the cache."""
+
+    def __init__(self, max_bytes: int, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[object, WorkspaceIndex]" = OrderedDict()
+        self._generations: Dict = {}
+        self._lock = threading.RLock()
+
+    @property
+    def lock(self):
+        return self._lock
+
+    def get(self, workspace_id) -> Optional[WorkspaceIndex]:
+        with self._lock:
+            index = self._entries.get(workspace_id)
+            if index is not None:
+                self._entries.move_to_end(workspace_id)
+            return index
+
+    def generation(self, workspace_id) -> int:
+        with self._lock:
+            return self._generations.get(workspace_id, 0)
+
+    def put(self, workspace_id, index: WorkspaceIndex, generation: int) -> bool:
+        with self._lock:
+            if self._generations.get(workspace_id, 0) != generation:
+                return False
+            self._entries[workspace_id] = index
+            self._entries.move_to_end(workspace_id)
+            evicted = self._evict()
+        self._notify(evicted)
+        return True
+
+    def update_note(self, workspace_id, note_id, vectors: Optional[np.ndarray], record: Optional[dict]) -> None:
+        with self._lock:
+            self._generations[workspace_id] = self._generations.get(workspace_id, 0) + 1
+            index = self._entries.get(workspace_id)
+            if index is None:
+                return
+            if record is None:
+                index.remove(note_id)
+            else:
+                index.upsert(note_id, vectors, record)
+            evicted = self._evict()
+        self._notify(evicted)
+
+    def invalidate(self, workspace_id) -> None:
+        with self._lock:
+            self._generations[workspace_id] = self._generations.get(workspace_id, 0) + 1
+            self._entries.pop(workspace_id, None)
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._entries.items())
+
+    def _evict(self) -> list:
+        evicted = []
+        total = sum(index.nbytes for index in self._entries.values())
+        # always keep the most recently used workspace, even if it alone is over budget
+        while total > self.max_bytes and len(self._entries) > 1:
+            workspace_id, index = self._entries.popitem(last=False)
+            total -= index.nbytes
+            evicted.append((workspace_id, index))
+        return evicted
+
+    def _notify(self, evicted: list) -> None:
+        if self.on_evict is None:
+            return
+        for workspace_id, index in evicted:
+            try:
+                self.on_evict(workspace_id, index)
+            except Exception as e:
+                print(f"Eviction hook failed for workspace {workspace_id}: {e}", flush=True)
+
+
+def save_index_segment(workspace_id, index: WorkspaceIndex) -> bool:
+    """Write a workspace's vectors to its on-disk segment if they changed since the last write."""
+    if not segments_enabled() or not index.dirty:
+        return False
+    try:
+        write_segment(workspace_id, index.vectors, index.segment_notes(), EMBEDDING_MODEL_NAME)
+    except Exception as e:
+        print(f"Could not write index segment for workspace {workspace_id}: {e}", flush=True)
+        return False
+    index.dirty = False
+    return True
+
+
+_index_cache = WorkspaceIndexCache(RAG_INDEX_CACHE_MB * 1024 * 1024, on_evict=save_index_segment)
+
+
+def flush_index_segments() -> int:
+    """Persist every cached workspace whose vectors changed (call on shutdown)."""
+    saved = 0
+    with _index_cache.lock:
+        for workspace_id, index in _index_cache.items():
+            saved += save_index_segment(workspace_id, index)
+    return saved
+
+
+def refresh_note_embedding(note_id) -> bool:
+    """Bring a single note's stored embeddings up to date and patch the cached workspace index.
+    Opens its own session so it can run in a worker thread. Returns False on failure."""
+    try:
+        with SessionLocal() as db:
+            note = db.query(Note).filter(Note.id == note_id).first()
+            if not note:
+                return True
+            chunks = upsert_note_chunks(db, note)
+            db.commit()
+            if chunks is None:
+                _index_cache.update_note(note.workspace_id, note.id, None, None)
+            else:
+                spans, vectors = chunks
+                _index_cache.update_note(note.workspace_id, note.id, vectors, _note_record(note, spans))
+            # answers cached while the index still had the old text
+            answer_cache.note_changed(note.workspace_id, note.id)
+        return True
+    except Exception as e:
+        print(f"Failed to refresh embedding for note {note_id}: {e}", flush=True)
+        return False
+
+
+def forget_note(workspace_id, note_id) -> None:
+    """Drop a deleted note from the cached workspace index (and answers that may rely on it)."""
+    _index_cache.update_note(workspace_id, note_id, None, None)
+    answer_cache.workspace_changed(workspace_id)
+    digest_worker.schedule(workspace_id)
+
+
+def forget_workspace(workspace_id) -> None:
+    _index_cache.invalidate(workspace_id)
+    answer_cache.workspace_changed(workspace_id)
+    if segments_enabled():
+        delete_segment(workspace_id)
+
+
+def _load_workspace_index(db: Session, workspace_id, lexical_only: bool = False) -> WorkspaceIndex:
+    query = db.query(Note).filter(Note.workspace_id == workspace_id)
+
+    if lexical_only:
+        index = WorkspaceIndex()
+        for note in query.all():
+            if note_embedding_text(note).strip():
+                index.upsert(note.id, None, _note_record(note, note_chunks(note, use_model_tokenizer=False)))
+        return index
+
+    segment = read_segment(workspace_id, EMBEDDING_MODEL_NAME, VECTOR_PRECISION) if segments_enabled() else None
+    if segment is None:
+        index = WorkspaceIndex()
+        notes = query.options(selectinload(Note.embeddings)).all()
+        stored = {}
+    else:
+        # vectors come memory-mapped from disk; only notes edited since the snapshot touch the DB blobs
+        vectors, stored = segment
+        index = WorkspaceIndex(vectors)
+        notes = query.all()
+        current = {note.id: _note_hash(note) for note in notes}
+        for note_id, meta in list(stored.items()):
+            if current.get(note_id) != meta["hash"]:
+                for chunk_index in range(len(meta["chunks"])):
+                    vectors.remove((note_id, chunk_index))
+                del stored[note_id]
+                index.dirty = True
+
+    for note in notes:
+        meta = stored.get(note.id)
+        if meta is not None:
+            index.upsert(note.id, None, _note_record(note, meta["chunks"]))
+            continue
+
+        # only notes whose text changed since they were last embedded hit the model
+        chunks = upsert_note_chunks(db, note)
+        if chunks is None:
+            continue
+        spans, vectors = chunks
+        index.upsert(note.id, vectors, _note_record(note, spans))
+
+    # persist anything we had to (re-)embed so the next load doesn't pay for it
+    if db.new or db.dirty or db.deleted:
         try:
-            get_embedding_model()
+            db.commit()
         except Exception as e:
-            print(f"Background model loading failed: {e}", flush=True)
-    
-    thread = threading.Thread(target=_load, daemon=True)
-    thread.start()
-    print("Started background model preloading...", flush=True)
+            db.rollback()
+            print(f"Could not persist note embeddings: {e}", flush=True)
 
-def get_note_embedding(text):
-    model = get_embedding_model()
-    return model.encode(text, convert_to_numpy=True)
+    if save_index_segment(workspace_id, index):
+        # swap in the memory-mapped copy so the float32 originals leave RAM
+        segment = read_segment(workspace_id, EMBEDDING_MODEL_NAME, VECTOR_PRECISION)
+        if segment is not None:
+            index.vectors = segment[0]
+
+    return index
+
+
+def get_workspace_index(workspace_id, db: Session) -> WorkspaceIndex:
+    """Return the in-memory index for a workspace, loading it from the DB on a cache miss.
+    While the embedding model is still loading, a throwaway lexical-only index is built instead."""
+    index = _index_cache.get(workspace_id)
+    if index is not None:
+        return index
+
+    if not is_embedding_model_ready():
+        return _load_workspace_index(db, workspace_id, lexical_only=True)
+
+    generation = _index_cache.generation(workspace_id)
+    index = _load_workspace_index(db, workspace_id)
+    _index_cache.put(workspace_id, index, generation)
+    return index
 
-def cosine_sim(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-# using a vsm IR model w/ neural embeddings
+def _rank_chunks(index: WorkspaceIndex, query: str, query_embedding: Optional[np.ndarray], k: int):
+    """Dense and BM25 top-k over chunks, fused with reciprocal-rank fusion."""
+    rankings = []
+    dense_scores = {}
+    if query_embedding is not None and len(index.vectors):
+        dense = index.vectors.search(query_embedding, k)
+        dense_scores = dict(dense)
+        rankings.append([chunk_id for chunk_id, _ in dense])
+
+    lexical = index.lexical.search(query, k)
+    lexical_scores = dict(lexical)
+    rankings.append([chunk_id for chunk_id, _ in lexical])
+
+    return reciprocal_rank_fusion(rankings, k=RRF_K), dense_scores, lexical_scores
+
+
+def _group_hits_by_note(index: WorkspaceIndex, query: str, query_embedding: Optional[np.ndarray], top_n: int):
+    """Rank chunks and group them by note, best note first.
+    Widens the candidate depth until top_n distinct notes are found or the index is exhausted."""
+    total = len(index)
+    k = min(total, max(top_n * 10, 50))
+    while True:
+        fused, dense_scores, lexical_scores = _rank_chunks(index, query, query_embedding, k)
+        grouped = OrderedDict()
+        for (note_id, chunk_index), score in fused:
+            grouped.setdefault(note_id, []).append((chunk_index, score))
+        if len(grouped) >= top_n or k >= total:
+            return grouped, dense_scores, lexical_scores
+        k = min(total, k * 4)
+
+
+# hybrid retrieval: neural embeddings + BM25 over chunks, fused by rank
 def retrieve_relevant_notes(
     query,
     workspace_id,
     db,
-    top_n = 3
+    top_n = 3,
+    passages_per_note: int = PASSAGES_PER_NOTE
 ):
-    notes = db.query(Note).filter(Note.workspace_id == workspace_id).all()
+    # read the generation before the index so results computed from an older index
+    # can never be stored under a newer key
+    dense = is_embedding_model_ready()
+    cache_key = (workspace_id, _index_cache.generation(workspace_id), query_key(query), top_n, passages_per_note)
+    if dense:
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            return _copy_results(cached)
 
-    if not notes:
+    index = get_workspace_index(workspace_id, db)
+
+    if not len(index):
         return []
     
-    query_embedding = get_note_embedding(query)
+    # don't block on a model that is still loading; BM25 alone is better than nothing
+    query_embedding = get_note_embedding(query) if dense else None
 
     results = []
-    for note in notes:
-        note_text = f"{note.title}\n\n{note.content}"
+    with _index_cache.lock:
+        grouped, dense_scores, lexical_scores = _group_hits_by_note(index, query, query_embedding, top_n)
+        for note_id, chunk_hits in list(grouped.items())[:top_n]:
+            record = index.notes[note_id]
+            content = record["content"] or ""
+            passages = []
+            for chunk_index, score in chunk_hits[:passages_per_note]:
+                start, end = record["chunks"][chunk_index]
+                passages.append({
+                    "chunk_index": chunk_index,
+                    "start": start,
+                    "end": end,
+                    "text": content[start:end],
+                    "similarity": dense_scores.get((note_id, chunk_index), 0.0),
+                    "score": score,
+                })
+            chunk_ids = [(note_id, chunk_index) for chunk_index, _ in chunk_hits]
+            results.append({
+                "note_id": note_id,
+                "title": record["title"],
+                "content": content,
+                "similarity": max((dense_scores.get(c, 0.0) for c in chunk_ids), default=0.0),
+                "lexical_score": max((lexical_scores.get(c, 0.0) for c in chunk_ids), default=0.0),
+                "score": chunk_hits[0][1],
+                "created_at": record["created_at"],
+                "passages": passages,
+            })
 
-        if not note_text.strip():
-            continue
+    if dense:
+        _result_cache.put(cache_key, _copy_results(results))
+    return results
 
-        note_embedding = get_note_embedding(note_text)
 
-        similarity = cosine_sim(query_embedding, note_embedding)
-
-        results.append({
-            "note_id": note.id,
-            "title": note.title,
-            "content": note.content,
-            "similarity": float(similarity),
-            "created_at": note.created_at.isoformat() if note.created_at else None
-        })
+def similar_notes(workspace_id, note_id, db: Session, k: int) -> List[tuple]:
+    """Up to k (note_id, score) pairs for the notes most similar to note_id, best first.
+    A note's similarity to another is that of their closest pair of chunks, found by
+    searching the workspace index with each of the note's stored chunk vectors."""
+    rows = (
+        db.query(NoteEmbedding.vector)
+        .filter(NoteEmbedding.note_id == note_id, NoteEmbedding.model_name == EMBEDDING_MODEL_NAME)
+        .all()
+    )
+    if not rows:
+        return []
+    index = get_workspace_index(workspace_id, db)
+    best: Dict = {}
+    with _index_cache.lock:
+        # a chunk's top hits are mostly its own note's other chunks; look a little deeper
+        depth = k + len(rows) + 4
+        for row in rows:
+            for (other_id, _), score in index.vectors.search(np.frombuffer(row.vector, dtype=np.float32), depth):
+                if other_id != note_id and score > best.get(other_id, -1.0):
+                    best[other_id] = score
+    return sorted(best.items(), key=lambda item: -item[1])[:k]
 
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:top_n]
 
-def build_rag_context(relevant_notes):
-    if not relevant_notes:
-        return ""
-    context_parts = ["Here are the most relevant documents from the workspace:\n"]
+def _copy_results(results: List[dict]) -> List[dict]:
+    # callers are free to mutate what they get back
+    return [dict(result, passages=[dict(p) for p in result["passages"]]) for result in results]
 
-    for i, note in enumerate(relevant_notes, 1):
-        context_parts.append(f"\n--- Title: \"{note['title']}\" (ID: {note['note_id']}, relevance: {note['similarity']:.2f}) ---")
+def workspace_overview(workspace_id, db: Session, preview_chars: int = 600) -> List[dict]:
+    """Every note in the workspace with its background summary (services/summary_worker.py),
+    most recently updated first. Notes without one offer the start of their content."""
+    rows = (
+        db.query(Note.id, Note.title, Note.summary, func.substr(Note.content, 1, preview_chars).label("preview"), Note.created_at)
+        .filter(Note.workspace_id == workspace_id)
+        .order_by(Note.updated_at.desc())
+        .all()
+    )
+    return [
+        {
+            "note_id": row.id,
+            "title": row.title,
+            "summary": row.summary,
+            "content": row.preview or "",
+            "similarity": 0.0,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "passages": [],
+        }
+        for row in rows
+    ]
 
-        content = note['content'][:500]
-        context_parts.append(content)
-        if len(note['content']) > 500:
-            context_parts.append("...[truncated]")
 
-    return "\n".join(context_parts)
\ No newline at end of file
+def build_rag_context(relevant_notes, token_budget: Optional[int] = None, use_summaries: bool = False) -> str:
+    """Prompt context for the retrieved notes, packed into `token_budget` tokens
+    (RAG_CONTEXT_TOKENS by default); see services/context_packer.py. With
+    use_summaries, each note is represented by its summary instead of passages,
+    which is what broad "what's in my workspace" questions need."""
+    if use_summaries:
+        return pack_summary_context(relevant_notes, token_budget)["context"]
+    return pack_rag_context(relevant_notes, token_budget)["context"]
@@ -0,0 +1,233 @@
+"""Optional second retrieval stage: rescore candidate passages with a cross-encoder.
+
+The bi-encoder + BM25 ranking in retrieve_relevant_notes is cheap but coarse.
+When RERANK_ENABLED is set, the first RERANK_TOP_K candidate passages are
+scored against the question by a CPU cross-encoder in one batched call, and
+notes and passages are reordered by those scores before context packing.
+
+One batch runs at a time. Requests that arrive while it runs are queued (up
+to RERANK_MAX_QUEUED_PAIRS pairs) and scored together in the next batch,
+rather than skipping reranking. Each request waits at most RERANK_BUDGET_MS
+for the scores; past that (or while the model is loading, or when the queue
+is full) it keeps the first-stage order. A batch that overran still finishes
+in the background and its scores are cached per (query hash, chunk hash), so
+a repeated question is reranked for free.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.query_cache import LRUCache, query_key
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "24"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
+# pairs waiting behind the running batch; requests beyond this keep the first-stage order
+RERANK_MAX_QUEUED_PAIRS = int(os.getenv("RERANK_MAX_QUEUED_PAIRS", str(4 * RERANK_TOP_K)))
+# longer passages are cut before scoring; the cross-encoder truncates at 512 tokens anyway
+RERANK_MAX_CHARS = 2000
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    def __init__(self):
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._loading = False
+        # one batch at a time, off the event loop and off the embedding thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._queue_lock = threading.Lock()
+        # (query, query key, pairs, future) for the next batch, and whether a batch is running
+        self._queued: List[tuple] = []
+        self._queued_pairs = 0
+        self._running = False
+        self._cache = LRUCache(RERANK_CACHE_SIZE)
+        self._batch_ms = deque(maxlen=200)
+        self._stats = {
+            "requests": 0, "reranked": 0, "from_cache": 0, "over_budget": 0,
+            "busy": 0, "queued": 0, "not_ready": 0, "errors": 0, "pairs_scored": 0, "batches": 0,
+        }
+
+    # --- model ---
+
+    def _load(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    print(f"Loading reranker {RERANK_MODEL}...", flush=True)
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(RERANK_MODEL, device="cpu")
+                    print("Reranker loaded", flush=True)
+        return self._model
+
+    def preload_async(self) -> None:
+        if not RERANK_ENABLED or self._model is not None or self._loading:
+            return
+        self._loading = True
+
+        def _load():
+            try:
+                self._load()
+            except Exception as e:
+                print(f"Reranker loading failed: {e}", flush=True)
+            finally:
+                self._loading = False
+
+        threading.Thread(target=_load, daemon=True).start()
+
+    def is_ready(self) -> bool:
+        return self._model is not None
+
+    # --- scoring ---
+
+    def _submit(self, query: str, qkey: str, pending: List[tuple]) -> Optional[Future]:
+        """Queue (chunk hash, text) pairs for scoring; the future resolves once they are cached.
+        None if the queue behind the running batch is full."""
+        future: Future = Future()
+        with self._queue_lock:
+            if self._running:
+                if self._queued_pairs + len(pending) > RERANK_MAX_QUEUED_PAIRS:
+                    return None
+                self._stats["queued"] += 1
+            self._queued.append((query, qkey, pending, future))
+            self._queued_pairs += len(pending)
+            if not self._running:
+                self._running = True
+                self._executor.submit(self._drain)
+        return future
+
+    def _drain(self) -> None:
+        while True:
+            with self._queue_lock:
+                batch, self._queued, self._queued_pairs = self._queued, [], 0
+                if not batch:
+                    self._running = False
+                    return
+            self._score(batch)
+
+    def _score(self, batch: List[tuple]) -> None:
+        """Score the pairs of every queued request in one pass and cache the results."""
+        pairs = {}
+        for query, qkey, pending, _ in batch:
+            for chash, text in pending:
+                # requests for the same question share pairs, and may have been scored since they were queued
+                if (qkey, chash) not in pairs and self._cache.peek((qkey, chash)) is None:
+                    pairs[(qkey, chash)] = (query, text)
+        try:
+            if pairs:
+                start = time.perf_counter()
+                scores = self._model.predict(
+                    list(pairs.values()),
+                    batch_size=len(pairs),
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                )
+                self._batch_ms.append((time.perf_counter() - start) * 1000)
+                for key, score in zip(pairs, np.asarray(scores, dtype=np.float32).reshape(-1)):
+                    self._cache.put(key, float(score))
+                self._stats["pairs_scored"] += len(pairs)
+                self._stats["batches"] += 1
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+        for *_, future in batch:
+            future.set_result(None)
+
+    async def rerank(self, query: str, relevant_notes: List[dict], budget_ms: Optional[float] = None) -> tuple:
+        """(notes in reranked order, outcome). On any shortfall the notes come back unchanged.
+        Reranked passages get a descending "score" (so the packer follows the new order) and a raw "rerank_score"."""
+        if not RERANK_ENABLED or not relevant_notes:
+            return relevant_notes, "disabled"
+        self._stats["requests"] += 1
+        if not self.is_ready():
+            self.preload_async()
+            self._stats["not_ready"] += 1
+            return relevant_notes, "not_ready"
+
+        qkey = query_key(query)
+        candidates = []  # (note index, passage or None, chunk hash, text)
+        for i, note in enumerate(relevant_notes):
+            passages = note.get("passages") or [None]
+            for passage in passages:
+                text = (passage["text"] if passage else note.get("content") or "")[:RERANK_MAX_CHARS]
+                if text.strip():
+                    candidates.append((i, passage, chunk_hash(text), text))
+        candidates = candidates[:RERANK_TOP_K]
+        if not candidates:
+            return relevant_notes, "disabled"
+
+        scores = {c[2]: self._cache.get((qkey, c[2])) for c in candidates}
+        pending = list({chash: text for _, _, chash, text in candidates if scores[chash] is None}.items())
+        outcome = "from_cache"
+        if pending:
+            future = self._submit(query, qkey, pending)
+            if future is None:
+                self._stats["busy"] += 1
+                return relevant_notes, "busy"
+            budget = (RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+            try:
+                # shield: an overrun batch keeps going and fills the cache for next time
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=budget)
+            except asyncio.TimeoutError:
+                self._stats["over_budget"] += 1
+                return relevant_notes, "over_budget"
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"Reranking failed: {e}", flush=True)
+                return relevant_notes, "error"
+            scores = {chash: self._cache.peek((qkey, chash)) for chash in scores}
+            if any(score is None for score in scores.values()):
+                # evicted between scoring and reading; not worth a retry
+                return relevant_notes, "over_budget"
+            outcome = "reranked"
+        self._stats[outcome] += 1
+        return self._apply(relevant_notes, candidates, scores), outcome
+
+    @staticmethod
+    def _apply(relevant_notes: List[dict], candidates: List[tuple], scores: Dict[str, float]) -> List[dict]:
+        ranked = sorted(candidates, key=lambda c: -scores[c[2]])
+        total = len(ranked)
+        best: Dict[int, float] = {}
+        for rank, (i, passage, chash, _) in enumerate(ranked):
+            # scores above every first-stage score (RRF scores are well below 1)
+            value = 1.0 + (total - rank) / total
+            if passage is not None:
+                passage["rerank_score"] = scores[chash]
+                passage["score"] = value
+            best.setdefault(i, scores[chash])
+            note = relevant_notes[i]
+            note["score"] = max(note.get("score", 0.0), value)
+        for i, score in best.items():
+            relevant_notes[i]["rerank_score"] = score
+        order = sorted(range(len(relevant_notes)), key=lambda i: (i not in best, -best.get(i, 0.0), i))
+        return [relevant_notes[i] for i in order]
+
+    def stats(self) -> dict:
+        batches = sorted(self._batch_ms)
+        return {
+            "enabled": RERANK_ENABLED,
+            "model": RERANK_MODEL,
+            "ready": self.is_ready(),
+            "budget_ms": RERANK_BUDGET_MS,
+            "top_k": RERANK_TOP_K,
+            **self._stats,
+            "batch_p50_ms": batches[len(batches) // 2] if batches else None,
+            "batch_p95_ms": batches[int(len(batches) * 0.95)] if batches else None,
+            "cache": self._cache.stats(),
+        }
+
+
+reranker = Reranker()
@@ -0,0 +1,159 @@
+"""Speculative retrieval for AI questions that are still being typed.
+
+The assistant tab sends its (debounced) draft as a Socket.IO `ai_draft` event.
+The draft is embedded at the lowest embedding priority and run through
+retrieval for its workspace, which loads the workspace index if it was cold
+and leaves the scored candidates in the retrieval result cache. When the
+question is sent unchanged, prepare_chat finds its embedding and candidates
+already computed; when it differs, the index is at least warm.
+
+Speculative work is capped per user (one draft in flight, PREFETCH_PER_MINUTE
+per minute) and overall (PREFETCH_MAX_CONCURRENCY); drafts over the cap are
+dropped, never queued.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+from services.db import SessionLocal
+from services.query_cache import query_key
+from services.embedding_model import is_embedding_model_ready
+from services.rag_service import retrieve_relevant_notes, prefetch_query_embedding
+from services.context_packer import CONTEXT_CANDIDATE_NOTES, CONTEXT_PASSAGES_PER_NOTE
+from services.indexing_worker import indexing_worker
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_PER_MINUTE = int(os.getenv("PREFETCH_PER_MINUTE", "30"))
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("PREFETCH_MAX_CONCURRENCY", "2"))
+# drafts shorter than this say too little to be worth retrieving for
+PREFETCH_MIN_CHARS = 8
+# a question counts as prefetched if its draft was prefetched this recently
+PREFETCH_TTL_SECONDS = 300
+PREFETCH_REMEMBER = 4096
+
+
+def _prefetch(workspace_id, draft: str) -> None:
+    prefetch_query_embedding(draft)
+    with SessionLocal() as db:
+        retrieve_relevant_notes(
+            query=draft,
+            workspace_id=workspace_id,
+            db=db,
+            top_n=CONTEXT_CANDIDATE_NOTES,
+            passages_per_note=CONTEXT_PASSAGES_PER_NOTE,
+        )
+
+
+class RetrievalPrefetcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_calls: Dict[str, deque] = {}
+        self._user_busy = set()
+        self._running = 0
+        # (workspace_id, query key) -> when its draft was prefetched
+        self._prefetched: "OrderedDict[tuple, float]" = OrderedDict()
+        self._workspace_prefetched: Dict = {}
+        self._stats = {
+            "drafts": 0, "prefetched": 0, "failed": 0,
+            "skipped_short": 0, "skipped_duplicate": 0, "skipped_not_ready": 0,
+            "dropped_user_busy": 0, "dropped_user_rate": 0, "dropped_saturated": 0,
+            "questions": 0, "used_exact": 0, "used_warm_index": 0,
+        }
+
+    def _admit(self, user_id: str, key: tuple) -> Optional[str]:
+        """Reserve a slot for this draft, or say why not."""
+        now = time.monotonic()
+        with self._lock:
+            seen = self._prefetched.get(key)
+            if seen is not None and now - seen < PREFETCH_TTL_SECONDS:
+                return "skipped_duplicate"
+            if user_id in self._user_busy:
+                return "dropped_user_busy"
+            calls = self._user_calls.setdefault(user_id, deque())
+            while calls and now - calls[0] > 60:
+                calls.popleft()
+            if len(calls) >= PREFETCH_PER_MINUTE:
+                return "dropped_user_rate"
+            if self._running >= PREFETCH_MAX_CONCURRENCY:
+                return "dropped_saturated"
+            calls.append(now)
+            self._user_busy.add(user_id)
+            self._running += 1
+            return None
+
+    def _release(self, user_id: str, key: tuple, ok: bool) -> None:
+        with self._lock:
+            self._user_busy.discard(user_id)
+            self._running -= 1
+            if not self._user_calls.get(user_id):
+                self._user_calls.pop(user_id, None)
+            if ok:
+                self._prefetched[key] = time.monotonic()
+                self._prefetched.move_to_end(key)
+                self._workspace_prefetched[key[0]] = time.monotonic()
+                while len(self._prefetched) > PREFETCH_REMEMBER:
+                    self._prefetched.popitem(last=False)
+                if len(self._workspace_prefetched) > PREFETCH_REMEMBER:
+                    self._workspace_prefetched.clear()
+
+    async def prefetch(self, user_id, workspace_id, draft: str) -> str:
+        """Speculatively retrieve for a draft question. Returns "prefetched" or why it was not."""
+        self._stats["drafts"] += 1
+        draft = (draft or "").strip()
+        if not PREFETCH_ENABLED:
+            return "disabled"
+        if len(draft) < PREFETCH_MIN_CHARS:
+            status = "skipped_short"
+        elif not is_embedding_model_ready():
+            # lexical-only retrieval is cheap enough at question time; don't build throwaway indexes
+            status = "skipped_not_ready"
+        else:
+            key = (workspace_id, query_key(draft))
+            status = self._admit(str(user_id), key)
+            if status is None:
+                # someone is about to ask here; index its pending notes first
+                indexing_worker.mark_workspace_queried(workspace_id)
+                ok = False
+                try:
+                    await asyncio.to_thread(_prefetch, workspace_id, draft)
+                    ok = True
+                    status = "prefetched"
+                except Exception as e:
+                    status = "failed"
+                    print(f"Retrieval prefetch failed for workspace {workspace_id}: {e}", flush=True)
+                finally:
+                    self._release(str(user_id), key, ok)
+        self._stats[status] += 1
+        return status
+
+    def record_question(self, workspace_id, message: str) -> Optional[str]:
+        """Note whether a question being answered was prefetched: "exact" (same text),
+        "warm_index" (another draft in the workspace) or None."""
+        now = time.monotonic()
+        with self._lock:
+            self._stats["questions"] += 1
+            seen = self._prefetched.get((workspace_id, query_key(message)))
+            if seen is not None and now - seen < PREFETCH_TTL_SECONDS:
+                self._stats["used_exact"] += 1
+                return "exact"
+            seen = self._workspace_prefetched.get(workspace_id)
+            if seen is not None and now - seen < PREFETCH_TTL_SECONDS:
+                self._stats["used_warm_index"] += 1
+                return "warm_index"
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = self._running
+        questions = stats["questions"]
+        stats["exact_use_rate"] = stats["used_exact"] / questions if questions else 0.0
+        # share of prefetches whose exact text was then asked
+        stats["prefetch_precision"] = stats["used_exact"] / stats["prefetched"] if stats["prefetched"] else 0.0
+        return stats
+
+
+retrieval_prefetcher = RetrievalPrefetcher()
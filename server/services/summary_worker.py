@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+
+from models.note import Note
+from models.note_summary import NoteSummaryState
+from services.db import SessionLocal
+from services.context_packer import count_tokens
+from services.llm_client import llm_client, LLMSaturated
+from services.rag_service import content_hash, note_embedding_text
+from services.workspace_digest import digest_worker
+from services.table_stats import table_stats_text
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+# notes shorter than this are their own summary
+SUMMARY_MIN_CHARS = int(os.getenv("SUMMARY_MIN_CHARS", "1200"))
+# quiet period after the last edit, so a note being typed is summarised once
+SUMMARY_DELAY_SECONDS = float(os.getenv("SUMMARY_DELAY_SECONDS", "120"))
+# ...but a note edited without such a pause is still summarised this long after its first edit
+SUMMARY_MAX_WAIT_SECONDS = float(os.getenv("SUMMARY_MAX_WAIT_SECONDS", "900"))
+SUMMARY_CALLS_PER_MINUTE = float(os.getenv("SUMMARY_CALLS_PER_MINUTE", "6"))
+# small notes are summarised several per call, up to this many input tokens
+SUMMARY_BATCH_NOTES = 6
+SUMMARY_BATCH_TOKENS = 3000
+# a large document is summarised alone from excerpts totalling at most this many tokens
+SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", "6000"))
+SUMMARY_EXCERPTS = 4
+SUMMARY_MODEL = "gpt-4o-mini"
+
+SUMMARY_PROMPT = """You write short summaries of notes and documents for a workspace overview.
+For each note, write 2-4 sentences (at most 80 words) saying what it is and its key facts: topics, names, dates, numbers, decisions.
+Do not start with "This note". If the text is an excerpt of a longer document, summarise the document as a whole.
+Reply with JSON: {"summaries": [{"id": "<id>", "summary": "<summary>"}]}, one entry per note, using the ids given."""
+
+
+def summary_hash(note: Note) -> str:
+    return content_hash(note_embedding_text(note))
+
+
+def _excerpt(text: str, max_tokens: int) -> str:
+    """The text, or evenly spaced windows of it totalling about max_tokens."""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    chars_per_token = len(text) / tokens
+    window = int(max_tokens / SUMMARY_EXCERPTS * chars_per_token)
+    step = (len(text) - window) / (SUMMARY_EXCERPTS - 1)
+    return "\n[...]\n".join(text[int(i * step):int(i * step) + window] for i in range(SUMMARY_EXCERPTS))
+
+
+def _unsummarised_notes() -> list:
+    """(note_id, workspace_id) for long notes with no summary, or edited since they were summarised."""
+    with SessionLocal() as db:
+        rows = (
+            db.query(Note.id, Note.workspace_id)
+            .outerjoin(NoteSummaryState, NoteSummaryState.note_id == Note.id)
+            .filter(func.length(Note.content) >= SUMMARY_MIN_CHARS)
+            .filter(or_(NoteSummaryState.note_id.is_(None), Note.updated_at > NoteSummaryState.updated_at))
+            .all()
+        )
+        return [(row.id, row.workspace_id) for row in rows]
+
+
+def _load_batchable(note_ids: list) -> tuple:
+    """Notes that need a (new) summary, as {"id", "title", "text", "hash"}; notes that
+    became too short get their summary cleared. Returns (work, skipped count)."""
+    work, skipped = [], 0
+    with SessionLocal() as db:
+        notes = db.query(Note).filter(Note.id.in_(note_ids)).all()
+        states = {s.note_id: s for s in db.query(NoteSummaryState).filter(NoteSummaryState.note_id.in_(note_ids))}
+        for note in notes:
+            digest = summary_hash(note)
+            state = states.get(note.id)
+            if len(note.content or "") < SUMMARY_MIN_CHARS:
+                if state is not None:
+                    _store_summary(db, note, None, None)
+                skipped += 1
+                continue
+            if state is not None and state.content_hash == digest and state.model_name == SUMMARY_MODEL:
+                if note.updated_at is not None and (state.updated_at is None or state.updated_at < note.updated_at):
+                    # saved without a text change: mark the summary current so backfill leaves the note alone
+                    state.updated_at = func.now()
+                skipped += 1
+                continue
+            work.append({
+                "id": note.id,
+                "title": note.title,
+                # spreadsheets are summarised from their column statistics rather than raw rows
+                "text": table_stats_text(db, note.id) or _excerpt(note.content, SUMMARY_MAX_INPUT_TOKENS),
+                "hash": digest,
+            })
+        db.commit()
+    return work, skipped
+
+
+def _store_summary(db, note: Note, summary: Optional[str], digest: Optional[str]) -> None:
+    # keep updated_at as is: a new summary is not an edit
+    db.query(Note).filter(Note.id == note.id).update(
+        {Note.summary: summary, Note.updated_at: Note.updated_at}, synchronize_session=False
+    )
+    state = db.get(NoteSummaryState, note.id)
+    if digest is None:
+        if state is not None:
+            db.delete(state)
+    elif state is None:
+        db.add(NoteSummaryState(note_id=note.id, content_hash=digest, model_name=SUMMARY_MODEL))
+    else:
+        state.content_hash = digest
+        state.model_name = SUMMARY_MODEL
+
+
+def _save_summaries(results: List[tuple]) -> int:
+    """Write (note_id, summary, hash) results, skipping notes edited while they were being summarised."""
+    saved = 0
+    with SessionLocal() as db:
+        for note_id, summary, digest in results:
+            note = db.get(Note, note_id)
+            if note is None or summary_hash(note) != digest:
+                continue
+            _store_summary(db, note, summary, digest)
+            saved += 1
+            # the note's leaf in the workspace digest changed with it
+            digest_worker.schedule(note.workspace_id)
+        db.commit()
+    return saved
+
+
+def _batches(work: List[dict]) -> List[List[dict]]:
+    batches, current, current_tokens = [], [], 0
+    for item in sorted(work, key=lambda w: count_tokens(w["text"])):
+        tokens = count_tokens(item["text"])
+        if current and (len(current) >= SUMMARY_BATCH_NOTES or current_tokens + tokens > SUMMARY_BATCH_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class SummaryWorker:
+    """Fills Note.summary in the background for long notes and uploaded documents.
+
+    enqueue() (safe from any thread) schedules a note SUMMARY_DELAY_SECONDS after
+    its latest edit. Due notes are summarised several to an LLM call, calls are
+    spaced to SUMMARY_CALLS_PER_MINUTE, and the worker yields to chat whenever
+    requests are waiting for the LLM. A content hash skips notes whose text has
+    not changed since their last summary."""
+
+    def __init__(self):
+        self._due: Dict = {}
+        # note_id -> when it was first enqueued since it was last summarised
+        self._first: Dict = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self._last_call = 0.0
+        self._stats = {"enqueued": 0, "summarised": 0, "skipped": 0, "llm_calls": 0, "failed": 0}
+        self._last_error: Optional[str] = None
+
+    def enqueue(self, note_id, workspace_id, delay: float = SUMMARY_DELAY_SECONDS) -> None:
+        if not SUMMARY_ENABLED or note_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            first = self._first.setdefault(note_id, now)
+            self._due[note_id] = min(first + SUMMARY_MAX_WAIT_SECONDS, now + delay)
+            self._stats["enqueued"] += 1
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            due = [note_id for note_id, at in self._due.items() if at <= now]
+            for note_id in due:
+                del self._due[note_id]
+                del self._first[note_id]
+            return due
+
+    def _next_due_in(self) -> Optional[float]:
+        with self._lock:
+            if not self._due:
+                return None
+            return max(0.0, min(self._due.values()) - time.monotonic())
+
+    async def _throttle(self) -> None:
+        interval = 60.0 / max(SUMMARY_CALLS_PER_MINUTE, 0.01)
+        while True:
+            wait = self._last_call + interval - time.monotonic()
+            # chat requests queued for the LLM come first
+            if wait <= 0 and llm_client.stats()["waiting"] == 0:
+                break
+            await asyncio.sleep(max(wait, 1.0))
+        self._last_call = time.monotonic()
+
+    async def _summarise(self, batch: List[dict]) -> List[tuple]:
+        aliases = {f"n{i + 1}": item for i, item in enumerate(batch)}
+        body = "\n\n".join(
+            f"### id: {alias}\nTitle: {item['title']}\n{item['text']}" for alias, item in aliases.items()
+        )
+        await self._throttle()
+        self._stats["llm_calls"] += 1
+        response = await llm_client.complete(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": body}],
+            max_tokens=160 * len(batch),
+            temperature=0.2,
+            response_format={"type": "json_object"},
+        )
+        parsed = json.loads(response.choices[0].message.content or "{}")
+        results = []
+        for entry in parsed.get("summaries", []):
+            item = aliases.get(str(entry.get("id")))
+            summary = (entry.get("summary") or "").strip()
+            if item is not None and summary:
+                results.append((item["id"], summary, item["hash"]))
+        return results
+
+    async def _process(self, note_ids: list) -> None:
+        work, skipped = await asyncio.to_thread(_load_batchable, note_ids)
+        self._stats["skipped"] += skipped
+        for batch in _batches(work):
+            try:
+                results = await self._summarise(batch)
+                self._stats["summarised"] += await asyncio.to_thread(_save_summaries, results)
+                missing = len(batch) - len(results)
+                if missing:
+                    self._stats["failed"] += missing
+            except LLMSaturated:
+                # busy; try these again later
+                for item in batch:
+                    self.enqueue(item["id"], None, delay=30)
+            except Exception as e:
+                self._stats["failed"] += len(batch)
+                self._last_error = str(e)
+                print(f"Summarising {len(batch)} notes failed: {e}", flush=True)
+
+    async def _run(self) -> None:
+        while True:
+            due = self._pop_due()
+            if not due:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_due_in())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(due)
+
+    def start(self) -> None:
+        """Start the worker task on the running event loop (call from app startup)."""
+        if self._task is not None or not SUMMARY_ENABLED:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print("Summary worker started", flush=True)
+
+    async def backfill(self) -> int:
+        """Queue every long note whose summary is missing or older than the note."""
+        if not SUMMARY_ENABLED:
+            return 0
+        try:
+            stale = await asyncio.to_thread(_unsummarised_notes)
+        except Exception as e:
+            print(f"Summary backfill query failed: {e}", flush=True)
+            return 0
+        for note_id, workspace_id in stale:
+            self.enqueue(note_id, workspace_id, delay=0)
+        if stale:
+            print(f"Summary backfill queued {len(stale)} notes", flush=True)
+        return len(stale)
+
+    def status(self) -> dict:
+        with self._lock:
+            status = dict(self._stats)
+            status["pending"] = len(self._due)
+        status["running"] = self._task is not None
+        status["last_error"] = self._last_error
+        return status
+
+
+summary_worker = SummaryWorker()
@@ -0,0 +1,307 @@
+"""Column statistics for tabular uploads (CSV, TSV, XLSX).
+
+When a spreadsheet is uploaded its rows are parsed into one NumPy array per
+column and summarised (count, missing, mean, spread, quantiles, distinct and
+most common values). The statistics are stored in note_table_stats, served by
+GET /notes/{id}/table-stats and, when retrieval picks the note for a chat
+question, put in the prompt instead of raw rows: the model gets exact numbers
+in a few hundred tokens rather than doing arithmetic over thousands of cells.
+
+CSV/TSV notes stay editable text, so the indexing worker recomputes their
+statistics whenever the content changes.
+"""
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import re
+from collections import Counter
+from datetime import date, datetime, time as dt_time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from models.note import Note
+from models.note_table_stats import NoteTableStats
+from services.db import SessionLocal
+
+TABULAR_EXTENSIONS = {".csv": "csv", ".tsv": "tsv", ".xlsx": "xlsx"}
+# rows beyond this are not parsed; the stats say so
+TABLE_STATS_MAX_ROWS = int(os.getenv("TABLE_STATS_MAX_ROWS", "200000"))
+TABLE_STATS_MAX_COLUMNS = 100
+TABLE_STATS_TOP_VALUES = 5
+# a column is numeric when at least this share of its non-empty cells are numbers
+NUMERIC_SHARE = 0.9
+# columns described in the chat prompt per table
+CONTEXT_MAX_COLUMNS = 30
+
+_NUMBER = re.compile(r"^[-+]?(\d{1,3}(,\d{3})+|\d*)(\.\d+)?([eE][-+]?\d+)?$")
+_CURRENCY = "$£€¥"
+
+
+def _to_number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        # NaN and infinities are not numbers anyone typed into a cell
+        return float(value) if math.isfinite(value) else None
+    text = str(value).strip().lstrip(_CURRENCY).rstrip("%").strip()
+    if not text or not _NUMBER.match(text) or not any(c.isdigit() for c in text):
+        return None
+    return float(text.replace(",", ""))
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _cell_text(value) -> str:
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def _split_header(rows: List[list]) -> tuple:
+    """(column names, data rows). The first row is a header unless it has a number in it."""
+    width = min(max((len(row) for row in rows), default=0), TABLE_STATS_MAX_COLUMNS)
+    first = rows[0] if rows else []
+    if first and all(_to_number(cell) is None for cell in first if not _is_empty(cell)):
+        names = [_cell_text(cell) if not _is_empty(cell) else f"column_{i + 1}" for i, cell in enumerate(first[:width])]
+        names += [f"column_{i + 1}" for i in range(len(names), width)]
+        return names, rows[1:]
+    return [f"column_{i + 1}" for i in range(width)], rows
+
+
+def _table(name: Optional[str], rows: List[list], truncated: bool) -> Optional[dict]:
+    rows = [row for row in rows if any(not _is_empty(cell) for cell in row)]
+    if not rows:
+        return None
+    names, data = _split_header(rows)
+    columns = [[row[i] if i < len(row) else None for row in data] for i in range(len(names))]
+    return {"name": name, "rows": len(data), "truncated": truncated, "columns": list(zip(names, columns))}
+
+
+def read_csv(text: str, delimiter: Optional[str] = None) -> List[dict]:
+    """One table: {"name", "rows", "truncated", "columns": [(name, cells)]}."""
+    if delimiter is None:
+        try:
+            delimiter = csv.Sniffer().sniff(text[:8192], delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+    rows, truncated = [], False
+    for i, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter)):
+        if i > TABLE_STATS_MAX_ROWS:
+            truncated = True
+            break
+        rows.append(row)
+    table = _table(None, rows, truncated)
+    return [table] if table else []
+
+
+def read_xlsx(data: bytes) -> List[dict]:
+    """One table per non-empty sheet."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    tables = []
+    try:
+        for sheet in workbook.worksheets:
+            rows, truncated = [], False
+            for i, row in enumerate(sheet.iter_rows(values_only=True)):
+                if i > TABLE_STATS_MAX_ROWS:
+                    truncated = True
+                    break
+                rows.append(list(row))
+            table = _table(sheet.title, rows, truncated)
+            if table:
+                tables.append(table)
+    finally:
+        workbook.close()
+    return tables
+
+
+def _numeric_array(cells: list) -> tuple:
+    """(float array of the finite numeric cells, count of the other ones) for the non-empty cells."""
+    if not any(isinstance(cell, bool) for cell in cells):
+        try:
+            # fast path: plain numbers or numeric strings ("nan" and "inf" parse too, so count them out)
+            values = np.asarray(cells, dtype=np.float64)
+            finite = np.isfinite(values)
+            return values[finite], len(values) - int(finite.sum())
+        except (TypeError, ValueError):
+            pass
+    numbers = [_to_number(cell) for cell in cells]
+    values = np.asarray([n for n in numbers if n is not None], dtype=np.float64)
+    return values, len(cells) - len(values)
+
+
+def column_stats(name: str, cells: list) -> dict:
+    present = [cell for cell in cells if not _is_empty(cell)]
+    stats = {"name": name, "count": len(present), "missing": len(cells) - len(present)}
+    values, non_numeric = _numeric_array(present) if present else (np.empty(0), 0)
+    if present and len(values) >= NUMERIC_SHARE * len(present):
+        q25, median, q75 = np.quantile(values, [0.25, 0.5, 0.75]).tolist()
+        stats.update(
+            type="number",
+            non_numeric=non_numeric,
+            mean=float(values.mean()),
+            std=float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+            min=float(values.min()),
+            p25=q25,
+            median=median,
+            p75=q75,
+            max=float(values.max()),
+            sum=float(values.sum()),
+            distinct=int(len(np.unique(values))),
+        )
+        return stats
+    counts = Counter(_cell_text(cell) for cell in present)
+    stats.update(
+        type="text",
+        distinct=len(counts),
+        top=[[value, count] for value, count in counts.most_common(TABLE_STATS_TOP_VALUES)],
+    )
+    return stats
+
+
+def compute_table_stats(tables: List[dict]) -> dict:
+    return {
+        "tables": [
+            {
+                "name": table["name"],
+                "rows": table["rows"],
+                "truncated": table["truncated"],
+                "columns": [column_stats(name, cells) for name, cells in table["columns"]],
+            }
+            for table in tables
+        ]
+    }
+
+
+def _source_of(note: Note, source: str):
+    """What the stats are computed from: the text of CSV/TSV notes, the original file for XLSX."""
+    return note.file_data if source == "xlsx" else (note.content or "")
+
+
+def _hash_source(data) -> str:
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode("utf-8")).hexdigest()
+
+
+def _parse(source: str, data) -> List[dict]:
+    if source == "xlsx":
+        return read_xlsx(data)
+    return read_csv(data, "\t" if source == "tsv" else None)
+
+
+def refresh_table_stats(note_id, source: Optional[str] = None) -> bool:
+    """Compute (or recompute, if the note changed) a tabular note's statistics.
+    With source=None only notes that already have statistics are considered.
+    Opens its own session so it can run in a worker thread. Returns True if stats were written."""
+    with SessionLocal() as db:
+        row = db.get(NoteTableStats, note_id)
+        source = source or (row.source if row is not None else None)
+        if source is None:
+            return False
+        note = db.get(Note, note_id)
+        data = _source_of(note, source) if note is not None else None
+        if not data:
+            return False
+        digest = _hash_source(data)
+        if row is not None and row.content_hash == digest and row.source == source:
+            return False
+        try:
+            stats = compute_table_stats(_parse(source, data))
+        except Exception as e:
+            print(f"Could not compute table stats for note {note_id}: {e}", flush=True)
+            if row is not None:
+                db.delete(row)
+                db.commit()
+            return False
+        if row is None:
+            row = NoteTableStats(note_id=note_id)
+            db.add(row)
+        row.source = source
+        row.content_hash = digest
+        row.row_count = sum(table["rows"] for table in stats["tables"])
+        row.column_count = sum(len(table["columns"]) for table in stats["tables"])
+        row.stats = json.dumps(stats)
+        db.commit()
+        return True
+
+
+def get_table_stats(db, note_id) -> Optional[dict]:
+    row = db.get(NoteTableStats, note_id)
+    if row is None:
+        return None
+    return {
+        "note_id": str(row.note_id),
+        "source": row.source,
+        "rows": row.row_count,
+        "columns": row.column_count,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        **json.loads(row.stats),
+    }
+
+
+def table_stats_text(db, note_id) -> Optional[str]:
+    """stats_context() for a note, or None if it is not a tabular upload."""
+    row = db.get(NoteTableStats, note_id)
+    return stats_context(json.loads(row.stats)) if row is not None else None
+
+
+def _fmt(x: float) -> str:
+    if math.isnan(x) or math.isinf(x):
+        return str(x)
+    if x == int(x) and abs(x) < 1e15:
+        return f"{int(x):,}" if abs(x) >= 1e6 else str(int(x))
+    return f"{x:,.2f}" if abs(x) >= 1e6 else f"{x:.6g}"
+
+
+def stats_context(stats: dict) -> str:
+    """Compact description of a note's tables for the chat prompt."""
+    lines = []
+    for table in stats["tables"]:
+        name = f" (sheet \"{table['name']}\")" if table["name"] else ""
+        more = " (only the first rows were analysed)" if table["truncated"] else ""
+        lines.append(f"Table{name}: {table['rows']} rows, {len(table['columns'])} columns{more}. Column statistics:")
+        for column in table["columns"][:CONTEXT_MAX_COLUMNS]:
+            missing = f", {column['missing']} missing" if column["missing"] else ""
+            if column["type"] == "number":
+                lines.append(
+                    f"- {column['name']} (number): count {column['count']}{missing}, "
+                    f"mean {_fmt(column['mean'])}, std {_fmt(column['std'])}, min {_fmt(column['min'])}, "
+                    f"p25 {_fmt(column['p25'])}, median {_fmt(column['median'])}, p75 {_fmt(column['p75'])}, "
+                    f"max {_fmt(column['max'])}, sum {_fmt(column['sum'])}, {column['distinct']} distinct"
+                )
+            else:
+                if column["distinct"] == column["count"]:
+                    top = "all values distinct, e.g. " + ", ".join(value for value, _ in column["top"][:3])
+                else:
+                    top = "most common: " + ", ".join(f"{value} ({count})" for value, count in column["top"])
+                lines.append(f"- {column['name']} (text): count {column['count']}{missing}, {column['distinct']} distinct; {top}")
+        hidden = len(table["columns"]) - CONTEXT_MAX_COLUMNS
+        if hidden > 0:
+            lines.append(f"- ... and {hidden} more columns")
+    return "\n".join(lines)
+
+
+def attach_table_stats(relevant_notes: List[dict], db) -> int:
+    """Swap the raw rows of retrieved tabular notes for their column statistics,
+    so the packer puts the statistics in the prompt. Returns how many notes were swapped."""
+    if not relevant_notes:
+        return 0
+    rows = db.query(NoteTableStats).filter(
+        NoteTableStats.note_id.in_([note["note_id"] for note in relevant_notes])
+    ).all()
+    by_note: Dict = {row.note_id: row for row in rows}
+    for note in relevant_notes:
+        row = by_note.get(note["note_id"])
+        if row is None:
+            continue
+        text = stats_context(json.loads(row.stats))
+        score = max((p["score"] for p in note.get("passages", [])), default=note.get("score", 0.0))
+        note["content"] = text
+        note["passages"] = [{"start": 0, "end": len(text), "text": text, "score": score, "similarity": note["similarity"]}]
+        note["table_stats"] = True
+    return len(by_note)
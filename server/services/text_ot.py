@@ -0,0 +1,254 @@
+"""Operational transformation for plain text, in the ot.js operation format.
+
+An operation is a list of components that walks the whole document left to
+right: a positive int keeps that many characters, a negative int deletes that
+many, and a string is inserted. Lengths are counted in UTF-16 code units, as
+JavaScript strings count them, so an operation built in the browser applies
+to the server's copy unchanged (client/src/utils/textOperation.ts is the
+other half).
+"""
+from typing import List, Tuple, Union
+
+Component = Union[int, str]
+
+
+class OperationError(ValueError):
+    """The operation is malformed or does not fit the document it was applied to."""
+
+
+def encode(text: str) -> bytes:
+    return text.encode("utf-16-le", "surrogatepass")
+
+
+def decode(data: bytes) -> str:
+    return data.decode("utf-16-le", "surrogatepass")
+
+
+def utf16_len(text: str) -> int:
+    return len(encode(text)) // 2
+
+
+class _Builder:
+    """Accumulates components in canonical form: merged runs, inserts before deletes."""
+
+    def __init__(self):
+        self.ops: List[Component] = []
+
+    def retain(self, n: int) -> None:
+        if n <= 0:
+            return
+        if self.ops and isinstance(self.ops[-1], int) and self.ops[-1] > 0:
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+
+    def insert(self, text: str) -> None:
+        if not text:
+            return
+        ops = self.ops
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        elif ops and isinstance(ops[-1], int) and ops[-1] < 0:
+            # an insert next to a delete goes first, so equal edits have one spelling
+            if len(ops) > 1 and isinstance(ops[-2], str):
+                ops[-2] += text
+            else:
+                ops.insert(len(ops) - 1, text)
+        else:
+            ops.append(text)
+
+    def delete(self, n: int) -> None:
+        if n <= 0:
+            return
+        if self.ops and isinstance(self.ops[-1], int) and self.ops[-1] < 0:
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+
+
+def normalize(ops) -> List[Component]:
+    """Validate an operation received from a client and return it in canonical form."""
+    if not isinstance(ops, list):
+        raise OperationError("operation must be a list")
+    builder = _Builder()
+    for component in ops:
+        if isinstance(component, bool):
+            raise OperationError("invalid operation component")
+        if isinstance(component, int):
+            if component > 0:
+                builder.retain(component)
+            else:
+                builder.delete(-component)
+        elif isinstance(component, str):
+            builder.insert(component)
+        else:
+            raise OperationError("invalid operation component")
+    return builder.ops
+
+
+def base_length(ops: List[Component]) -> int:
+    """Length of the document the operation applies to."""
+    return sum(abs(c) for c in ops if isinstance(c, int))
+
+
+def target_length(ops: List[Component]) -> int:
+    """Length of the document the operation produces."""
+    return sum(c if isinstance(c, int) else utf16_len(c) for c in ops if not isinstance(c, int) or c > 0)
+
+
+def is_noop(ops: List[Component]) -> bool:
+    return all(isinstance(c, int) and c > 0 for c in ops)
+
+
+def apply_encoded(data: bytes, ops: List[Component]) -> bytes:
+    """apply() on a document kept as UTF-16 bytes, which saves re-encoding it on every keystroke."""
+    if base_length(ops) * 2 != len(data):
+        raise OperationError(f"operation spans {base_length(ops)} characters, document has {len(data) // 2}")
+    parts, pos = [], 0
+    for c in ops:
+        if isinstance(c, str):
+            parts.append(encode(c))
+        elif c > 0:
+            parts.append(data[pos:pos + 2 * c])
+            pos += 2 * c
+        else:
+            pos -= 2 * c
+    return b"".join(parts)
+
+
+def apply(text: str, ops: List[Component]) -> str:
+    return decode(apply_encoded(encode(text), ops))
+
+
+def _components(ops: List[Component]):
+    """Iterator over components with a sentinel None at the end."""
+    yield from ops
+    while True:
+        yield None
+
+
+def _take(c, n: int):
+    """Split n units off the front of a retain or delete: (taken, rest)."""
+    sign = 1 if c > 0 else -1
+    rest = abs(c) - n
+    return sign * n, (sign * rest if rest else None)
+
+
+def transform(a: List[Component], b: List[Component]) -> Tuple[List[Component], List[Component]]:
+    """Given a and b applied to the same document, return (a', b') such that
+    apply(apply(doc, a), b') == apply(apply(doc, b), a'). Inserts of a go first at equal positions."""
+    if base_length(a) != base_length(b):
+        raise OperationError("concurrent operations must apply to the same document")
+    a_prime, b_prime = _Builder(), _Builder()
+    it_a, it_b = _components(a), _components(b)
+    ca, cb = next(it_a), next(it_b)
+    while ca is not None or cb is not None:
+        if isinstance(ca, str):
+            a_prime.insert(ca)
+            b_prime.retain(utf16_len(ca))
+            ca = next(it_a)
+            continue
+        if isinstance(cb, str):
+            a_prime.retain(utf16_len(cb))
+            b_prime.insert(cb)
+            cb = next(it_b)
+            continue
+        if ca is None or cb is None:
+            raise OperationError("concurrent operations must apply to the same document")
+        n = min(abs(ca), abs(cb))
+        take_a, rest_a = _take(ca, n)
+        take_b, rest_b = _take(cb, n)
+        if take_a > 0 and take_b > 0:
+            a_prime.retain(n)
+            b_prime.retain(n)
+        elif take_a < 0 and take_b > 0:
+            a_prime.delete(n)
+        elif take_a > 0 and take_b < 0:
+            b_prime.delete(n)
+        # both deleted the same text: nothing left for either to do
+        ca = rest_a if rest_a is not None else next(it_a)
+        cb = rest_b if rest_b is not None else next(it_b)
+    return a_prime.ops, b_prime.ops
+
+
+def compose(a: List[Component], b: List[Component]) -> List[Component]:
+    """One operation with the effect of a followed by b."""
+    if target_length(a) != base_length(b):
+        raise OperationError("the second operation must apply to the result of the first")
+    out = _Builder()
+    it_a, it_b = _components(a), _components(b)
+    ca, cb = next(it_a), next(it_b)
+    while ca is not None or cb is not None:
+        if isinstance(ca, int) and ca < 0:
+            out.delete(-ca)
+            ca = next(it_a)
+            continue
+        if isinstance(cb, str):
+            out.insert(cb)
+            cb = next(it_b)
+            continue
+        if ca is None or cb is None:
+            raise OperationError("the second operation must apply to the result of the first")
+        if isinstance(ca, str):
+            length = utf16_len(ca)
+            n = min(length, abs(cb))
+            if cb > 0:
+                out.insert(_utf16_slice(ca, 0, n))
+            ca = _utf16_slice(ca, n, length) if n < length else next(it_a)
+            _, rest_b = _take(cb, n)
+            cb = rest_b if rest_b is not None else next(it_b)
+            continue
+        n = min(ca, abs(cb))
+        _, rest_a = _take(ca, n)
+        take_b, rest_b = _take(cb, n)
+        if take_b > 0:
+            out.retain(n)
+        else:
+            out.delete(n)
+        ca = rest_a if rest_a is not None else next(it_a)
+        cb = rest_b if rest_b is not None else next(it_b)
+    return out.ops
+
+
+def _utf16_slice(text: str, start: int, end: int) -> str:
+    return decode(encode(text)[2 * start:2 * end])
+
+
+def _common_prefix(a: bytes, b: bytes) -> int:
+    """Length in bytes of the common prefix (binary search, so the comparisons run in C)."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _is_surrogate(data: bytes, index: int, base: int) -> bool:
+    """Whether code unit `index` is a high (base 0xD800) or low (base 0xDC00) surrogate."""
+    unit = int.from_bytes(data[2 * index:2 * index + 2], "little")
+    return base <= unit < base + 0x400
+
+
+def diff(old: str, new: str) -> List[Component]:
+    """An operation turning old into new: everything between their common prefix and suffix is replaced."""
+    return diff_encoded(encode(old), encode(new))
+
+
+def diff_encoded(a: bytes, b: bytes) -> List[Component]:
+    prefix = _common_prefix(a, b) // 2
+    if prefix and _is_surrogate(a, prefix - 1, 0xD800):
+        # don't end the prefix between the halves of a surrogate pair
+        prefix -= 1
+    # compare whole code units from the end; the suffix may not overlap the prefix
+    suffix = min(_common_prefix(a[::-1], b[::-1]) // 2, min(len(a), len(b)) // 2 - prefix)
+    if suffix and _is_surrogate(a, len(a) // 2 - suffix, 0xDC00):
+        suffix -= 1
+    builder = _Builder()
+    builder.retain(prefix)
+    builder.insert(decode(b[2 * prefix:len(b) - 2 * suffix]))
+    builder.delete(len(a) // 2 - prefix - suffix)
+    builder.retain(suffix)
+    return builder.ops
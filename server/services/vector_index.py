@@ -0,0 +1,227 @@
+import os
+import numpy as np
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+# storage for the in-memory matrix: float32, float16 or int8 (per-row scalar quantization)
+VECTOR_PRECISION = os.getenv("RAG_VECTOR_PRECISION", "int8")
+# quantized scores only shortlist k * RESCORE_FACTOR candidates, which are re-ranked in float32 (0 disables)
+RESCORE_FACTOR = int(os.getenv("RAG_RESCORE_FACTOR", "4"))
+
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# rows converted to float32 per step when scoring a quantized matrix (numpy has no int8/float16 BLAS)
+_SCORE_BLOCK = 1024
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise a vector or the rows of a matrix (zero rows are left as zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Encode float32 rows for storage. int8 uses one symmetric scale per row,
+    returned alongside the codes; other precisions have no scales."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(PRECISIONS[precision]), None
+
+
+class VectorIndex:
+    """Exact cosine-similarity index over one contiguous matrix of unit vectors.
+
+    Scoring a query is a single mat-vec, and top-k selection uses argpartition
+    so only the k winners are sorted. Rows can be upserted and removed in place;
+    the backing matrix grows geometrically and removal swaps in the last row.
+
+    The matrix can be stored as float16 or int8 to cut memory 2-4x. With
+    `keep_full` the original float32 rows are kept aside (normally in a
+    memory-mapped segment file, see services/index_segments.py) and the quantized
+    shortlist is re-ranked against them, which recovers float32 ranking."""
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        precision: str = VECTOR_PRECISION,
+        rescore_factor: int = RESCORE_FACTOR,
+        keep_full: bool = False,
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"unknown vector precision {precision!r}")
+        self.dim = dim
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self.keep_full = keep_full and precision != "float32"
+        self.ids: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._matrix = np.empty((0, dim or 0), dtype=PRECISIONS[precision])
+        self._scales = np.empty(0, dtype=np.float32)
+        # float32 originals: read-only rows (usually an mmap) plus anything upserted since
+        self._full: Optional[np.ndarray] = None
+        self._full_positions: Dict[Hashable, int] = {}
+        self._full_extra: Dict[Hashable, np.ndarray] = {}
+
+    @classmethod
+    def from_vectors(cls, ids: Iterable[Hashable], vectors: Iterable[np.ndarray], dim: Optional[int] = None, **kwargs) -> "VectorIndex":
+        index = cls(dim, **kwargs)
+        index.ids = list(ids)
+        index._positions = {item_id: pos for pos, item_id in enumerate(index.ids)}
+        if index.ids:
+            full = np.ascontiguousarray(normalize(np.vstack(list(vectors))))
+            index._matrix, scales = quantize(full, index.precision)
+            if scales is not None:
+                index._scales = scales
+            index.dim = full.shape[1]
+            if index.keep_full:
+                index._full_extra = dict(zip(index.ids, full))
+        return index
+
+    @classmethod
+    def from_arrays(cls, ids: List[Hashable], matrix: np.ndarray, scales: Optional[np.ndarray] = None,
+                    full: Optional[np.ndarray] = None, **kwargs) -> "VectorIndex":
+        """Wrap already-encoded arrays without copying them, e.g. memory-mapped segment files.
+        They are only copied into RAM if the index is later modified."""
+        index = cls(matrix.shape[1], precision=np.dtype(matrix.dtype).name, keep_full=full is not None, **kwargs)
+        index.ids = list(ids)
+        index._positions = {item_id: pos for pos, item_id in enumerate(index.ids)}
+        index._matrix = matrix
+        if scales is not None:
+            index._scales = scales
+        if index.keep_full:
+            index._full = full
+            index._full_positions = dict(index._positions)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._positions
+
+    @property
+    def nbytes(self) -> int:
+        # the float32 segment rows aren't counted: they stay on disk and only shortlisted rows are read
+        extra = len(self._full_extra) * (self.dim or 0) * 4
+        return self._matrix.nbytes + self._scales.nbytes + extra
+
+    @property
+    def rescoring(self) -> bool:
+        return self.keep_full and self.rescore_factor > 0
+
+    def _ensure_writable(self) -> None:
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix)
+            self._scales = np.array(self._scales)
+
+    def upsert(self, item_id: Hashable, vector: np.ndarray) -> None:
+        vector = normalize(vector)
+        if self.dim is None:
+            self.dim = vector.shape[0]
+            self._matrix = np.empty((0, self.dim), dtype=PRECISIONS[self.precision])
+        self._ensure_writable()
+
+        pos = self._positions.get(item_id)
+        if pos is None:
+            pos = len(self.ids)
+            if pos == self._matrix.shape[0]:
+                capacity = max(16, pos * 2)
+                grown = np.empty((capacity, self.dim), dtype=self._matrix.dtype)
+                grown[:pos] = self._matrix[:pos]
+                self._matrix = grown
+                if self.precision == "int8":
+                    scales = np.empty(capacity, dtype=np.float32)
+                    scales[:pos] = self._scales[:pos]
+                    self._scales = scales
+            self.ids.append(item_id)
+            self._positions[item_id] = pos
+        codes, scales = quantize(vector, self.precision)
+        self._matrix[pos] = codes[0]
+        if scales is not None:
+            self._scales[pos] = scales[0]
+        if self.keep_full:
+            self._full_extra[item_id] = vector
+            self._full_positions.pop(item_id, None)
+
+    def remove(self, item_id: Hashable) -> bool:
+        pos = self._positions.pop(item_id, None)
+        if pos is None:
+            return False
+        self._ensure_writable()
+        last = len(self.ids) - 1
+        if pos != last:
+            moved = self.ids[last]
+            self.ids[pos] = moved
+            self._positions[moved] = pos
+            self._matrix[pos] = self._matrix[last]
+            if self.precision == "int8":
+                self._scales[pos] = self._scales[last]
+        self.ids.pop()
+        self._full_extra.pop(item_id, None)
+        self._full_positions.pop(item_id, None)
+        return True
+
+    def decode(self, positions) -> np.ndarray:
+        """float32 (approximate, for quantized storage) rows at the given positions."""
+        rows = self._matrix[positions].astype(np.float32)
+        if self.precision == "int8":
+            rows *= self._scales[positions][..., None]
+        return rows
+
+    def full_vectors(self, item_ids: List[Hashable]) -> np.ndarray:
+        """Original float32 rows for item_ids (decoded rows where no original is kept)."""
+        out = np.empty((len(item_ids), self.dim), dtype=np.float32)
+        for i, item_id in enumerate(item_ids):
+            vector = self._full_extra.get(item_id)
+            if vector is None:
+                full_pos = self._full_positions.get(item_id)
+                if full_pos is not None:
+                    vector = self._full[full_pos]
+                else:
+                    vector = self.decode(self._positions[item_id])
+            out[i] = vector
+        return out
+
+    def _scores(self, query: np.ndarray, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        n = len(self.ids)
+        if self.precision == "float32":
+            rows = self._matrix[:n] if candidates is None else self._matrix[candidates]
+            return rows @ query
+        total = n if candidates is None else len(candidates)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, _SCORE_BLOCK):
+            stop = min(total, start + _SCORE_BLOCK)
+            positions = slice(start, stop) if candidates is None else candidates[start:stop]
+            scores[start:stop] = self._matrix[positions].astype(np.float32) @ query
+            if self.precision == "int8":
+                scores[start:stop] *= self._scales[positions]
+        return scores
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _search(self, query: np.ndarray, k: int, candidates: Optional[np.ndarray] = None) -> List[Tuple[Hashable, float]]:
+        scores = self._scores(query, candidates)
+        if not self.rescoring:
+            top = self._top(scores, k)
+            positions = top if candidates is None else candidates[top]
+            return [(self.ids[pos], float(scores[i])) for i, pos in zip(top, positions)]
+
+        shortlist = self._top(scores, k * self.rescore_factor)
+        positions = shortlist if candidates is None else candidates[shortlist]
+        item_ids = [self.ids[pos] for pos in positions]
+        exact = self.full_vectors(item_ids) @ query
+        return [(item_ids[i], float(exact[i])) for i in self._top(exact, k)]
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[Hashable, float]]:
+        """Return up to k (id, cosine similarity) pairs, best first."""
+        if not self.ids or k <= 0:
+            return []
+        return self._search(normalize(query), k)
@@ -0,0 +1,313 @@
+"""Hierarchical (map-reduce) digest of a whole workspace.
+
+Notes are the leaves: each contributes its background summary (see
+services/summary_worker.py), or the start of its content while it has none.
+Leaves are grouped into sections, sections into larger groups, and so on up to
+a single workspace summary; every internal node is an LLM summary of its
+children.
+
+Group boundaries are chosen by the items themselves (a new group starts after
+an item whose hash is 0 mod DIGEST_FANOUT), so adding or deleting a note only
+reshapes the group it falls in. Each node is keyed by a hash of everything
+underneath, and a rebuild only summarises nodes whose hash is new: editing
+one note costs one summary per level along its branch.
+
+Rebuilds run in the background, debounced per workspace; questions read the
+last digest that was built.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from models.note import Note
+from models.workspace_digest import WorkspaceDigestNode
+from services.db import SessionLocal
+from services.llm_client import llm_client, LLMSaturated
+
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "true").lower() in ("1", "true", "yes")
+# wait for edits (and the note summaries they trigger) to settle before rebuilding
+DIGEST_DELAY_SECONDS = float(os.getenv("DIGEST_DELAY_SECONDS", "300"))
+# ...but a workspace that never settles is still rebuilt this long after its first change
+DIGEST_MAX_WAIT_SECONDS = float(os.getenv("DIGEST_MAX_WAIT_SECONDS", "1800"))
+# expected children per node; a group is cut at twice this regardless
+DIGEST_FANOUT = int(os.getenv("DIGEST_FANOUT", "8"))
+LEAF_PREVIEW_CHARS = 600
+DIGEST_MODEL = "gpt-4o-mini"
+
+SECTION_PROMPT = """You are building a digest of a user's workspace of notes and documents.
+Combine the summaries below into one summary of at most 150 words.
+Keep concrete facts: numbers, names, dates, decisions, and which document titles they come from (write titles in double quotes).
+Do not add anything that is not in the summaries."""
+
+ROOT_PROMPT = """You are building a digest of a user's workspace of notes and documents.
+The parts below each summarise a group of documents. Write an overview of the whole workspace in at most 200 words:
+the main topics, the kinds of documents, and the most important facts and numbers, naming document titles in double quotes.
+Do not add anything that is not in the parts."""
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _group(items: List[dict]) -> List[List[dict]]:
+    """Split items into consecutive groups of about DIGEST_FANOUT, with content-defined boundaries."""
+    groups, current = [], []
+    for item in items:
+        current.append(item)
+        if int(item["hash"][:8], 16) % DIGEST_FANOUT == 0 or len(current) >= 2 * DIGEST_FANOUT:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _leaves(workspace_id) -> List[dict]:
+    with SessionLocal() as db:
+        rows = (
+            db.query(Note.id, Note.title, Note.summary, func.substr(Note.content, 1, LEAF_PREVIEW_CHARS).label("preview"))
+            .filter(Note.workspace_id == workspace_id)
+            .order_by(Note.created_at, Note.id)
+            .all()
+        )
+    leaves = []
+    for row in rows:
+        text = (row.summary or row.preview or "").strip()
+        leaves.append({
+            "hash": _hash(str(row.id), row.title, text),
+            "text": f"\"{row.title}\": {text}" if text else f"\"{row.title}\" (empty)",
+            "note_ids": [str(row.id)],
+        })
+    return leaves
+
+
+def build_tree(leaves: List[dict]) -> List[List[dict]]:
+    """Levels of the digest tree above the leaves, bottom-up; the last level has one node."""
+    levels = []
+    nodes = leaves
+    while nodes and (not levels or len(nodes) > 1):
+        parents = []
+        for group in _group(nodes):
+            parents.append({
+                "hash": _hash(*(child["hash"] for child in group)),
+                "children": group,
+                "note_ids": [note_id for child in group for note_id in child["note_ids"]],
+            })
+        levels.append(parents)
+        nodes = parents
+    return levels
+
+
+def _existing_summaries(workspace_id) -> Dict[str, str]:
+    with SessionLocal() as db:
+        rows = db.query(WorkspaceDigestNode.node_hash, WorkspaceDigestNode.summary).filter(
+            WorkspaceDigestNode.workspace_id == workspace_id
+        )
+        return {row.node_hash: row.summary for row in rows}
+
+
+def _undigested_workspaces() -> list:
+    with SessionLocal() as db:
+        built = db.query(WorkspaceDigestNode.workspace_id).distinct()
+        rows = db.query(Note.workspace_id).filter(~Note.workspace_id.in_(built)).distinct().all()
+        return [row.workspace_id for row in rows]
+
+
+def _save_tree(workspace_id, levels: List[List[dict]]) -> None:
+    """Make the stored nodes exactly this tree: keep rows whose hash survives, add new ones, drop the rest."""
+    with SessionLocal() as db:
+        stored = {
+            node.node_hash: node
+            for node in db.query(WorkspaceDigestNode).filter(WorkspaceDigestNode.workspace_id == workspace_id)
+        }
+        keep = set()
+        for level_index, level in enumerate(levels, start=1):
+            for position, node in enumerate(level):
+                keep.add(node["hash"])
+                row = stored.get(node["hash"])
+                if row is None:
+                    db.add(WorkspaceDigestNode(
+                        workspace_id=workspace_id,
+                        node_hash=node["hash"],
+                        level=level_index,
+                        position=position,
+                        note_ids=json.dumps(node["note_ids"]),
+                        summary=node["summary"],
+                    ))
+                elif row.level != level_index or row.position != position:
+                    row.level = level_index
+                    row.position = position
+        for node_hash, row in stored.items():
+            if node_hash not in keep:
+                db.delete(row)
+        db.commit()
+
+
+def get_workspace_digest(workspace_id, db) -> Optional[dict]:
+    """The last digest built for the workspace, or None if none has been built yet:
+    {"summary", "note_ids", "sections": [{"summary", "note_ids"}], "levels"}."""
+    rows = (
+        db.query(WorkspaceDigestNode)
+        .filter(WorkspaceDigestNode.workspace_id == workspace_id)
+        .order_by(WorkspaceDigestNode.level, WorkspaceDigestNode.position)
+        .all()
+    )
+    if not rows:
+        return None
+    root = rows[-1]
+    return {
+        "summary": root.summary,
+        "note_ids": json.loads(root.note_ids),
+        # with a single level the root is the only section
+        "sections": [
+            {"summary": row.summary, "note_ids": json.loads(row.note_ids)}
+            for row in rows if row.level == 1
+        ] if root.level > 1 else [],
+        "levels": root.level,
+    }
+
+
+class DigestWorker:
+    """Debounced background rebuilds of workspace digests. schedule() is safe from any thread."""
+
+    def __init__(self):
+        self._due: Dict = {}
+        # workspace_id -> when it was first scheduled since its last rebuild
+        self._first: Dict = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self._stats = {"builds": 0, "nodes_summarised": 0, "nodes_reused": 0, "failed": 0}
+        self._last_error: Optional[str] = None
+
+    def schedule(self, workspace_id, delay: float = DIGEST_DELAY_SECONDS) -> None:
+        if not DIGEST_ENABLED or workspace_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            first = self._first.setdefault(workspace_id, now)
+            self._due[workspace_id] = min(first + DIGEST_MAX_WAIT_SECONDS, now + delay)
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            due = [ws for ws, at in self._due.items() if at <= now]
+            for ws in due:
+                del self._due[ws]
+                del self._first[ws]
+            return due
+
+    def _next_due_in(self) -> Optional[float]:
+        with self._lock:
+            if not self._due:
+                return None
+            return max(0.0, min(self._due.values()) - time.monotonic())
+
+    async def _summarise(self, node: dict, texts: Dict[str, str], root: bool) -> str:
+        # chat requests queued for the LLM come first
+        while llm_client.stats()["waiting"]:
+            await asyncio.sleep(1.0)
+        body = "\n\n".join(f"- {texts[child['hash']]}" for child in node["children"])
+        response = await llm_client.complete(
+            model=DIGEST_MODEL,
+            messages=[
+                {"role": "system", "content": ROOT_PROMPT if root else SECTION_PROMPT},
+                {"role": "user", "content": body},
+            ],
+            max_tokens=320 if root else 240,
+            temperature=0.2,
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def build(self, workspace_id) -> dict:
+        """Bring the stored digest up to date, summarising only nodes whose subtree changed."""
+        leaves = await asyncio.to_thread(_leaves, workspace_id)
+        levels = build_tree(leaves)
+        existing = await asyncio.to_thread(_existing_summaries, workspace_id)
+        texts = {leaf["hash"]: leaf["text"] for leaf in leaves}
+        summarised = reused = 0
+        for level_index, level in enumerate(levels):
+            root = level_index == len(levels) - 1
+            for node in level:
+                if node["hash"] in existing:
+                    node["summary"] = existing[node["hash"]]
+                    reused += 1
+                else:
+                    node["summary"] = await self._summarise(node, texts, root)
+                    summarised += 1
+                texts[node["hash"]] = node["summary"]
+        await asyncio.to_thread(_save_tree, workspace_id, levels)
+        self._stats["builds"] += 1
+        self._stats["nodes_summarised"] += summarised
+        self._stats["nodes_reused"] += reused
+        return {"notes": len(leaves), "levels": len(levels), "summarised": summarised, "reused": reused}
+
+    async def _run(self) -> None:
+        while True:
+            due = self._pop_due()
+            if not due:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_due_in())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for workspace_id in due:
+                try:
+                    result = await self.build(workspace_id)
+                    if result["summarised"]:
+                        print(f"Digest for workspace {workspace_id}: {result}", flush=True)
+                except LLMSaturated:
+                    self.schedule(workspace_id, delay=60)
+                except Exception as e:
+                    self._stats["failed"] += 1
+                    self._last_error = f"workspace {workspace_id}: {e}"
+                    print(f"Digest build failed for workspace {workspace_id}: {e}", flush=True)
+
+    def start(self) -> None:
+        """Start the worker task on the running event loop (call from app startup)."""
+        if self._task is not None or not DIGEST_ENABLED:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print("Digest worker started", flush=True)
+
+    async def backfill(self) -> int:
+        """Schedule every workspace that has notes but no digest yet."""
+        if not DIGEST_ENABLED:
+            return 0
+        try:
+            missing = await asyncio.to_thread(_undigested_workspaces)
+        except Exception as e:
+            print(f"Digest backfill query failed: {e}", flush=True)
+            return 0
+        for workspace_id in missing:
+            self.schedule(workspace_id, delay=0)
+        if missing:
+            print(f"Digest backfill queued {len(missing)} workspaces", flush=True)
+        return len(missing)
+
+    def status(self) -> dict:
+        with self._lock:
+            status = dict(self._stats)
+            status["pending"] = len(self._due)
+        status["running"] = self._task is not None
+        status["last_error"] = self._last_error
+        return status
+
+
+digest_worker = DigestWorker()
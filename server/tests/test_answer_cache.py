@@ -0,0 +1,92 @@
+"""Answer cache vs. note edits: an answer built from text the index is about to replace must not be served.
+
+Run from server/: python -m unittest discover tests
+"""
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="answer-cache-test-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+os.environ["RAG_SEGMENT_DIR"] = ""
+
+import numpy as np
+
+import models  # noqa: F401  (registers the tables)
+from models.note import Note
+from models.workspace import Workspace
+from services import answer_cache as answer_cache_module
+from services import rag_service
+from services.answer_cache import answer_cache
+from services.db import Base, SessionLocal, engine
+from services.indexing_worker import indexing_worker
+
+
+class AnswerCacheEditTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            workspace = Workspace(name="answers")
+            db.add(workspace)
+            db.commit()
+            note = Note(title="Budget", content="The budget is 10k.", workspace_id=workspace.id)
+            db.add(note)
+            db.commit()
+            self.workspace_id, self.note_id = workspace.id, note.id
+        answer_cache._backend = answer_cache_module._MemoryBackend()
+        self.embedding = np.random.default_rng(0).standard_normal(16).astype(np.float32)
+        # indexing is driven by hand; the worker's own queue and the follow-up jobs stay idle
+        patches = [
+            mock.patch("services.indexing_worker.summary_worker"),
+            mock.patch("services.indexing_worker.digest_worker"),
+            mock.patch.object(rag_service, "upsert_note_chunks", return_value=None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def _ask(self, answer: str, asked_at: float):
+        """A question over the note: a cached answer if there is one, else `answer` is stored."""
+        cached = answer_cache.lookup(self.workspace_id, self.embedding, [self.note_id], None)
+        if cached is None:
+            answer_cache.store(self.workspace_id, self.embedding, [self.note_id], None, {"message": answer}, asked_at)
+        return cached
+
+    def test_repeated_question_is_served_from_cache(self):
+        self._ask("10k", time.time())
+        self.assertEqual(self._ask("10k", time.time())["message"], "10k")
+
+    def test_question_between_enqueue_and_refresh_is_not_served_afterwards(self):
+        self._ask("10k", time.time())
+        indexing_worker.enqueue(self.note_id, self.workspace_id)
+        # asked while the index still has the old text: answered (and offered to the cache) from it
+        self.assertIsNone(self._ask("10k", time.time()))
+        self.assertTrue(rag_service.refresh_note_embedding(self.note_id))
+        self.assertIsNone(self._ask("20k", time.time()))
+        self.assertEqual(self._ask("20k", time.time())["message"], "20k")
+
+    def test_answer_finished_after_refresh_is_not_stored(self):
+        indexing_worker.enqueue(self.note_id, self.workspace_id)
+        asked_at = time.time()
+        self.assertIsNone(answer_cache.lookup(self.workspace_id, self.embedding, [self.note_id], None))
+        # the note is re-indexed while the model is still writing the answer
+        self.assertTrue(rag_service.refresh_note_embedding(self.note_id))
+        answer_cache.store(self.workspace_id, self.embedding, [self.note_id], None, {"message": "10k"}, asked_at)
+        self.assertIsNone(answer_cache.lookup(self.workspace_id, self.embedding, [self.note_id], None))
+
+    def test_edit_stamps_expire_with_the_answers(self):
+        backend = answer_cache._backend
+        backend.drop_note("ws", "old")
+        backend._changed["ws"]["old"] -= answer_cache_module.ANSWER_CACHE_TTL
+        backend.drop_note("ws", "new")
+        self.assertEqual(set(backend._changed["ws"]), {"new"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Keyword retrieval: tokenizing, BM25 scoring and reciprocal rank fusion.
+
+Run from server/: python -m unittest discover tests
+"""
+import unittest
+
+from services.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_identifiers_are_kept_whole_and_split(self):
+        self.assertEqual(tokenize("See INV-2024-001"), ["see", "inv-2024-001", "inv", "2024", "001"])
+        self.assertIn("a.b@c.com", tokenize("mail a.b@c.com"))
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add("budget", "The budget for 2024 is ten thousand. Budget review in May.")
+        self.index.add("travel", "Travel plans: flights booked for May, hotel pending.")
+        self.index.add("invoice", "Invoice INV-2024-001 was paid.")
+
+    def test_ranks_by_term_frequency_and_rarity(self):
+        results = self.index.search("budget may", 3)
+        self.assertEqual([doc_id for doc_id, _ in results], ["budget", "travel"])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertGreater(results[1][1], 0)
+
+    def test_finds_a_compound_identifier_by_its_parts(self):
+        self.assertEqual(self.index.search("INV-2024-001", 1)[0][0], "invoice")
+        self.assertEqual(self.index.search("2024", 3)[0][0], "invoice")
+
+    def test_re_adding_replaces_the_document(self):
+        self.index.add("travel", "Nothing about trips any more")
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search("hotel", 3), [])
+        self.assertEqual(self.index.search("trips", 3)[0][0], "travel")
+
+    def test_remove_drops_postings(self):
+        self.assertTrue(self.index.remove("invoice"))
+        self.assertFalse(self.index.remove("invoice"))
+        self.assertNotIn("invoice", self.index)
+        self.assertEqual(self.index.search("paid", 3), [])
+        self.assertNotIn("paid", self.index._postings)
+
+    def test_no_results_for_unknown_terms_or_empty_index(self):
+        self.assertEqual(self.index.search("zebra", 3), [])
+        self.assertEqual(BM25Index().search("budget", 3), [])
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+    def test_items_ranked_well_in_both_lists_win(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+        self.assertEqual([item_id for item_id, _ in fused], ["b", "c", "a", "d"])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+
+    def test_single_ranking_keeps_its_order(self):
+        self.assertEqual([item_id for item_id, _ in reciprocal_rank_fusion([["x", "y"]])], ["x", "y"])
+
+
+if __name__ == "__main__":
+    unittest.main()
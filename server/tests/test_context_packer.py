@@ -0,0 +1,94 @@
+"""Packing retrieved passages into a token budget.
+
+Token counts use the length estimate (about 4 characters per token), so the
+tests don't depend on tiktoken or on downloading its encoding.
+
+Run from server/: python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from services import context_packer
+from services.context_packer import count_tokens, pack_rag_context, pack_summary_context
+
+
+def _note(note_id: str, content: str, passages=(), score: float = 0.5) -> dict:
+    return {
+        "note_id": note_id,
+        "title": note_id.title(),
+        "similarity": score,
+        "score": score,
+        "content": content,
+        "passages": [
+            {"start": start, "end": end, "score": passage_score, "text": content[start:end]}
+            for start, end, passage_score in passages
+        ],
+    }
+
+
+class PackRagContextTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(context_packer, "_get_encoding", return_value=None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_passages_are_laid_out_in_document_order(self):
+        content = "alpha " * 20 + "beta " * 20 + "gamma " * 20
+        note = _note("a", content, [(220, 320, 0.9), (0, 60, 0.8)])
+        packed = pack_rag_context([note], token_budget=500)
+        self.assertEqual(packed["passages"], 2)
+        self.assertLess(packed["context"].index("alpha"), packed["context"].index("gamma"))
+        self.assertLessEqual(packed["tokens_used"], 500)
+
+    def test_overlapping_chunks_are_paid_for_once(self):
+        content = "word " * 100
+        note = _note("a", content, [(0, 300, 0.9), (200, 500, 0.8)])
+        packed = pack_rag_context([note], token_budget=1000)
+        self.assertEqual(packed["context"].count("word"), 100)
+
+    def test_duplicate_text_in_another_note_is_skipped(self):
+        shared = "the same paragraph pasted into two notes"
+        packed = pack_rag_context(
+            [_note("a", shared, [(0, len(shared), 0.9)]), _note("b", shared, [(0, len(shared), 0.8)])],
+            token_budget=1000,
+        )
+        self.assertEqual(packed["notes"], ["a"])
+        self.assertEqual(packed["skipped"], 1)
+
+    def test_a_passage_too_big_is_cut_at_a_word_boundary(self):
+        content = " ".join(f"w{i}" for i in range(400))
+        note = _note("a", content, [(0, len(content), 0.9)])
+        packed = pack_rag_context([note], token_budget=120)
+        self.assertEqual(packed["truncated"], 1)
+        self.assertLessEqual(packed["tokens_used"], 120)
+        body = packed["context"].rsplit("---\n", 1)[1]
+        self.assertTrue(body.endswith("..."))
+        self.assertIn(body[:-3].rsplit(" ", 1)[1], content.split())
+
+    def test_higher_scores_are_packed_first(self):
+        low = _note("low", "x " * 200, [(0, 400, 0.2)], score=0.2)
+        high = _note("high", "y " * 200, [(0, 400, 0.9)], score=0.9)
+        packed = pack_rag_context([low, high], token_budget=150)
+        self.assertEqual(packed["notes"], ["high"])
+
+    def test_empty_budget_packs_nothing(self):
+        packed = pack_rag_context([_note("a", "text", [(0, 4, 0.9)])], token_budget=0)
+        self.assertEqual((packed["context"], packed["notes"]), ("", []))
+
+
+class PackSummaryContextTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(context_packer, "_get_encoding", return_value=None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_uses_summaries_until_the_budget_is_spent(self):
+        notes = [{"note_id": f"n{i}", "title": f"N{i}", "summary": "s" * 200, "content": "c" * 2000} for i in range(10)]
+        packed = pack_summary_context(notes, token_budget=200)
+        self.assertEqual(packed["notes"], ["n0", "n1", "n2"])
+        self.assertNotIn("c" * 10, packed["context"])
+        self.assertEqual(packed["tokens_used"], count_tokens(packed["context"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
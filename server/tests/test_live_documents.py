@@ -0,0 +1,193 @@
+"""Live documents and their update log: logging, replay, compaction and recovery.
+
+The log's Redis is replaced by an in-memory stand-in for the handful of
+commands services/note_log.py sends.
+
+Run from server/: python -m unittest discover tests
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="live-documents-test-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+os.environ["RAG_SEGMENT_DIR"] = ""
+
+import models  # noqa: F401  (registers the tables)
+from models.note import Note
+from models.workspace import Workspace
+from services.db import Base, SessionLocal, engine
+from services.live_documents import LiveDocuments
+from services.note_log import note_log
+from services.text_ot import diff
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    def rpushx(self, key, *values):
+        return self.rpush(key, *values) if key in self.data else 0
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(key, []))
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def scan_iter(self, match, count=None):
+        return [key for key in list(self.data) if key.startswith(match.rstrip("*"))]
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self._calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in self._calls]
+
+
+class LiveDocumentLogTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            workspace = Workspace(name="live")
+            db.add(workspace)
+            db.commit()
+            note = Note(title="Draft", content="hello", workspace_id=workspace.id)
+            db.add(note)
+            db.commit()
+            self.workspace_id, self.note_id = workspace.id, note.id
+        self.redis = _FakeRedis()
+        saved = note_log._redis, note_log._connected, note_log._owner
+        note_log._redis, note_log._connected = self.redis, True
+
+        def restore():
+            note_log._redis, note_log._connected, note_log._owner = saved
+
+        self.addCleanup(restore)
+        self.log_key = f"note_log:{self.note_id}"
+        self.lease_key = f"note_log_lease:{self.note_id}"
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+
+    @staticmethod
+    async def _settle(documents: LiveDocuments) -> None:
+        """Wait for the log writes and loads already started."""
+        while documents._io:
+            await asyncio.wait(set(documents._io.values()))
+
+    def _stored(self) -> tuple:
+        with SessionLocal() as db:
+            note = db.get(Note, self.note_id)
+            return note.content, note.title
+
+    async def _edit(self, documents: LiveDocuments, texts, title=None):
+        doc = await documents.open(self.note_id, self.workspace_id, "editor")
+        for text in texts:
+            self.assertIsNotNone(documents.receive(doc, doc.epoch, doc.revision, diff(doc.content, text)))
+        if title is not None:
+            documents.set_title(doc, title)
+        await self._settle(documents)
+        return doc
+
+    def _restart(self) -> LiveDocuments:
+        """A new process: nothing in memory, and the old one's leases gone with it."""
+        note_log._owner = "restarted"
+        self.redis.delete(self.lease_key)
+        return LiveDocuments()
+
+    async def test_edits_are_logged_and_replayed_after_a_restart(self):
+        doc = await self._edit(LiveDocuments(), ["hello w", "hello wor", "hello world"], title="Greeting")
+        # header plus one entry per update, written in batches
+        self.assertEqual(self.redis.llen(self.log_key), 5)
+        self.assertEqual(self._stored(), ("hello", "Draft"))
+
+        replayed = await self._restart().open(self.note_id, self.workspace_id)
+        self.assertEqual((replayed.content, replayed.title), ("hello world", "Greeting"))
+        self.assertEqual(replayed.revision, doc.revision)
+        self.assertTrue(replayed.dirty)
+
+    async def test_compaction_stores_the_text_and_restarts_the_log(self):
+        documents = LiveDocuments()
+        doc = await self._edit(documents, ["hello there"], title="Note")
+        note = await documents.compact(doc)
+        self.assertEqual((note.content, note.title), ("hello there", "Note"))
+        self.assertFalse(doc.dirty)
+        self.assertEqual(self.redis.llen(self.log_key), 1)
+
+        await self._edit(documents, ["hello there!"])
+        reopened = await self._restart().open(self.note_id, self.workspace_id)
+        self.assertEqual(reopened.content, "hello there!")
+        self.assertEqual(reopened.revision, 1)
+
+    async def test_updates_waiting_for_the_log_are_not_logged_after_a_compaction(self):
+        documents = LiveDocuments()
+        doc = await documents.open(self.note_id, self.workspace_id, "editor")
+        documents.receive(doc, doc.epoch, doc.revision, diff(doc.content, "hello again"))
+        await documents.compact(doc)
+        await self._settle(documents)
+        self.assertEqual(self.redis.llen(self.log_key), 1)
+        self.assertEqual(self._stored()[0], "hello again")
+
+    async def test_a_log_written_against_other_text_is_dropped(self):
+        await self._edit(LiveDocuments(), ["hello world"])
+        with SessionLocal() as db:
+            db.get(Note, self.note_id).content = "rewritten"
+            db.commit()
+        reopened = await self._restart().open(self.note_id, self.workspace_id)
+        self.assertEqual(reopened.content, "rewritten")
+        self.assertFalse(reopened.dirty)
+
+    async def test_recover_compacts_logs_nobody_holds(self):
+        await self._edit(LiveDocuments(), ["hello world"], title="Recovered")
+        documents = self._restart()
+        self.assertEqual(await documents.recover(), [(self.note_id, self.workspace_id)])
+        self.assertEqual(self._stored(), ("hello world", "Recovered"))
+        self.assertNotIn(self.log_key, self.redis.data)
+
+    async def test_logs_held_by_a_running_process_are_not_recovered(self):
+        await self._edit(LiveDocuments(), ["hello world"])
+        note_log._owner = "another process"
+        self.assertEqual(await LiveDocuments().recover(), [])
+        self.assertEqual(self._stored()[0], "hello")
+        self.assertEqual(self.redis.llen(self.log_key), 2)
+
+    async def test_concurrent_opens_share_one_document(self):
+        documents = LiveDocuments()
+        docs = await asyncio.gather(*[
+            documents.open(self.note_id, self.workspace_id, f"editor-{i}") for i in range(4)
+        ])
+        self.assertEqual(len({id(doc) for doc in docs}), 1)
+        self.assertEqual(len(docs[0].editors), 4)
+        self.assertIsNone(await documents.open(self.note_id, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
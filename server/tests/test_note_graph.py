@@ -0,0 +1,136 @@
+"""Related-note lists: incremental updates as notes are re-embedded and deleted.
+
+Run from server/: python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="note-graph-test-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+os.environ["RAG_SEGMENT_DIR"] = ""
+
+import models  # noqa: F401  (registers the tables)
+from models.note import Note
+from models.note_embedding import NoteEmbedding
+from models.note_neighbors import NoteNeighbors
+from models.workspace import Workspace
+from services import note_graph
+from services.db import Base, SessionLocal, engine
+from services.embedding_model import EMBEDDING_MODEL_NAME
+
+
+class NoteGraphTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            workspace = Workspace(name="graph")
+            db.add(workspace)
+            db.commit()
+            notes = {name: Note(title=name, content=name, workspace_id=workspace.id) for name in "abcd"}
+            db.add_all(notes.values())
+            db.commit()
+            self.ids = {name: note.id for name, note in notes.items()}
+            self.workspace_id = workspace.id
+        for name in "abcd":
+            self._embed(name, "v1")
+        # pairwise similarities standing in for the vector search
+        self.similarity = {
+            frozenset("ab"): 0.9, frozenset("ac"): 0.8, frozenset("ad"): 0.4,
+            frozenset("bc"): 0.7, frozenset("bd"): 0.5, frozenset("cd"): 0.6,
+        }
+        patches = [
+            mock.patch.object(note_graph, "NOTE_GRAPH_K", 2),
+            mock.patch.object(note_graph, "similar_notes", side_effect=self._similar_notes),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def _embed(self, name: str, content_hash: str) -> None:
+        with SessionLocal() as db:
+            db.query(NoteEmbedding).filter(NoteEmbedding.note_id == self.ids[name]).delete()
+            db.add(NoteEmbedding(
+                note_id=self.ids[name], workspace_id=self.workspace_id, char_start=0, char_end=1,
+                content_hash=content_hash, model_name=EMBEDDING_MODEL_NAME, dim=1, vector=b"\0\0\0\0",
+            ))
+            db.commit()
+
+    def _similar_notes(self, workspace_id, note_id, db, k):
+        name = self._name(note_id)
+        with SessionLocal() as session:
+            alive = {row.id for row in session.query(Note.id)}
+        scores = [
+            (self.ids[other], self.similarity[frozenset(name + other)])
+            for other in "abcd" if other != name and self.ids[other] in alive
+        ]
+        return sorted(scores, key=lambda item: -item[1])[:k]
+
+    def _name(self, note_id) -> str:
+        return next(name for name, other_id in self.ids.items() if str(other_id) == str(note_id))
+
+    def _neighbors(self, name: str) -> list:
+        with SessionLocal() as db:
+            row = db.get(NoteNeighbors, self.ids[name])
+            return [self._name(note_id) for note_id in note_graph._load(row)] if row else None
+
+    def _build(self) -> None:
+        for name in "abcd":
+            note_graph.update_note(self.ids[name])
+
+    def test_lists_hold_the_k_most_similar_notes_best_first(self):
+        self._build()
+        self.assertEqual(self._neighbors("a"), ["b", "c"])
+        self.assertEqual(self._neighbors("d"), ["c", "b"])
+
+    def test_a_new_neighbour_is_merged_into_the_other_ends_list(self):
+        note_graph.update_note(self.ids["d"])
+        note_graph.update_note(self.ids["c"])
+        # c's update put it in d's list straight away
+        self.assertIn("c", self._neighbors("d"))
+
+    def test_unchanged_embeddings_are_skipped(self):
+        self._build()
+        with mock.patch.object(note_graph, "_store") as store:
+            self.assertEqual(note_graph.update_note(self.ids["a"]), [])
+            store.assert_not_called()
+
+    def test_a_note_that_moves_away_leaves_lists_to_recompute(self):
+        self._build()
+        self.similarity.update({frozenset("ac"): 0.1, frozenset("bc"): 0.1})
+        self._embed("c", "v2")
+        recompute = note_graph.update_note(self.ids["c"])
+        self.assertEqual(self._neighbors("a"), ["b"])
+        self.assertIn(self.ids["a"], recompute)
+        for note_id in recompute:
+            note_graph.update_note(note_id, force=True)
+        self.assertEqual(self._neighbors("a"), ["b", "d"])
+
+    def test_remove_note_drops_it_from_every_list(self):
+        self._build()
+        with SessionLocal() as db:
+            db.delete(db.get(Note, self.ids["b"]))
+            db.commit()
+        holders = note_graph.remove_note(self.ids["b"])
+        self.assertEqual({self._name(note_id) for note_id in holders}, {"a", "c", "d"})
+        for name in "acd":
+            self.assertNotIn("b", self._neighbors(name))
+        for note_id in holders:
+            note_graph.update_note(note_id, force=True)
+        self.assertEqual(self._neighbors("a"), ["c", "d"])
+
+    def test_a_note_without_embeddings_loses_its_list(self):
+        self._build()
+        with SessionLocal() as db:
+            db.query(NoteEmbedding).filter(NoteEmbedding.note_id == self.ids["d"]).delete()
+            db.commit()
+        self.assertEqual(note_graph.update_note(self.ids["d"]), [])
+        self.assertIsNone(self._neighbors("d"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Column statistics for tabular notes.
+
+Run from server/: python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="table-stats-test-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+
+from services.table_stats import column_stats, compute_table_stats, read_csv
+
+
+class TableStatsTest(unittest.TestCase):
+    def test_csv_header_and_column_types(self):
+        tables = read_csv("name,amount,when\nrent,\"$1,200\",2024-01\nfood,300.50,2024-02\nfun,,2024-03\n")
+        self.assertEqual(len(tables), 1)
+        self.assertEqual(tables[0]["rows"], 3)
+        columns = {column["name"]: column for column in compute_table_stats(tables)["tables"][0]["columns"]}
+        self.assertEqual(columns["name"]["type"], "text")
+        amount = columns["amount"]
+        self.assertEqual((amount["type"], amount["count"], amount["missing"]), ("number", 2, 1))
+        self.assertAlmostEqual(amount["sum"], 1500.5)
+        self.assertEqual(columns["when"]["type"], "text")
+
+    def test_a_numeric_first_row_is_data(self):
+        tables = read_csv("1,2\n3,4\n")
+        self.assertEqual(tables[0]["rows"], 2)
+        self.assertEqual([name for name, _ in tables[0]["columns"]], ["column_1", "column_2"])
+
+    def test_a_few_words_in_a_numeric_column_are_counted_out(self):
+        stats = column_stats("score", [str(i) for i in range(19)] + ["n/a"])
+        self.assertEqual((stats["type"], stats["non_numeric"], stats["max"]), ("number", 1, 18.0))
+
+    def test_nan_and_infinity_are_not_numbers(self):
+        stats = column_stats("x", [str(i) for i in range(95)] + ["inf", "-Infinity", "nan", "NaN", "inf"])
+        self.assertEqual((stats["type"], stats["non_numeric"], stats["max"]), ("number", 5, 94.0))
+        self.assertEqual(column_stats("x", ["nan", "inf", float("nan")])["type"], "text")
+        self.assertEqual(column_stats("x", [1.0, float("inf"), float("nan")])["type"], "text")
+
+    def test_mostly_text_column_lists_its_top_values(self):
+        stats = column_stats("city", ["Paris", "Rome", "Paris", "12"])
+        self.assertEqual(stats["type"], "text")
+        self.assertEqual(stats["top"][0], ["Paris", 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Text operations: applying, transforming, composing and diffing in UTF-16 units.
+
+Run from server/: python -m unittest discover tests
+"""
+import random
+import unittest
+
+from services.text_ot import (
+    OperationError,
+    apply,
+    compose,
+    diff,
+    is_noop,
+    normalize,
+    transform,
+    utf16_len,
+)
+
+
+def _random_op(rng: random.Random, text: str) -> list:
+    """A random edit of text, as the diff of text and an edited copy."""
+    chars = list(text)
+    for _ in range(rng.randint(1, 3)):
+        pos = rng.randint(0, len(chars))
+        if chars and rng.random() < 0.4:
+            del chars[pos:pos + rng.randint(1, 3)]
+        else:
+            chars[pos:pos] = rng.choice(["a", "bc", "é", "😀", "\n"])
+    return diff(text, "".join(chars))
+
+
+class TextOperationTest(unittest.TestCase):
+    def test_apply_retains_inserts_and_deletes(self):
+        self.assertEqual(apply("hello world", [6, "there ", -5]), "hello there ")
+
+    def test_lengths_count_utf16_units(self):
+        self.assertEqual(utf16_len("a😀"), 3)
+        # the emoji is two units, so retaining three keeps it whole
+        self.assertEqual(apply("a😀b", [3, "!", -1]), "a😀!")
+
+    def test_apply_rejects_an_operation_for_another_length(self):
+        with self.assertRaises(OperationError):
+            apply("abc", [2, "x"])
+
+    def test_normalize_merges_runs_and_puts_inserts_before_deletes(self):
+        self.assertEqual(normalize([1, 2, -1, "a", "b", -1]), [3, "ab", -2])
+        self.assertTrue(is_noop(normalize([2, 3])))
+
+    def test_normalize_rejects_malformed_operations(self):
+        for ops in ("abc", [1.5], [True], [None]):
+            with self.assertRaises(OperationError):
+                normalize(ops)
+
+    def test_transform_converges(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            doc = "".join(rng.choice("ab😀 ") for _ in range(rng.randint(0, 12)))
+            a, b = _random_op(rng, doc), _random_op(rng, doc)
+            a_prime, b_prime = transform(a, b)
+            self.assertEqual(apply(apply(doc, a), b_prime), apply(apply(doc, b), a_prime))
+
+    def test_transform_puts_the_first_operations_insert_first(self):
+        a_prime, b_prime = transform(["x", 2], ["y", 2])
+        self.assertEqual(apply(apply("ab", ["x", 2]), b_prime), "xyab")
+        self.assertEqual(apply(apply("ab", ["y", 2]), a_prime), "xyab")
+
+    def test_concurrent_deletes_of_the_same_text_apply_once(self):
+        a_prime, b_prime = transform([1, -2, 1], [1, -2, 1])
+        self.assertEqual(apply("abcd", compose([1, -2, 1], b_prime)), "ad")
+        self.assertTrue(is_noop(a_prime))
+
+    def test_compose_matches_applying_in_turn(self):
+        rng = random.Random(11)
+        for _ in range(200):
+            doc = "".join(rng.choice("xy😀") for _ in range(rng.randint(0, 10)))
+            a = _random_op(rng, doc)
+            b = _random_op(rng, apply(doc, a))
+            self.assertEqual(apply(doc, compose(a, b)), apply(apply(doc, a), b))
+
+    def test_diff_never_splits_a_surrogate_pair(self):
+        old, new = "x😀y", "x😃y"
+        ops = diff(old, new)
+        self.assertEqual(apply(old, ops), new)
+        self.assertIn("😃", ops)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Vector search: exact and quantized VectorIndex, and the IVF index built on it.
+
+Run from server/: python -m unittest discover tests
+"""
+import unittest
+
+import numpy as np
+
+from services.ann_index import IVFVectorIndex
+from services.vector_index import VectorIndex, normalize, quantize
+
+
+def _vectors(n: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def _exact(vectors: np.ndarray, query: np.ndarray, k: int) -> list:
+    scores = normalize(vectors) @ normalize(query)
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+class VectorIndexTest(unittest.TestCase):
+    def test_float32_search_is_exact(self):
+        vectors = _vectors(200)
+        index = VectorIndex.from_vectors(range(200), vectors, precision="float32")
+        query = _vectors(1, seed=1)[0]
+        results = index.search(query, 10)
+        self.assertEqual([item_id for item_id, _ in results], _exact(vectors, query, 10))
+        self.assertAlmostEqual(results[0][1], float(normalize(vectors[results[0][0]]) @ normalize(query)), places=5)
+
+    def test_int8_codes_decode_close_to_the_originals(self):
+        vectors = normalize(_vectors(50))
+        codes, scales = quantize(vectors, "int8")
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertLess(np.abs(codes * scales[:, None] - vectors).max(), 0.01)
+
+    def test_quantized_search_with_rescoring_matches_float32(self):
+        vectors = _vectors(300)
+        query = _vectors(1, seed=2)[0]
+        for precision in ("int8", "float16"):
+            index = VectorIndex.from_vectors(range(300), vectors, precision=precision, keep_full=True, rescore_factor=4)
+            self.assertTrue(index.rescoring)
+            self.assertEqual([item_id for item_id, _ in index.search(query, 5)], _exact(vectors, query, 5))
+
+    def test_upsert_replaces_and_remove_swaps_in_the_last_row(self):
+        vectors = _vectors(20)
+        index = VectorIndex(precision="float32")
+        for i, vector in enumerate(vectors):
+            index.upsert(f"n{i}", vector)
+        index.upsert("n3", vectors[7])
+        self.assertEqual(len(index), 20)
+        self.assertEqual({item_id for item_id, _ in index.search(vectors[7], 2)}, {"n3", "n7"})
+
+        self.assertTrue(index.remove("n0"))
+        self.assertFalse(index.remove("n0"))
+        self.assertNotIn("n0", index)
+        self.assertEqual(index.search(vectors[19], 1)[0][0], "n19")
+        self.assertNotIn("n0", [item_id for item_id, _ in index.search(vectors[0], 20)])
+
+    def test_from_arrays_copies_read_only_arrays_before_writing(self):
+        source = VectorIndex.from_vectors(range(10), _vectors(10), precision="int8")
+        matrix, scales = source._matrix.copy(), source._scales.copy()
+        matrix.flags.writeable = False
+        index = VectorIndex.from_arrays(list(range(10)), matrix, scales)
+        index.upsert(10, _vectors(1, seed=3)[0])
+        index.remove(0)
+        self.assertEqual(len(index), 10)
+        self.assertFalse(matrix.flags.writeable)
+
+    def test_empty_index_and_non_positive_k_return_nothing(self):
+        self.assertEqual(VectorIndex().search(_vectors(1)[0], 5), [])
+        index = VectorIndex.from_vectors(range(3), _vectors(3))
+        self.assertEqual(index.search(_vectors(1)[0], 0), [])
+
+
+class IVFVectorIndexTest(unittest.TestCase):
+    def test_search_is_exact_below_the_threshold(self):
+        vectors = _vectors(100)
+        index = IVFVectorIndex.from_vectors(range(100), vectors, threshold=1000, precision="float32")
+        self.assertFalse(index.is_trained)
+        query = _vectors(1, seed=4)[0]
+        self.assertEqual([item_id for item_id, _ in index.search(query, 5)], _exact(vectors, query, 5))
+
+    def test_trained_index_finds_stored_vectors(self):
+        vectors = _vectors(2000)
+        index = IVFVectorIndex.from_vectors(range(2000), vectors, threshold=500, nprobe=4, precision="float32")
+        self.assertTrue(index.is_trained)
+        hits = sum(index.search(vectors[i], 1)[0][0] == i for i in range(0, 2000, 40))
+        self.assertEqual(hits, 50)
+
+    def test_probing_every_cluster_is_exact(self):
+        vectors = _vectors(1500)
+        index = IVFVectorIndex.from_vectors(range(1500), vectors, threshold=500, precision="float32")
+        query = _vectors(1, seed=5)[0]
+        results = index.search(query, 10, nprobe=len(index._centroids))
+        self.assertEqual([item_id for item_id, _ in results], _exact(vectors, query, 10))
+
+    def test_upserts_and_removes_keep_cluster_assignments(self):
+        vectors = _vectors(1200)
+        index = IVFVectorIndex.from_vectors(range(1000), vectors[:1000], threshold=500, nprobe=8, precision="float32")
+        for i in range(1000, 1200):
+            index.upsert(i, vectors[i])
+        for i in range(0, 100):
+            index.remove(i)
+        self.assertEqual(len(index), 1100)
+        for i in (150, 999, 1100, 1199):
+            self.assertEqual(index.search(vectors[i], 1)[0][0], i)
+        self.assertNotIn(5, [item_id for item_id, _ in index.search(vectors[5], 10)])
+
+    def test_retrains_once_it_doubles(self):
+        vectors = _vectors(1100)
+        index = IVFVectorIndex.from_vectors(range(500), vectors[:500], threshold=500, precision="float32")
+        self.assertEqual(index._trained_size, 500)
+        for i in range(500, 1001):
+            index.upsert(i, vectors[i])
+        self.assertEqual(index._trained_size, 1001)
+
+
+if __name__ == "__main__":
+    unittest.main()